@@ -0,0 +1,91 @@
+"""
+Latency Histogram
+HDR-style log-linear histogram for recording client-side latencies
+"""
+
+import math
+
+# Latencies are recorded as integer microseconds
+UNIT = 1e-6
+
+
+class LatencyHistogram:
+    """Log-linear histogram with a fixed number of significant digits
+
+    Values below 2 * 10^digits are counted exactly. Above that every power
+    of two is split into the same number of linear sub-buckets, so the
+    relative error of any recorded value stays below 10^-digits while the
+    memory used only grows with the logarithm of the largest value.
+    """
+
+    def __init__(self, significant_digits=2):
+        self.significant_digits = significant_digits
+        self.sub_bucket_bits = math.ceil(math.log2(2 * 10 ** significant_digits))
+        self.sub_bucket_count = 1 << self.sub_bucket_bits
+        self.sub_bucket_half = self.sub_bucket_count >> 1
+        self.counts = [0] * self.sub_bucket_count
+        self.total = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = 0
+
+    def _index(self, value):
+        if value < self.sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return (self.sub_bucket_count + (shift - 1) * self.sub_bucket_half
+                + (value >> shift) - self.sub_bucket_half)
+
+    def _highest_equivalent(self, index):
+        """Largest value that maps to the same bucket as index"""
+        if index < self.sub_bucket_count:
+            return index
+        offset = index - self.sub_bucket_count
+        shift = offset // self.sub_bucket_half + 1
+        sub = offset % self.sub_bucket_half + self.sub_bucket_half
+        return ((sub + 1) << shift) - 1
+
+    def record(self, seconds):
+        value = max(0, int(seconds / UNIT))
+        index = self._index(value)
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += 1
+        self.total += 1
+        self.sum += seconds
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.total += other.total
+        self.sum += other.sum
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """Latency in seconds at the given percentile (0-100)"""
+        if not self.total:
+            return 0.0
+        target = max(1, math.ceil(self.total * percent / 100.0))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self._highest_equivalent(index), self.max) * UNIT
+        return self.max * UNIT
+
+    def count_at_or_below(self, seconds):
+        """Number of recorded values that are <= seconds (bucket resolution)"""
+        limit = self._index(max(0, int(seconds / UNIT)))
+        return sum(self.counts[:limit + 1])
+
+    def mean(self):
+        return self.sum / self.total if self.total else 0.0
@@ -1,29 +1,247 @@
-import requests
-import time
+"""
+Load Generator
+Open-loop HTTP load generator with pooled keep-alive connections.
+
+Every URL gets its own arrival schedule (constant, poisson or ramp) that is
+independent of how fast responses come back, so a slow endpoint shows up as
+latency instead of silently lowering the request rate. Latency is measured
+from the time a request was *scheduled* to be sent, which keeps queueing
+delay inside the numbers (no coordinated omission).
+
+With REPLAY_TRACE set it replays captured traffic instead (replay.py).
+"""
+
+import asyncio
 import os
 import random
-import threading
+import signal
+from collections import defaultdict
+
+import aiohttp
+from prometheus_client import start_http_server, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
 
+from latency_histogram import LatencyHistogram
+
+# Configuration
 TARGET_URLS = os.environ.get('TARGET_URLS', 'http://nginx').split(',')
 REQUEST_INTERVAL = int(os.environ.get('REQUEST_INTERVAL', '5'))
+# Per URL; derived from REQUEST_INTERVAL only when that is positive, otherwise TARGET_RPS has to be set
+TARGET_RPS = float(os.environ.get('TARGET_RPS', 1.0 / REQUEST_INTERVAL if REQUEST_INTERVAL > 0 else 0.0))
+ARRIVAL_PATTERN = os.environ.get('ARRIVAL_PATTERN', 'poisson')  # constant | poisson | ramp
+RAMP_START_RPS = float(os.environ.get('RAMP_START_RPS', '1'))
+RAMP_SECONDS = float(os.environ.get('RAMP_SECONDS', '60'))
+DURATION = float(os.environ.get('DURATION', '0'))  # seconds, 0 = run until stopped
+MAX_IN_FLIGHT = int(os.environ.get('MAX_IN_FLIGHT', '5000'))
+MAX_CONNECTIONS = int(os.environ.get('MAX_CONNECTIONS', '1000'))
+REQUEST_TIMEOUT = float(os.environ.get('REQUEST_TIMEOUT', '5'))
+POST_RATIO = float(os.environ.get('POST_RATIO', '0.3'))
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '9600'))  # 0 disables the exporter
+REPORT_INTERVAL = float(os.environ.get('REPORT_INTERVAL', '30'))
+SEED = os.environ.get('LOADGEN_SEED')
+
+ARRIVAL_PATTERNS = ('constant', 'poisson', 'ramp')
+EXPORT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SUMMARY_PERCENTILES = (50, 99, 99.9)
+
+
+class URLStats:
+    """Latency histograms and status counts for one target URL"""
 
-def make_requests():
+    def __init__(self, url):
+        self.url = url
+        self.response_time = LatencyHistogram()  # from scheduled send time
+        self.service_time = LatencyHistogram()   # from actual send time
+        self.statuses = defaultdict(int)
+        self.dropped = 0
+
+    def record(self, status, response_time, service_time):
+        self.statuses[str(status)] += 1
+        self.response_time.record(response_time)
+        self.service_time.record(service_time)
+
+
+def arrival_offsets(pattern, rate, rng):
+    """Yield send times in seconds since start for one URL"""
+    t = 0.0
     while True:
-        for url in TARGET_URLS:
+        if pattern == 'constant':
+            t += 1.0 / rate
+        elif pattern == 'poisson':
+            t += rng.expovariate(rate)
+        else:
+            progress = min(1.0, t / RAMP_SECONDS) if RAMP_SECONDS > 0 else 1.0
+            current = RAMP_START_RPS + (rate - RAMP_START_RPS) * progress
+            t += 1.0 / max(current, 1e-3)
+        yield t
+
+
+class LoadGenerator:
+    def __init__(self, urls, rate, pattern=ARRIVAL_PATTERN, duration=DURATION, rng=None):
+        if pattern not in ARRIVAL_PATTERNS:
+            raise ValueError(f"Unknown ARRIVAL_PATTERN {pattern!r}, expected one of {ARRIVAL_PATTERNS}")
+        if rate <= 0:
+            raise ValueError(f"TARGET_RPS must be positive, got {rate:g} (without it the rate is one request "
+                             f"every REQUEST_INTERVAL seconds, which then has to be positive)")
+        self.urls = urls
+        self.rate = rate
+        self.pattern = pattern
+        self.duration = duration
+        self.rng = rng or random.Random()
+        self.stats = {url: URLStats(url) for url in urls}
+        self.in_flight = 0
+        self.session = None
+        self.start = None
+        self._tasks = set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS, keepalive_timeout=30, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            self.session = session
+            self.start = loop.time()
+            schedulers = [asyncio.create_task(scheduler) for scheduler in self.schedulers()]
+            reporter = asyncio.create_task(self._report_loop())
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, lambda: [task.cancel() for task in schedulers])
             try:
-                response = requests.get(url, timeout=5)
-                print(f"Request to {url}: {response.status_code}")
-                
-                # Occasionally make POST requests
-                if 'inference' in url and random.random() < 0.3:
-                    response = requests.post(url, json={})
-                    print(f"POST to {url}: {response.status_code}")
-                    
-            except Exception as e:
-                print(f"Error requesting {url}: {e}")
-        
-        time.sleep(REQUEST_INTERVAL + random.uniform(-1, 1))
+                await asyncio.gather(*schedulers, return_exceptions=True)
+            finally:
+                reporter.cancel()
+                # Let requests that were already sent finish before summarising
+                if self._tasks:
+                    await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def schedulers(self):
+        """Coroutines that send the requests, one per URL"""
+        return [self._schedule(url) for url in self.urls]
+
+    async def _schedule(self, url):
+        loop = asyncio.get_running_loop()
+        stats = self.stats[url]
+        for offset in arrival_offsets(self.pattern, self.rate, self.rng):
+            if self.duration and offset > self.duration:
+                break
+            intended = self.start + offset
+            delay = intended - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.in_flight >= MAX_IN_FLIGHT:
+                stats.dropped += 1
+                continue
+            method = 'POST' if 'inference' in url and self.rng.random() < POST_RATIO else 'GET'
+            body = {} if method == 'POST' else None
+            self.spawn(self.send(method, url, intended, stats, body))
+
+    def spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def send(self, method, url, intended, stats, body=None, data=None, headers=None):
+        """Send one request and record its latency against the scheduled time"""
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        sent = loop.time()
+        try:
+            async with self.session.request(method, url, json=body, data=data, headers=headers) as response:
+                await response.read()
+                status = response.status
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            status = 'error'
+        finally:
+            self.in_flight -= 1
+        done = loop.time()
+        stats.record(status, done - intended, done - sent)
+
+    async def _report_loop(self):
+        previous = {}
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            report(self.stats, previous, self.in_flight)
+
+    def print_summary(self):
+        print_summary(self.stats)
+
+
+def report(stats_by_url, previous, in_flight):
+    """Print each URL's request rate since the last report"""
+    for url, stats in list(stats_by_url.items()):
+        total = stats.response_time.total
+        rps = (total - previous.get(url, 0)) / REPORT_INTERVAL
+        previous[url] = total
+        print(f"{url}: {rps:.1f} req/s, p99 {stats.response_time.percentile(99) * 1000:.1f}ms, "
+              f"in flight {in_flight}, dropped {stats.dropped}")
+
+
+def print_summary(stats_by_url):
+    header = f"{'url':<45} {'count':>8} {'errors':>7} {'dropped':>8}"
+    header += ''.join(f" {'p' + format(p, 'g'):>9}" for p in SUMMARY_PERCENTILES) + f" {'max':>9}"
+    print("\n=== Latency summary (ms, from scheduled send time) ===")
+    print(header)
+    for url, stats in stats_by_url.items():
+        hist = stats.response_time
+        errors = sum(count for status, count in stats.statuses.items()
+                     if status == 'error' or status.startswith('5'))
+        line = f"{url:<45} {hist.total:>8} {errors:>7} {stats.dropped:>8}"
+        line += ''.join(f" {hist.percentile(p) * 1000:>9.1f}" for p in SUMMARY_PERCENTILES)
+        line += f" {hist.max / 1000:>9.1f}"
+        print(line)
+
+
+class LoadGeneratorCollector:
+    """Expose client-side latency histograms as Prometheus metrics"""
+
+    def __init__(self, generator):
+        self.generator = generator
+
+    def collect(self):
+        requests = CounterMetricFamily('loadgen_requests', 'Requests completed by the load generator',
+                                       labels=['url', 'status'])
+        dropped = CounterMetricFamily('loadgen_requests_dropped', 'Requests skipped because MAX_IN_FLIGHT was reached',
+                                      labels=['url'])
+        latency = HistogramMetricFamily('loadgen_response_time_seconds',
+                                        'Client-side latency measured from the scheduled send time',
+                                        labels=['url'])
+        quantiles = GaugeMetricFamily('loadgen_response_time_quantile_seconds',
+                                      'Client-side latency percentiles from the HDR histogram',
+                                      labels=['url', 'quantile'])
+        for url, stats in list(self.generator.stats.items()):
+            for status, count in list(stats.statuses.items()):
+                requests.add_metric([url, status], count)
+            dropped.add_metric([url], stats.dropped)
+            hist = stats.response_time
+            buckets = [(str(bound), hist.count_at_or_below(bound)) for bound in EXPORT_BUCKETS]
+            buckets.append(('+Inf', hist.total))
+            latency.add_metric([url], buckets, hist.sum)
+            for p in SUMMARY_PERCENTILES:
+                quantiles.add_metric([url, str(p / 100)], hist.percentile(p))
+        yield requests
+        yield dropped
+        yield latency
+        yield quantiles
+        yield GaugeMetricFamily('loadgen_in_flight_requests', 'Requests currently in flight',
+                                value=self.generator.in_flight)
+
+
+async def main():
+    rng = random.Random(int(SEED)) if SEED is not None else random.Random()
+    generator = LoadGenerator(TARGET_URLS, TARGET_RPS, rng=rng)
+    if METRICS_PORT:
+        REGISTRY.register(LoadGeneratorCollector(generator))
+        start_http_server(METRICS_PORT)
+    try:
+        await generator.run()
+    finally:
+        generator.print_summary()
+
 
 if __name__ == "__main__":
-    print(f"Starting load generator for URLs: {TARGET_URLS}")
-    make_requests()
+    if os.environ.get('REPLAY_TRACE'):
+        import replay
+        replay.main()
+    else:
+        print(f"Starting load generator for URLs: {TARGET_URLS} "
+              f"({ARRIVAL_PATTERN}, {TARGET_RPS:g} req/s per URL)")
+        asyncio.run(main())
@@ -0,0 +1,269 @@
+"""
+Trace Replay
+Replays request traces captured by python-app (TRACE_CAPTURE_FILE) against
+a target, keeping the original gaps between requests.
+
+Every worker process memory-maps the traces (common/tracefile.py), sorts
+their requests by arrival and takes every REPLAY_WORKERS-th one, so the
+workers together send the whole trace with its timing intact while the
+sending is spread over several cores. REPLAY_SPEED divides the gaps (1 is
+real time, 10 ten times faster); `max` drops them and sends as fast as
+MAX_IN_FLIGHT allows. Latency is measured from each request's scheduled
+time, as in the open-loop mode.
+
+Workers send their per-URL stats to the parent every second; the parent
+merges them for the exporter, the periodic report and the final summary.
+A worker whose parent has gone away stops replaying at the next snapshot.
+Traces hold method, path and body but no headers, so bodies are sent as
+JSON.
+"""
+
+import asyncio
+import glob
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+
+from multiprocessing.connection import wait
+
+from prometheus_client import REGISTRY, start_http_server
+
+from load_generator import (
+    METRICS_PORT, MAX_IN_FLIGHT, REPORT_INTERVAL, LoadGenerator, LoadGeneratorCollector, URLStats, print_summary,
+    report,
+)
+
+# Shared modules live in common/ (copied to /opt/common in the image)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+
+from tracefile import TraceReader, merged_order
+
+REPLAY_TRACE = os.environ.get('REPLAY_TRACE', '')  # file or glob, comma-separated
+REPLAY_TARGET = os.environ.get('REPLAY_TARGET', 'http://python-app:8000').rstrip('/')
+REPLAY_SPEED = os.environ.get('REPLAY_SPEED', '1')  # multiplier, or max
+REPLAY_WORKERS = int(os.environ.get('REPLAY_WORKERS', str(os.cpu_count() or 1)))
+SNAPSHOT_INTERVAL = 1.0
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+def trace_paths(patterns):
+    paths = []
+    for pattern in patterns.split(','):
+        matches = sorted(glob.glob(pattern.strip()))
+        if not matches:
+            raise FileNotFoundError(f"No trace files match {pattern!r}")
+        paths.extend(matches)
+    return paths
+
+
+def parse_speed(speed):
+    """Gap divisor, or None for max speed"""
+    if speed == 'max':
+        return None
+    speed = float(speed)
+    if speed <= 0:
+        raise ValueError(f"REPLAY_SPEED must be positive or 'max', got {speed:g}")
+    return speed
+
+
+class TraceReplayer(LoadGenerator):
+    """Sends a share of a trace's requests at their recorded offsets"""
+
+    def __init__(self, requests, target, speed, start_at, origin=0.0):
+        super().__init__([], rate=1.0, duration=0)
+        self.requests = requests  # (reader, index, seconds since trace start)
+        self.origin = origin  # offset of the trace's first request, sent at start_at
+        self.target = target
+        self.speed = speed
+        self.start_at = start_at  # Unix time every worker starts at
+
+    def schedulers(self):
+        return [self._replay()]
+
+    async def _report_loop(self):
+        pass  # the parent reports for all workers
+
+    def _stats(self, path):
+        url = self.target + path.partition('?')[0]
+        stats = self.stats.get(url)
+        if stats is None:
+            stats = self.stats[url] = URLStats(url)
+        return stats
+
+    async def _replay(self):
+        loop = asyncio.get_running_loop()
+        start = loop.time() + max(0.0, self.start_at - time.time())
+        slots = asyncio.Semaphore(MAX_IN_FLIGHT) if self.speed is None else None
+        for reader, index, offset in self.requests:
+            _, method, path, body = reader.request(index)
+            stats = self._stats(path)
+            if slots is not None:
+                # Max speed: wait for a free slot instead of dropping the request
+                await slots.acquire()
+                intended = loop.time()
+            else:
+                intended = start + (offset - self.origin) / self.speed
+                delay = intended - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if self.in_flight >= MAX_IN_FLIGHT:
+                    stats.dropped += 1
+                    continue
+            data, headers = (bytes(body), JSON_HEADERS) if body else (None, None)
+            coro = self.send(method, self.target + path, intended, stats, data=data, headers=headers)
+            if slots is not None:
+                coro = self._release_after(coro, slots)
+            self.spawn(coro)
+
+    @staticmethod
+    async def _release_after(coro, slots):
+        try:
+            await coro
+        finally:
+            slots.release()
+
+
+async def _run_worker(replayer, conn):
+    replay = asyncio.create_task(replayer.run())
+
+    async def snapshots():
+        while True:
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+            try:
+                conn.send((replayer.stats, replayer.in_flight))
+            except OSError:
+                # The parent is gone, so nobody reads the stats any more: stop as on SIGTERM
+                replay.cancel()
+                return
+
+    sender = asyncio.create_task(snapshots())
+    try:
+        await replay
+    except asyncio.CancelledError:
+        pass
+    finally:
+        sender.cancel()
+        try:
+            conn.send((replayer.stats, 0))
+        except OSError:
+            pass
+
+
+def run_worker(paths, worker, workers, speed, start_at, conn, inherited):
+    # Forked workers hold the parent's read ends of their own and earlier workers' pipes; without
+    # closing them a send to a dead parent blocks on a full pipe instead of failing
+    for parent_conn in inherited:
+        parent_conn.close()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    readers = [TraceReader(path) for path in paths]
+    order = merged_order(readers)
+    origin = order[0][2] if order else 0.0
+    replayer = TraceReplayer(order[worker::workers], REPLAY_TARGET, speed, start_at, origin)
+    asyncio.run(_run_worker(replayer, conn))
+    conn.close()
+
+
+class MergedStats:
+    """Latest stats of every worker, merged per URL on read"""
+
+    def __init__(self, workers):
+        self._snapshots = [({}, 0)] * workers
+        self._lock = threading.Lock()
+
+    def update(self, worker, snapshot):
+        with self._lock:
+            self._snapshots[worker] = snapshot
+
+    @property
+    def stats(self):
+        merged = {}
+        with self._lock:
+            snapshots = list(self._snapshots)
+        for stats_by_url, _ in snapshots:
+            for url, stats in stats_by_url.items():
+                total = merged.get(url)
+                if total is None:
+                    total = merged[url] = URLStats(url)
+                total.response_time.merge(stats.response_time)
+                total.service_time.merge(stats.service_time)
+                for status, count in stats.statuses.items():
+                    total.statuses[status] += count
+                total.dropped += stats.dropped
+        return merged
+
+    @property
+    def in_flight(self):
+        with self._lock:
+            return sum(in_flight for _, in_flight in self._snapshots)
+
+
+def interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def _receive(merged, worker, conn):
+    try:
+        while True:
+            merged.update(worker, conn.recv())
+    except EOFError:
+        pass
+
+
+def main():
+    paths = trace_paths(REPLAY_TRACE)
+    speed = parse_speed(REPLAY_SPEED)
+    readers = [TraceReader(path) for path in paths]
+    total = sum(len(reader) for reader in readers)
+    span = max((reader.start + reader.duration() for reader in readers), default=0.0) - \
+        min((reader.start for reader in readers), default=0.0)
+    for reader in readers:
+        reader.close()
+    print(f"Replaying {total} requests ({span:.1f}s captured) from {len(paths)} trace(s) against {REPLAY_TARGET} "
+          f"at {'max speed' if speed is None else f'{speed:g}x'} with {REPLAY_WORKERS} workers")
+
+    merged = MergedStats(REPLAY_WORKERS)
+    if METRICS_PORT:
+        REGISTRY.register(LoadGeneratorCollector(merged))
+        start_http_server(METRICS_PORT)
+
+    # Workers start together, after all of them have indexed the traces
+    start_at = time.time() + 1.0 + total / 2e5
+    processes, receivers, parent_conns = [], [], []
+    # Workers stop on SIGINT/SIGTERM like the open-loop mode: in-flight requests finish first.
+    # SIGTERM to the parent takes the same path as Ctrl-C, which passes it on to the workers
+    signal.signal(signal.SIGTERM, interrupt)
+    previous = {}
+    try:
+        for worker in range(REPLAY_WORKERS):
+            parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+            parent_conns.append(parent_conn)
+            process = multiprocessing.Process(
+                target=run_worker, name=f'replay-{worker}',
+                args=(paths, worker, REPLAY_WORKERS, speed, start_at, child_conn, list(parent_conns)))
+            process.start()
+            child_conn.close()
+            receiver = threading.Thread(target=_receive, args=(merged, worker, parent_conn), daemon=True)
+            receiver.start()
+            processes.append(process)
+            receivers.append(receiver)
+
+        running = {process.sentinel for process in processes}
+        while running:
+            finished = wait(list(running), timeout=REPORT_INTERVAL)
+            running.difference_update(finished)
+            if not finished:
+                report(merged.stats, previous, merged.in_flight)
+    except KeyboardInterrupt:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        for process in processes:
+            process.terminate()
+    for process in processes:
+        process.join()
+    for receiver in receivers:
+        receiver.join(timeout=5)
+    print_summary(merged.stats)
+    if any(process.exitcode for process in processes):
+        sys.exit(1)
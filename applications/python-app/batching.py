@@ -0,0 +1,157 @@
+"""
+Dynamic Batching
+In-process inference scheduler behind /api/inference.
+
+Requests are queued per model. Each simulated GPU runs one worker that
+takes the next batch when it is ready: as soon as a model has
+max_batch_size requests waiting, or its oldest request has waited
+max_wait. A batch costs a fixed setup time plus a smaller per-request
+time, so larger batches raise throughput at the price of queueing delay,
+the usual serving trade-off. The queue is bounded: past max_queue,
+submit() raises QueueFull and the route answers 503.
+
+Queue depth, wait time, end-to-end duration and batch sizes are recorded
+on the metrics passed in, so job_queue_size and the inference histograms
+show the real queue instead of a random table. A request may carry an
+exemplar (the HTTP request id), attached to its wait and duration
+observations.
+"""
+
+import collections
+import random
+import threading
+import time
+
+from instrumentation import ChildCache
+
+
+class QueueFull(Exception):
+    pass
+
+
+class InferenceRequest:
+    __slots__ = ('model', 'exemplar', 'enqueued', 'done', 'wait', 'latency', 'batch_size')
+
+    def __init__(self, model, exemplar=None):
+        self.model = model
+        self.exemplar = exemplar
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.wait = self.latency = None
+        self.batch_size = 0
+
+
+class BatchScheduler:
+    def __init__(self, costs, gpus=4, max_batch_size=8, max_wait=0.05, max_queue=200,
+                 queue_depth=None, duration=None, wait_time=None, batch_size=None, rejected=None, rng=None):
+        self.costs = costs  # model -> (seconds per batch, seconds per request)
+        self.gpus = gpus
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.queue_depth = queue_depth
+        # Optional metrics, labelled by model_name
+        self.duration, self.wait_time, self.batch_size, self.rejected = (
+            ChildCache(metric) if metric is not None else None
+            for metric in (duration, wait_time, batch_size, rejected)
+        )
+        self.rng = rng or random.Random()
+        self.depth = 0
+        self._queues = {model: collections.deque() for model in costs}
+        self._cond = threading.Condition()
+        self._workers = []
+
+    def start(self):
+        for gpu in range(self.gpus):
+            worker = threading.Thread(target=self._run, args=(gpu,), name=f'inference-gpu-{gpu}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        return self
+
+    def _enqueue(self, model, exemplar=None):
+        request = InferenceRequest(model, exemplar)
+        with self._cond:
+            if self.depth >= self.max_queue:
+                if self.rejected is not None:
+                    self.rejected.get(model).inc()
+                raise QueueFull(f"inference queue is full ({self.depth} requests)")
+            self._queues[model].append(request)
+            self._changed(1)
+            self._cond.notify()
+        return request
+
+    def submit(self, model, timeout=None, exemplar=None):
+        """Queue one request and block until its batch has run
+
+        Returns the completed InferenceRequest, or None if it was still
+        queued after timeout seconds (it is then left to run unobserved).
+        """
+        request = self._enqueue(model, exemplar)
+        return request if request.done.wait(timeout) else None
+
+    def fill(self, depth):
+        """Queue requests nobody waits for until the queue holds depth (a load spike)"""
+        models = list(self._queues)
+        added = 0
+        while self.depth < min(depth, self.max_queue):
+            try:
+                self._enqueue(models[added % len(models)])
+            except QueueFull:
+                break
+            added += 1
+        return added
+
+    def _changed(self, delta):
+        self.depth += delta
+        if self.queue_depth is not None:
+            self.queue_depth.set(self.depth)
+
+    def _next_batch(self, now):
+        """Pop the ready batch whose oldest request has waited longest, or return the time to wait"""
+        ready, timeout = None, None
+        for queue in self._queues.values():
+            if not queue:
+                continue
+            head = queue[0].enqueued
+            if len(queue) >= self.max_batch_size or now - head >= self.max_wait:
+                if ready is None or head < ready[0].enqueued:
+                    ready = queue
+            else:
+                remaining = head + self.max_wait - now
+                timeout = remaining if timeout is None else min(timeout, remaining)
+        if ready is None:
+            return None, timeout
+        batch = [ready.popleft() for _ in range(min(len(ready), self.max_batch_size))]
+        self._changed(-len(batch))
+        return batch, None
+
+    def _run(self, gpu):
+        while True:
+            with self._cond:
+                while True:
+                    batch, timeout = self._next_batch(time.perf_counter())
+                    if batch is not None:
+                        break
+                    self._cond.wait(timeout)
+            self._execute(batch)
+
+    def _execute(self, batch):
+        model = batch[0].model
+        started = time.perf_counter()
+        per_batch, per_request = self.costs[model]
+        time.sleep((per_batch + per_request * len(batch)) * self.rng.uniform(0.9, 1.1))
+        finished = time.perf_counter()
+
+        if self.batch_size is not None:
+            self.batch_size.get(model).observe(len(batch))
+        wait_time = self.wait_time.get(model) if self.wait_time is not None else None
+        duration = self.duration.get(model) if self.duration is not None else None
+        for request in batch:
+            request.wait = started - request.enqueued
+            request.latency = finished - request.enqueued
+            request.batch_size = len(batch)
+            if wait_time is not None:
+                wait_time.observe(request.wait, request.exemplar)
+            if duration is not None:
+                duration.observe(request.latency, request.exemplar)
+            request.done.set()
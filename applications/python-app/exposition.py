@@ -0,0 +1,113 @@
+"""
+Exposition Cache
+Keeps the last rendered /metrics body and only re-encodes metric families
+whose samples changed since the previous render.
+
+Collecting samples is cheap compared to formatting them as text, so every
+render still calls collect() but compares each family's samples with the
+ones it encoded last time and reuses the cached text when they are equal.
+The finished body is stored with an ETag and a lazily built gzip copy, so
+identical scrapes can be answered with 304 and compressed scrapes do not
+recompress unchanged output. The cache's own scrape metrics change on every
+render, so they are left out of the ETag.
+
+Each exposition format (text, OpenMetrics, protobuf; see
+common/exposition_formats.py) has its own cached encodings and snapshot, so
+Prometheus and a curl from a terminal do not evict each other's cache.
+"""
+
+import gzip
+import hashlib
+import threading
+import time
+
+from prometheus_client import Counter, Histogram
+
+from exposition_formats import TEXT, encode_family, finish
+
+RENDER_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Snapshot:
+    """One rendered exposition body"""
+
+    def __init__(self, body, etag):
+        self.body = body
+        self.etag = etag
+        self._gzipped = None
+
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=6)
+        return self._gzipped
+
+
+class ExpositionCache:
+    def __init__(self, registry, ttl=0.0, metrics_registry=None):
+        self.registry = registry
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._families = {}  # format -> {family name: (samples, encoding)}
+        self._snapshots = {}  # format -> (Snapshot, rendered at)
+
+        metrics_registry = metrics_registry if metrics_registry is not None else registry
+        self.scrapes = Counter(
+            'app_metrics_scrapes_total',
+            'Scrapes of /metrics by how much of the exposition had to be re-encoded',
+            ['result'],
+            registry=metrics_registry
+        )
+        self.render_time = Histogram(
+            'app_metrics_render_duration_seconds',
+            'Time spent collecting and encoding the /metrics body',
+            buckets=RENDER_BUCKETS,
+            registry=metrics_registry
+        )
+        self._own_families = {'app_metrics_scrapes', 'app_metrics_render_duration_seconds'}
+
+    def render(self, fmt=TEXT):
+        """Return the current Snapshot in `fmt`, re-encoding only families that changed"""
+        with self._lock:
+            start = time.perf_counter()
+            snapshot, rendered_at = self._snapshots.get(fmt, (None, 0.0))
+            if snapshot is not None and self.ttl and start - rendered_at < self.ttl:
+                self.scrapes.labels(result='cached').inc()
+                return snapshot
+
+            previous = self._families.get(fmt, {})
+            families = {}
+            parts = []
+            digest = hashlib.blake2b(digest_size=12)
+            reencoded = 0
+            for family in self.registry.collect():
+                cached = previous.get(family.name)
+                # Native histogram buckets only change together with the
+                # histogram's _count and _sum samples, so samples decide
+                if cached is not None and cached[0] == family.samples:
+                    families[family.name] = cached
+                else:
+                    cached = families[family.name] = (family.samples, encode_family(family, fmt))
+                    if family.name not in self._own_families:
+                        reencoded += 1
+                parts.append(cached[1])
+                if family.name not in self._own_families:
+                    digest.update(cached[1])
+            self._families[fmt] = families
+
+            # While nothing but the cache's own metrics changed, keep serving
+            # the previous snapshot (and its gzip copy) under the same ETag
+            etag = f'{fmt}-{digest.hexdigest()}'
+            if snapshot is None or etag != snapshot.etag:
+                snapshot = Snapshot(finish(parts, fmt), etag)
+            rendered_at = time.perf_counter()
+            self._snapshots[fmt] = (snapshot, rendered_at)
+
+            if reencoded == 0:
+                result = 'unchanged'
+            elif reencoded < len(families) - len(self._own_families):
+                result = 'partial'
+            else:
+                result = 'full'
+            self.scrapes.labels(result=result).inc()
+            self.render_time.observe(rendered_at - start)
+            return snapshot
@@ -0,0 +1,41 @@
+"""
+Gunicorn configuration for python-app
+Pre-forked workers with cooperative (gevent) request handling.
+
+The gevent worker patches time.sleep, sockets and threading before app.py is
+imported, so the simulated work in each handler yields to other requests
+instead of pinning an OS thread. One worker can keep thousands of inference
+requests in flight; add workers to use more cores.
+"""
+
+import glob
+import os
+
+import multiproc
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+worker_class = os.environ.get('WORKER_CLASS', 'gevent')  # gevent | gthread | sync
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', '4000'))  # gevent only
+threads = int(os.environ.get('WORKER_THREADS', '32'))  # gthread only
+backlog = 4096
+keepalive = 5
+timeout = 30
+graceful_timeout = 10
+
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+
+def on_starting(server):
+    if not MULTIPROC_DIR:
+        return
+    # Values left behind by a previous run would otherwise be merged into this one
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+    for path in glob.glob(os.path.join(MULTIPROC_DIR, '*.db')):
+        os.remove(path)
+
+
+def child_exit(server, worker):
+    if MULTIPROC_DIR:
+        # Folds the worker's counters into the archive files and drops its live gauges
+        multiproc.mark_process_dead(worker.pid, MULTIPROC_DIR)
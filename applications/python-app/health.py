@@ -0,0 +1,101 @@
+"""
+Health Sampler
+Computes the /health status on a fixed cadence in a background thread so
+the endpoint itself only returns the latest snapshot.
+
+Each sample reads CPU, memory and the gauges the alerts look at, and is
+kept in a small ring buffer. Alerts are evaluated on the mean over that
+buffer with separate raise and clear levels, so a single noisy reading
+neither raises an alert nor clears one that is still on. Polling /health
+therefore costs a dict copy however often a load balancer asks, and the
+snapshot carries its age so a stuck sampler shows up as stale.
+"""
+
+import collections
+import threading
+import time
+
+
+class Threshold:
+    """An alert on one smoothed signal, with hysteresis
+
+    Raised once the value goes above raise_at (below, with below=True) and
+    cleared only after it comes back past clear_at.
+    """
+
+    def __init__(self, signal, raise_at, clear_at, message, below=False):
+        self.signal = signal
+        self.raise_at = raise_at
+        self.clear_at = clear_at
+        self.message = message
+        self.below = below
+        self.active = False
+
+    def update(self, value):
+        if self.below:
+            self.active = value < (self.clear_at if self.active else self.raise_at)
+        else:
+            self.active = value > (self.clear_at if self.active else self.raise_at)
+        return self.active
+
+
+class HealthSampler:
+    def __init__(self, read, alerts, degraded, interval=1.0, window=5, stale_after=None):
+        self.read = read
+        self.alerts = alerts
+        self.degraded = degraded
+        self.interval = interval
+        self.samples = collections.deque(maxlen=window)
+        self.stale_after = stale_after if stale_after is not None else 3 * interval
+        self._snapshot = None
+
+    def sample(self):
+        """Take one reading and publish a new snapshot"""
+        readings = self.read()
+        self.samples.append(readings)
+        count = len(self.samples)
+        smoothed = {signal: sum(s[signal] for s in self.samples) / count for signal in readings}
+
+        alerts = [a.message.format(value=smoothed[a.signal]) for a in self.alerts if a.update(smoothed[a.signal])]
+        degraded = [d.update(smoothed[d.signal]) for d in self.degraded]
+        if alerts:
+            status = 'critical'
+        elif any(degraded):
+            status = 'degraded'
+        else:
+            status = 'healthy'
+
+        # Replaced as a whole, so readers never see a half-built snapshot
+        self._snapshot = {
+            'status': status,
+            'cpu_percent': readings['cpu_percent'],
+            'memory_percent': readings['memory_percent'],
+            'active_connections': readings['active_connections'],
+            'alerts': alerts,
+            'samples': count,
+            'sampled_at': time.time(),
+        }
+
+    def snapshot(self):
+        """Latest snapshot plus its age; O(1) regardless of what was sampled"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {'status': 'starting', 'alerts': [], 'stale': True}
+        age = time.time() - snapshot['sampled_at']
+        return dict(snapshot, age_seconds=round(age, 3), stale=age > self.stale_after)
+
+    def run(self):
+        deadline = time.monotonic()
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                # Keep sampling; the snapshot going stale reports the problem
+                print(f"Health sample failed: {e}")
+            deadline += self.interval
+            time.sleep(max(0.0, deadline - time.monotonic()))
+
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
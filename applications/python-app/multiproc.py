@@ -0,0 +1,272 @@
+"""
+Multiprocess Metrics
+Aggregates the per-worker value files that prometheus_client writes when
+PROMETHEUS_MULTIPROC_DIR is set, so every scrape sees the whole server
+instead of whichever worker happened to answer.
+
+File layout (written by prometheus_client, one set per worker pid):
+    counter_<pid>.db, histogram_<pid>.db, summary_<pid>.db
+    gauge_<mode>_<pid>.db   mode = all|liveall|sum|livesum|max|livemax|min|livemin
+
+Gauge merge semantics follow the multiprocess_mode of each gauge:
+    sum/livesum   values of all workers are added
+    max/livemax   highest value wins (min/livemin: lowest)
+    all/liveall   one series per worker with an extra pid label
+The live* modes only include workers that are still running. Any other mode
+(e.g. mostrecent, which needs timestamps these files do not carry) is an
+error rather than being merged the wrong way.
+
+When a worker exits, mark_process_dead() folds its counters, histograms and
+non-live gauges into a single *_archive.db file and deletes the original, so
+the number of files read per scrape is bounded by the live worker count no
+matter how often workers are recycled.
+"""
+
+import fcntl
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+
+from prometheus_client.metrics_core import Metric
+from prometheus_client.mmap_dict import MmapedDict
+from prometheus_client.utils import floatToGoString
+
+_unpack_integer = struct.Struct('i').unpack_from
+_unpack_double = struct.Struct('d').unpack_from
+
+GAUGE_MODES = ('all', 'liveall', 'sum', 'livesum', 'max', 'livemax', 'min', 'livemin')
+LOCK_FILE = '.aggregate.lock'
+ARCHIVE_ID = 'archive'
+
+# How values of a dead worker are folded into the archive, per file prefix
+_ARCHIVE_MERGE = {
+    'counter': lambda old, new: old + new,
+    'histogram': lambda old, new: old + new,
+    'summary': lambda old, new: old + new,
+    'gauge_sum': lambda old, new: old + new,
+    'gauge_max': max,
+    'gauge_min': min,
+}
+
+
+@contextmanager
+def _locked(path, operation):
+    """Shared lock for scrapes, exclusive lock while archiving a dead worker"""
+    with open(os.path.join(path, LOCK_FILE), 'a+') as lock:
+        fcntl.flock(lock, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _split_filename(filename):
+    """Return (file prefix, pid) for a value file name"""
+    prefix, _, pid = os.path.basename(filename)[:-3].rpartition('_')
+    return prefix, pid
+
+
+class _ValueFile:
+    """Read-only view of one mmapped value file
+
+    Keys are parsed once and remembered together with their offsets, so a
+    scrape only has to unpack 8 byte doubles for entries it has seen before.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        self.inode = os.fstat(self._file.fileno()).st_ino
+        self._map = None
+        self._parsed_to = 8
+        self.entries = []
+
+    def _remap(self):
+        if self._map is not None:
+            self._map.close()
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+
+    def read(self):
+        """Return a list of (key, value) pairs"""
+        if self._map is None:
+            self._remap()
+        used = _unpack_integer(self._map, 0)[0]
+        if used > len(self._map):
+            self._remap()
+        pos = self._parsed_to
+        while pos < used:
+            encoded_len = _unpack_integer(self._map, pos)[0]
+            pos += 4
+            key = self._map[pos:pos + encoded_len].decode('utf-8')
+            pos += encoded_len + (8 - (encoded_len + 4) % 8)
+            self.entries.append((key, pos))
+            pos += 8
+        self._parsed_to = max(self._parsed_to, pos)
+        data = self._map
+        return [(key, _unpack_double(data, offset)[0]) for key, offset in self.entries]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+
+class AggregatingCollector:
+    """Collector that merges all worker value files in a directory"""
+
+    def __init__(self, path, registry=None):
+        if not os.path.isdir(path):
+            raise ValueError(f'{path} is not a directory')
+        self.path = path
+        self._files = {}
+        self._keys = {}
+        # The flock only excludes other processes; threads of this one (gthread workers, the health
+        # sampler) share the open files and their parsed entries
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _parse_key(self, key):
+        parsed = self._keys.get(key)
+        if parsed is None:
+            metric_name, name, labels, help_text = json.loads(key)
+            parsed = self._keys[key] = (metric_name, name, tuple(sorted(labels.items())), help_text)
+        return parsed
+
+    def _open_files(self):
+        """Yield (prefix, pid, _ValueFile) for every value file currently on disk"""
+        filenames = set(glob.glob(os.path.join(self.path, '*.db')))
+        for filename in list(self._files):
+            if filename not in filenames:
+                self._files.pop(filename).close()
+        for filename in sorted(filenames):
+            reader = self._files.get(filename)
+            try:
+                if reader is not None and os.stat(filename).st_ino != reader.inode:
+                    self._files.pop(filename).close()
+                    reader = None
+                if reader is None:
+                    reader = self._files[filename] = _ValueFile(filename)
+            except FileNotFoundError:
+                continue
+            prefix, pid = _split_filename(filename)
+            yield prefix, pid, reader
+
+    def _read(self):
+        """Merge all files into {metric_name: (type, help, {(name, labels): value}, mode)}"""
+        metrics = {}
+        buckets = {}
+        for prefix, pid, reader in self._open_files():
+            typ, _, mode = prefix.partition('_')
+            if typ == 'gauge' and mode not in GAUGE_MODES:
+                raise ValueError(f'{reader.filename}: unsupported gauge multiprocess mode {mode!r}')
+            for key, value in reader.read():
+                metric_name, name, labels, help_text = self._parse_key(key)
+                metric = metrics.get(metric_name)
+                if metric is None:
+                    metric = metrics[metric_name] = (typ, help_text, {}, mode)
+                samples = metric[2]
+                if typ == 'gauge':
+                    if mode in ('all', 'liveall'):
+                        samples[(name, labels + (('pid', pid),))] = value
+                    elif (name, labels) not in samples:
+                        samples[(name, labels)] = value
+                    elif mode in ('sum', 'livesum'):
+                        samples[(name, labels)] += value
+                    elif mode in ('max', 'livemax'):
+                        samples[(name, labels)] = max(samples[(name, labels)], value)
+                    elif mode in ('min', 'livemin'):
+                        samples[(name, labels)] = min(samples[(name, labels)], value)
+                elif typ == 'histogram' and name.endswith('_bucket'):
+                    le = dict(labels)['le']
+                    without_le = tuple(label for label in labels if label[0] != 'le')
+                    per_bucket = buckets.setdefault(metric_name, {}).setdefault(without_le, {})
+                    per_bucket[float(le)] = per_bucket.get(float(le), 0.0) + value
+                else:
+                    samples[(name, labels)] = samples.get((name, labels), 0.0) + value
+
+        # Histogram buckets are stored per bucket; the exposition is cumulative
+        for metric_name, series in buckets.items():
+            samples = metrics[metric_name][2]
+            for labels, per_bucket in series.items():
+                total = 0.0
+                for bound in sorted(per_bucket):
+                    total += per_bucket[bound]
+                    samples[(metric_name + '_bucket', labels + (('le', floatToGoString(bound)),))] = total
+                samples[(metric_name + '_count', labels)] = total
+        return metrics
+
+    def collect(self):
+        with self._lock, _locked(self.path, fcntl.LOCK_SH):
+            metrics = self._read()
+        for metric_name in sorted(metrics):
+            typ, help_text, samples, _ = metrics[metric_name]
+            metric = Metric(metric_name, help_text, typ)
+            for (name, labels), value in samples.items():
+                metric.add_sample(name, dict(labels), value)
+            yield metric
+
+    def gauge_values(self, *metric_names):
+        """Merged {metric name: {labels: value}} for some gauges, labels as sorted tuples of pairs
+
+        All of them come from one read of the files.
+        """
+        with self._lock, _locked(self.path, fcntl.LOCK_SH):
+            metrics = self._read()
+        return {
+            metric_name: {labels: value for (name, labels), value in metrics[metric_name][2].items()}
+            if metric_name in metrics else {}
+            for metric_name in metric_names
+        }
+
+
+def mark_process_dead(pid, path=None):
+    """Fold a dead worker's values into the archive files and delete its files"""
+    path = path or os.environ['PROMETHEUS_MULTIPROC_DIR']
+    with _locked(path, fcntl.LOCK_EX):
+        for filename in glob.glob(os.path.join(path, f'*_{pid}.db')):
+            prefix, _ = _split_filename(filename)
+            if prefix.startswith('gauge_live'):
+                os.remove(filename)
+                continue
+            merge = _ARCHIVE_MERGE.get(prefix)
+            if merge is None:
+                # 'all' gauges keep one series per pid, so their files have to stay
+                continue
+            archive = MmapedDict(os.path.join(path, f'{prefix}_{ARCHIVE_ID}.db'))
+            try:
+                existing = dict(archive.read_all_values())
+                for key, value, _ in MmapedDict.read_all_values_from_file(filename):
+                    archive.write_value(key, merge(existing[key], value) if key in existing else value)
+            finally:
+                archive.close()
+            os.remove(filename)
+
+
+class LeaderLock:
+    """Non-blocking file lock used to pick one worker for shared background work
+
+    The lock is released by the kernel when the holding process exits, so
+    another worker takes over on its next acquire() call.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = None
+
+    def acquire(self):
+        if self._file is not None:
+            return True
+        handle = open(self.filename, 'a+')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self._file = handle
+        return True
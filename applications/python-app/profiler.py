@@ -0,0 +1,216 @@
+"""
+Profiler
+On-demand stack sampling and allocation diffs for /debug/profile and
+/debug/allocations, plus the CPU clock behind the per-route CPU counters.
+
+Nothing here runs until a profile is requested. StackSampler then starts
+one OS thread that reads every thread's current frame with
+sys._current_frames() at a fixed interval and counts the stacks, and
+returns them collapsed ("frame;frame;frame count" per line), the input
+format of flamegraph.pl and speedscope. AllocationProfiler starts
+tracemalloc only for the requested window, diffs a snapshot from each end,
+and charges every allocation site to the route whose view function is on
+its traceback.
+
+Under the gevent worker, threads are greenlets sharing one OS thread, so
+the sampler uses gevent's original (unpatched) thread and sleep, and sees
+whichever greenlet is on the CPU when it samples. thread_time() would
+charge a request with the CPU of every greenlet that ran while it waited,
+so cpu_clock() returns a clock that follows greenlet switches instead.
+"""
+
+import collections
+import _thread
+import inspect
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import weakref
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _gevent_patched():
+    if 'gevent.monkey' not in sys.modules:
+        return False
+    from gevent import monkey
+    return monkey.is_module_patched('threading')
+
+
+def _os_thread_primitives():
+    """start_new_thread, get_ident and sleep of real OS threads, even under gevent"""
+    if _gevent_patched():
+        from gevent import monkey
+        return (monkey.get_original('_thread', 'start_new_thread'), monkey.get_original('_thread', 'get_ident'),
+                monkey.get_original('time', 'sleep'))
+    return _thread.start_new_thread, _thread.get_ident, time.sleep
+
+
+class _GreenletClock:
+    """CPU seconds used by the current greenlet, charged at every switch"""
+
+    def __init__(self):
+        import greenlet
+
+        self._getcurrent = greenlet.getcurrent
+        self._spent = weakref.WeakKeyDictionary()
+        self._last = time.thread_time()
+        self._previous = greenlet.settrace(self._switch)
+
+    def _switch(self, event, args):
+        if event in ('switch', 'throw'):
+            origin = args[0]
+            now = time.thread_time()
+            self._spent[origin] = self._spent.get(origin, 0.0) + now - self._last
+            self._last = now
+        if self._previous is not None:
+            self._previous(event, args)
+
+    def __call__(self):
+        return self._spent.get(self._getcurrent(), 0.0) + time.thread_time() - self._last
+
+
+def cpu_clock():
+    """A clock of CPU seconds used by the calling request: thread_time, or per greenlet under gevent"""
+    return _GreenletClock() if _gevent_patched() else time.thread_time
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Samples every thread's stack on request; one profile at a time"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start_thread, self._get_ident, self._sleep = _os_thread_primitives()
+        # Under gevent threading.enumerate() lists greenlets, so name the OS main thread here
+        self._main = self._get_ident()
+
+    def profile(self, seconds, interval=0.005, wait=time.sleep):
+        """Collapsed stacks sampled over `seconds`, most frequent first
+
+        Blocks the caller with `wait` (the patched sleep under gevent, so
+        other requests keep running) while a separate OS thread samples.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy('a profile is already running')
+        try:
+            result = {}
+            self._start_thread(self._sample, (seconds, interval, result))
+            while 'stacks' not in result:
+                wait(min(interval * 10, 0.1))
+        finally:
+            self._lock.release()
+        stacks = result['stacks']
+        lines = [f"{stack} {count}" for stack, count in stacks.most_common()]
+        return '\n'.join(lines) + '\n', result['samples']
+
+    def _sample(self, seconds, interval, result):
+        stacks = collections.Counter()
+        own = self._get_ident()
+        labels = {}  # code object -> frame label
+        samples = 0
+        deadline = time.perf_counter() + seconds
+        try:
+            while time.perf_counter() < deadline:
+                names = {self._main: 'MainThread'}
+                names.update((thread.ident, thread.name) for thread in threading.enumerate())
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    frames = []
+                    while frame is not None:
+                        code = frame.f_code
+                        label = labels.get(code)
+                        if label is None:
+                            label = labels[code] = _frame_label(code)
+                        frames.append(label)
+                        frame = frame.f_back
+                    frames.append(names.get(ident, f'thread-{ident}'))
+                    stacks[';'.join(reversed(frames))] += 1
+                samples += 1
+                self._sleep(interval)
+        finally:
+            result['samples'] = samples
+            result['stacks'] = stacks
+
+
+class AllocationProfiler:
+    """Net allocations per route and per source line over a window, via tracemalloc"""
+
+    def __init__(self, app, gauge=None, nframes=25):
+        self.app = app
+        self.gauge = gauge  # labelled by endpoint
+        self.nframes = nframes
+        self._lock = threading.Lock()
+        self._views = None
+
+    def _view_ranges(self):
+        """(filename, first line, last line, rule) of every view function"""
+        if self._views is None:
+            endpoints = {}
+            for rule in self.app.url_map.iter_rules():
+                endpoints.setdefault(rule.endpoint, rule.rule)
+            views = []
+            for endpoint, view in self.app.view_functions.items():
+                code = getattr(view, '__code__', None)
+                if code is None or endpoint not in endpoints:
+                    continue
+                try:
+                    lines, first = inspect.getsourcelines(view)
+                except OSError:
+                    continue
+                views.append((code.co_filename, first, first + len(lines) - 1, endpoints[endpoint]))
+            self._views = views
+        return self._views
+
+    def _route_of(self, traceback):
+        for frame in traceback:
+            for filename, first, last, rule in self._view_ranges():
+                if frame.filename == filename and first <= frame.lineno <= last:
+                    return rule
+        return 'other'
+
+    def profile(self, seconds, top=20, wait=time.sleep):
+        """{'routes': {rule: bytes}, 'top': [...]} for allocations made during `seconds`"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy('an allocation profile is already running')
+        started = not tracemalloc.is_tracing()
+        try:
+            if started:
+                tracemalloc.start(self.nframes)
+            before = tracemalloc.take_snapshot()
+            wait(seconds)
+            after = tracemalloc.take_snapshot()
+        finally:
+            if started:
+                tracemalloc.stop()
+            self._lock.release()
+
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        before, after = before.filter_traces(ignore), after.filter_traces(ignore)
+        routes = collections.Counter()
+        for stat in after.compare_to(before, 'traceback'):
+            routes[self._route_of(stat.traceback)] += stat.size_diff
+        if self.gauge is not None:
+            for rule, size in routes.items():
+                self.gauge.labels(rule).set(size)
+
+        lines = collections.Counter()
+        counts = collections.Counter()
+        for stat in after.compare_to(before, 'lineno'):
+            location = f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}"
+            lines[location] += stat.size_diff
+            counts[location] += stat.count_diff
+        return {
+            'seconds': seconds,
+            'routes': dict(routes.most_common()),
+            'top': [{'location': location, 'size_diff': size, 'count_diff': counts[location]}
+                    for location, size in sorted(lines.items(), key=lambda item: -abs(item[1]))[:top]],
+        }
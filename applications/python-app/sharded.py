@@ -0,0 +1,157 @@
+"""
+Sharded Metrics
+Counter and Gauge replacements for the hot request metrics that keep one
+accumulator per thread and only add the shards up at collect time.
+
+Every prometheus_client value is guarded by its own mutex, so with many
+request threads each inc()/dec() on app_requests_total and
+app_active_connections queues on the same few locks. Here a thread only
+ever writes its own cell, found by thread id with a plain dict lookup, so
+the hot path takes no lock at all. Thread ids are reused once a thread
+exits, which bounds the number of shards by the peak number of live threads
+even with a thread per request. The latency histograms get the same
+treatment in common/sparse_histogram.py.
+
+Reads are eventually consistent: a scrape may miss an increment that is
+happening at the same moment, which the next scrape picks up. Only used in
+single-process mode; gunicorn workers keep the mmap-backed client metrics.
+"""
+
+import threading
+import time
+
+from prometheus_client import REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+get_ident = threading.get_ident
+
+
+class _ShardedChild:
+    """One labelled series: a cell of size `width` per writing thread"""
+
+    width = 1
+
+    def __init__(self):
+        self.created = time.time()
+        self._cells = {}
+        self._lock = threading.Lock()
+
+    def _new_cell(self):
+        # Only taken the first time a thread id writes to this series
+        with self._lock:
+            cell = self._cells[get_ident()] = [0.0] * self.width
+        return cell
+
+    def _totals(self):
+        totals = [0.0] * self.width
+        with self._lock:
+            cells = list(self._cells.values())
+        for cell in cells:
+            for i, value in enumerate(cell):
+                totals[i] += value
+        return totals
+
+
+class _CounterChild(_ShardedChild):
+    def inc(self, amount=1):
+        if amount < 0:
+            raise ValueError('Counters can only be incremented by non-negative amounts.')
+        cell = self._cells.get(get_ident()) or self._new_cell()
+        cell[0] += amount
+
+    def get(self):
+        return self._totals()[0]
+
+
+class _GaugeChild(_ShardedChild):
+    def inc(self, amount=1):
+        cell = self._cells.get(get_ident()) or self._new_cell()
+        cell[0] += amount
+
+    def dec(self, amount=1):
+        cell = self._cells.get(get_ident()) or self._new_cell()
+        cell[0] -= amount
+
+    def get(self):
+        return self._totals()[0]
+
+
+class _ShardedMetric:
+    """Labels, registration and collection shared by the sharded metric types"""
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self._name = name
+        self._documentation = documentation
+        self._labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self._labelnames:
+            self._unlabelled = self._children[()] = self._new_child()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *labelvalues, **labelkwargs):
+        if not self._labelnames:
+            raise ValueError(f'No label names were set when constructing {self._name}')
+        if labelkwargs:
+            if labelvalues or set(labelkwargs) != set(self._labelnames):
+                raise ValueError('Incorrect label names')
+            labelvalues = tuple(str(labelkwargs[name]) for name in self._labelnames)
+        else:
+            if len(labelvalues) != len(self._labelnames):
+                raise ValueError('Incorrect label count')
+            labelvalues = tuple(str(value) for value in labelvalues)
+        child = self._children.get(labelvalues)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(labelvalues, self._new_child())
+        return child
+
+    def describe(self):
+        return [self._family()]
+
+    def collect(self):
+        family = self._family()
+        for labelvalues, child in list(self._children.items()):
+            self._add(family, list(labelvalues), child)
+        return [family]
+
+
+class ShardedCounter(_ShardedMetric):
+    def _new_child(self):
+        return _CounterChild()
+
+    def _family(self):
+        return CounterMetricFamily(self._name, self._documentation, labels=self._labelnames)
+
+    def _add(self, family, labelvalues, child):
+        family.add_metric(labelvalues, child.get(), created=child.created)
+
+    def inc(self, amount=1):
+        self._unlabelled.inc(amount)
+
+
+class ShardedGauge(_ShardedMetric):
+    """Gauge supporting inc()/dec() only; set() has no meaningful per-thread split"""
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY, multiprocess_mode=None):
+        # multiprocess_mode is accepted so the constructor matches Gauge's
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def _family(self):
+        return GaugeMetricFamily(self._name, self._documentation, labels=self._labelnames)
+
+    def _add(self, family, labelvalues, child):
+        family.add_metric(labelvalues, child.get())
+
+    def inc(self, amount=1):
+        self._unlabelled.inc(amount)
+
+    def dec(self, amount=1):
+        self._unlabelled.dec(amount)
+
+    def get(self):
+        return self._unlabelled.get()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Dynamic Batching Benchmark
+Throughput against latency for python-app's inference scheduler: a closed
+loop of clients keeps submitting requests while max_batch_size and max_wait
+are swept. Model costs are app.py's, divided by --scale so a sweep takes
+seconds.
+
+    python benchmarks/bench_batching.py --clients 64 --batch 1,4,8,16 --wait-ms 0,10,50
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'applications', 'python-app'))
+
+from batching import BatchScheduler
+
+# Same as INFERENCE_COSTS in app.py
+COSTS = {
+    'gpt-3': (0.6, 0.15),
+    'stable-diffusion': (1.2, 0.3),
+    'bert': (0.08, 0.01),
+}
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def bench(max_batch_size, max_wait, clients, duration, gpus, scale):
+    costs = {model: (batch / scale, request / scale) for model, (batch, request) in COSTS.items()}
+    scheduler = BatchScheduler(costs, gpus=gpus, max_batch_size=max_batch_size, max_wait=max_wait,
+                               max_queue=clients, rng=random.Random(1)).start()
+    latencies, batches = [], []
+    deadline = time.perf_counter() + duration
+
+    def client(seed):
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            request = scheduler.submit(rng.choice(list(costs)))
+            latencies.append(request.latency)
+            batches.append(request.batch_size)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Latencies are reported back in unscaled seconds
+    return (len(latencies) / duration / scale, percentile(latencies, 0.5) * scale,
+            percentile(latencies, 0.99) * scale, sum(batches) / len(batches))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch', default='1,4,8,16')
+    parser.add_argument('--wait-ms', default='0,10,50')
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--gpus', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=2.0)
+    parser.add_argument('--scale', type=float, default=100.0)
+    args = parser.parse_args()
+
+    print(f"{'batch':>5} {'wait ms':>7} {'req/s':>8} {'p50 s':>7} {'p99 s':>7} {'mean batch':>10}")
+    for max_batch_size in (int(b) for b in args.batch.split(',')):
+        for wait_ms in (float(w) for w in args.wait_ms.split(',')):
+            # The wait is a real-time knob too, so it is scaled like the costs
+            throughput, p50, p99, mean_batch = bench(max_batch_size, wait_ms / 1000 / args.scale, args.clients,
+                                                     args.duration, args.gpus, args.scale)
+            print(f"{max_batch_size:>5} {wait_ms:>7.0f} {throughput:>8.1f} {p50:>7.2f} {p99:>7.2f} {mean_batch:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+GPU Fleet Scrape Benchmark
+Scrape throughput of simulators/fleet.py with the node processes set by
+--workers, the way Prometheus sees it: every node is its own target and
+all of them are scraped concurrently.
+
+For each worker count the fleet is started as a subprocess on free ports,
+then an asyncio client scrapes every target in a loop, --concurrency at a
+time, for --duration seconds.
+
+    python benchmarks/bench_fleet_scrape.py --nodes 200 --workers 1,4,8
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+from bench_serving import free_port, wait_for_port
+
+SIMULATORS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'simulators')
+
+
+async def scrape(urls, concurrency, duration):
+    latencies = []
+    samples = errors = 0
+    deadline = time.perf_counter() + duration
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30)) as session:
+        async def worker(offset):
+            nonlocal samples, errors
+            i = offset
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    async with session.get(urls[i % len(urls)]) as response:
+                        body = await response.text()
+                        samples += sum(1 for line in body.splitlines() if line and line[0] != '#')
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+                i += concurrency
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(offset) for offset in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return latencies, samples, errors, elapsed
+
+
+def run_fleet(nodes, workers, concurrency, duration):
+    base_port = free_port()
+    env = dict(os.environ, FLEET_NODES=str(nodes), FLEET_WORKERS=str(workers), FLEET_BASE_PORT=str(base_port))
+    fleet = subprocess.Popen([sys.executable, 'fleet.py'], cwd=SIMULATORS_DIR, env=env,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for node in range(nodes):
+            wait_for_port(base_port + node)
+        urls = [f'http://127.0.0.1:{base_port + node}/metrics' for node in range(nodes)]
+        latencies, samples, errors, elapsed = asyncio.run(scrape(urls, concurrency, duration))
+    finally:
+        fleet.terminate()
+        fleet.wait(timeout=30)
+    latencies.sort()
+    count = len(latencies)
+    return {
+        'scrapes': count / elapsed,
+        'samples': samples / elapsed,
+        'errors': errors,
+        'p99': latencies[int(count * 0.99)] if count else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=200)
+    parser.add_argument('--workers', default=f'1,{os.cpu_count()}')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=10)
+    args = parser.parse_args()
+
+    print(f"{'workers':>7} {'scrapes/s':>10} {'samples/s':>11} {'errors':>7} {'p99 (s)':>8}")
+    for workers in (int(w) for w in args.workers.split(',')):
+        result = run_fleet(args.nodes, workers, args.concurrency, args.duration)
+        print(f"{workers:>7} {result['scrapes']:>10.1f} {result['samples']:>11.0f} {result['errors']:>7} "
+              f"{result['p99']:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
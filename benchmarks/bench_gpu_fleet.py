@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+GPU Fleet Benchmark
+Update and scrape cost of the vectorized GPUFleet against GPU count, next to
+the old per-device path (one labels().set() per metric per GPU).
+
+    python benchmarks/bench_gpu_fleet.py --sizes 8,1000,10000,50000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'simulators'))
+
+from prometheus_client import CollectorRegistry, Gauge, generate_latest
+
+import gpu_simulator
+from gpu_simulator import GPUFleet, FleetCollector, GAUGES, LABEL_NAMES
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def bench_fleet(size, repeat):
+    fleet = GPUFleet(size)
+    registry = CollectorRegistry()
+    registry.register(FleetCollector(fleet))
+    update = timed(fleet.step, repeat)
+    body = generate_latest(registry)
+    scrape = timed(lambda: generate_latest(registry), repeat)
+    return update, scrape, len(body)
+
+
+def bench_per_device(size, repeat):
+    """The pre-vectorization update path: Python objects and labels() per metric"""
+    registry = CollectorRegistry()
+    gauges = [Gauge(name, documentation, LABEL_NAMES, registry=registry) for name, documentation, _ in GAUGES]
+    devices = [(f"gpu{i % 8}", gpu_simulator.GPU_MODEL, f"node{i // 8}") for i in range(size)]
+    state = [random.randint(30, 70) for _ in range(size)]
+
+    def update():
+        for i, labels in enumerate(devices):
+            state[i] = max(0, min(100, state[i] + random.randint(-10, 10)))
+            for gauge in gauges:
+                gauge.labels(*labels).set(state[i] * random.uniform(0.8, 1.2))
+
+    update_time = timed(update, repeat)
+    scrape_time = timed(lambda: generate_latest(registry), repeat)
+    return update_time, scrape_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='8,100,1000,10000')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip-per-device', action='store_true', help='only run the vectorized fleet')
+    args = parser.parse_args()
+
+    print(f"{'gpus':>7} {'update ms':>10} {'scrape ms':>10} {'bytes':>11} {'old update ms':>14} {'old scrape ms':>14}")
+    for size in (int(s) for s in args.sizes.split(',')):
+        update, scrape, size_bytes = bench_fleet(size, args.repeat)
+        line = f"{size:>7} {update * 1000:>10.2f} {scrape * 1000:>10.2f} {size_bytes:>11}"
+        if not args.skip_per_device:
+            old_update, old_scrape = bench_per_device(size, args.repeat)
+            line += f" {old_update * 1000:>14.2f} {old_scrape * 1000:>14.2f}"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
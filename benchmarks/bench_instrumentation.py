@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Instrumentation Microbenchmark
+Per-request cost of recording the request metrics, comparing the old inline
+labels() calls with pre-bound children, and the same trivial Flask route
+instrumented with the old inline block and with RequestInstrumentation.
+
+    python benchmarks/bench_instrumentation.py --iterations 200000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'applications', 'python-app'))
+
+from flask import Flask
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+
+from instrumentation import ChildCache, RequestInstrumentation
+
+
+def request_metrics():
+    registry = CollectorRegistry()
+    return (
+        Counter('app_requests_total', 'Total number of requests', ['method', 'endpoint', 'status'], registry=registry),
+        Histogram('app_request_duration_seconds', 'Request duration in seconds', ['method', 'endpoint'],
+                  registry=registry),
+        Gauge('app_active_connections', 'Number of active connections', registry=registry),
+    )
+
+
+def bench_inline_labels(iterations):
+    """The copy-pasted per-route block: labels() lookups on every request"""
+    count, duration, active = request_metrics()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        start_time = time.time()
+        active.inc()
+        count.labels(method='GET', endpoint='/api/test', status='200').inc()
+        active.dec()
+        duration.labels(method='GET', endpoint='/api/test').observe(time.time() - start_time)
+    return (time.perf_counter() - start) / iterations
+
+
+def bench_child_cache(iterations):
+    count, duration, active = request_metrics()
+    counts, durations = ChildCache(count), ChildCache(duration)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        start_time = time.perf_counter()
+        active.inc()
+        counts.get('GET', '/api/test', '200').inc()
+        active.dec()
+        durations.get('GET', '/api/test').observe(time.perf_counter() - start_time)
+    return (time.perf_counter() - start) / iterations
+
+
+def bench_flask(iterations, mode):
+    app = Flask(__name__)
+    count, duration, active = request_metrics()
+
+    if mode == 'inline':
+        @app.route('/api/test')
+        def api_test():
+            start_time = time.time()
+            active.inc()
+            try:
+                count.labels(method='GET', endpoint='/api/test', status='200').inc()
+                return 'ok'
+            finally:
+                active.dec()
+                duration.labels(method='GET', endpoint='/api/test').observe(time.time() - start_time)
+    else:
+        @app.route('/api/test')
+        def api_test():
+            return 'ok'
+
+        if mode == 'hooks':
+            RequestInstrumentation(app, count, duration, active)
+
+    client = app.test_client()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        client.get('/api/test')
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=100000)
+    parser.add_argument('--flask-iterations', type=int, default=5000)
+    args = parser.parse_args()
+
+    inline = bench_inline_labels(args.iterations)
+    cached = bench_child_cache(args.iterations)
+    bare = bench_flask(args.flask_iterations, 'none')
+    old_route = bench_flask(args.flask_iterations, 'inline')
+    hooked = bench_flask(args.flask_iterations, 'hooks')
+
+    print(f"inline labels() per request:     {inline * 1e6:8.2f} us")
+    print(f"pre-bound children per request:  {cached * 1e6:8.2f} us  ({inline / cached:.2f}x faster)")
+    print(f"flask route, no metrics:         {bare * 1e6:8.2f} us")
+    print(f"flask route, inline block:       {old_route * 1e6:8.2f} us  (+{(old_route - bare) * 1e6:.2f} us)")
+    print(f"flask route, instrumentation:    {hooked * 1e6:8.2f} us  (+{(hooked - bare) * 1e6:.2f} us)")
+
+
+if __name__ == '__main__':
+    main()
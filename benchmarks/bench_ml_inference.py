@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+ML Inference Simulation Benchmark
+Per-tick cost of simulating inference traffic with one observe() per request
+(the old loop) against the batched path in ml_simulator, at increasing
+request volumes.
+
+    python benchmarks/bench_ml_inference.py --volumes 1,100,10000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'simulators'))
+
+import numpy as np
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest
+
+from ml_simulator import observe_batch
+
+
+def metrics():
+    registry = CollectorRegistry()
+    requests = Counter('inference_requests_total', 'Total inference requests', ['model_name', 'status'],
+                       registry=registry)
+    latency = Histogram('inference_latency_seconds', 'Inference latency', ['model_name'], registry=registry)
+    return registry, requests, latency
+
+
+def per_request(requests, latency, num_requests, rng):
+    for _ in range(num_requests):
+        if rng.random() < 0.95:
+            requests.labels(model_name='bert-base', status='success').inc()
+            latency.labels(model_name='bert-base').observe(rng.uniform(0.01, 0.5))
+        else:
+            requests.labels(model_name='bert-base', status='error').inc()
+
+
+def batched(requests, latency, num_requests, rng):
+    successes = int(rng.binomial(num_requests, 0.95))
+    requests.labels(model_name='bert-base', status='success').inc(successes)
+    requests.labels(model_name='bert-base', status='error').inc(num_requests - successes)
+    observe_batch(latency.labels(model_name='bert-base'), rng.uniform(0.01, 0.5, successes))
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def check_identical():
+    """Both paths must export the same histogram for the same latencies"""
+    values = np.random.default_rng(0).uniform(0.0, 12.0, 10000)
+    values[:len(Histogram.DEFAULT_BUCKETS) - 1] = Histogram.DEFAULT_BUCKETS[:-1]  # exact bucket bounds
+    registry_a, _, latency_a = metrics()
+    registry_b, _, latency_b = metrics()
+    for value in values.tolist():
+        latency_a.labels(model_name='bert-base').observe(value)
+    observe_batch(latency_b.labels(model_name='bert-base'), values)
+    strip = lambda body: [line for line in body.decode().splitlines() if '_created' not in line]
+    a, b = strip(generate_latest(registry_a)), strip(generate_latest(registry_b))
+    # Sums may differ in the last digit from the summation order
+    return all(x == y or x.startswith('inference_latency_seconds_sum') for x, y in zip(a, b))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--volumes', default='1,10,100,1000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"bucket counts identical: {check_identical()}")
+    print(f"{'requests/tick':>14} {'per-request ms':>15} {'batched ms':>11} {'speedup':>8}")
+    for volume in (int(v) for v in args.volumes.split(',')):
+        num_requests = 100 * volume
+        _, requests, latency = metrics()
+        old = timed(lambda: per_request(requests, latency, num_requests, random.Random(0)), args.repeat)
+        _, requests, latency = metrics()
+        rng = np.random.default_rng(0)
+        new = timed(lambda: batched(requests, latency, num_requests, rng), args.repeat)
+        print(f"{num_requests:>14} {old * 1000:>15.3f} {new * 1000:>11.3f} {old / new:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
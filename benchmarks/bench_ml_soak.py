@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+ML Simulator Soak Benchmark
+Runs the ML workload simulator through a simulated week as fast as it can
+and reports RSS, series count and /metrics size once per simulated day.
+Modes: managed (finished jobs' series removed, the simulator's behaviour),
+capped (never removed, held by the cardinality limiter) and unbounded
+(neither, the old behaviour). Each mode runs in its own process.
+
+    python benchmarks/bench_ml_soak.py --days 7
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'simulators'))
+
+TICKS_PER_DAY = 86400 // 10
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # peak, on platforms without /proc
+
+
+def soak(mode, days, seed):
+    import numpy as np
+    from prometheus_client import REGISTRY, generate_latest
+
+    import ml_simulator
+    from scenario import ScenarioEngine
+
+    engine = ScenarioEngine('ml-simulator', seed=seed, tick=ml_simulator.UPDATE_INTERVAL)
+    grace_ticks = 6 if mode == 'managed' else None
+    if mode == 'unbounded':
+        ml_simulator.limiter.max_series = float('inf')
+    simulator = ml_simulator.WorkloadSimulator(np.random.default_rng(engine.seed_for('inference')), grace_ticks)
+    for day in range(1, days + 1):
+        engine.run(simulator.tick, ticks=TICKS_PER_DAY, realtime=False)
+        body = generate_latest(REGISTRY)
+        series = sum(1 for line in body.splitlines() if line and not line.startswith(b'#'))
+        print(f"{mode:>9} {day:>4} {simulator.job_counter:>6} {series:>7} {len(body) / 1024:>10.1f} {rss_mb():>8.1f}",
+              flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--mode', choices=['managed', 'capped', 'unbounded'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        soak(args.mode, args.days, args.seed)
+        return
+
+    print(f"{'mode':>9} {'day':>4} {'jobs':>6} {'series':>7} {'scrape KiB':>10} {'RSS MiB':>8}")
+    for mode in ('managed', 'capped', 'unbounded'):
+        subprocess.run([sys.executable, __file__, '--mode', mode, '--days', str(args.days), '--seed', str(args.seed)],
+                       check=True)
+
+
+if __name__ == '__main__':
+    main()
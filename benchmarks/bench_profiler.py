@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Profiler Overhead Benchmark
+What python-app's profiling costs the work it observes (profiler.py).
+
+A CPU-bound loop runs in --threads threads for --seconds while the stack
+sampler is idle and while it samples at each --intervals; the loop's
+throughput against the idle run is the sampler's overhead. Also times the
+two per-request CPU clocks: time.thread_time and the greenlet clock used
+under gevent, including what its switch hook adds to every greenlet switch.
+
+    python benchmarks/bench_profiler.py --threads 4 --intervals 1,5,10
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'applications', 'python-app'))
+
+import greenlet
+
+from profiler import StackSampler, _GreenletClock
+
+
+def spin(seconds, counts, slot):
+    deadline = time.perf_counter() + seconds
+    loops = 0
+    while time.perf_counter() < deadline:
+        sum(range(200))
+        loops += 1
+    counts[slot] = loops
+
+
+def throughput(threads, seconds, interval=None):
+    counts = [0] * threads
+    workers = [threading.Thread(target=spin, args=(seconds, counts, i)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    if interval is not None:
+        StackSampler().profile(seconds, interval)
+    for worker in workers:
+        worker.join()
+    return sum(counts) / seconds
+
+
+def per_call(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+
+def switch_cost(iterations):
+    """Seconds per switch between two greenlets"""
+    def ping():
+        while True:
+            main.switch()
+
+    main = greenlet.getcurrent()
+    other = greenlet.greenlet(ping)
+    return per_call(other.switch, iterations) / 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--intervals', default='1,5,10', help='sampling intervals in milliseconds')
+    parser.add_argument('--iterations', type=int, default=200000)
+    args = parser.parse_args()
+
+    idle = throughput(args.threads, args.seconds)
+    print(f"{'sampler':>14} {'loops/s':>12} {'overhead':>9}")
+    print(f"{'idle':>14} {idle:>12.0f} {'':>9}")
+    for interval in (float(i) for i in args.intervals.split(',')):
+        sampled = throughput(args.threads, args.seconds, interval / 1000)
+        print(f"{f'every {interval:g} ms':>14} {sampled:>12.0f} {1 - sampled / idle:>8.1%}")
+
+    plain_switch = switch_cost(args.iterations)
+    clock = _GreenletClock()
+    traced_switch = switch_cost(args.iterations)
+    greenlet.settrace(None)
+    print(f"time.thread_time():     {per_call(time.thread_time, args.iterations) * 1e9:8.0f} ns")
+    print(f"greenlet clock():       {per_call(clock, args.iterations) * 1e9:8.0f} ns")
+    print(f"greenlet switch:        {plain_switch * 1e9:8.0f} ns, {traced_switch * 1e9:.0f} ns with the clock's hook")
+
+
+if __name__ == '__main__':
+    main()
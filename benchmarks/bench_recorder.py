@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Metric Recorder Benchmark
+Cost of common/recorder.py's per-tick snapshot of a GPU fleet, and of
+loading the recording back into NumPy.
+
+For each --gpus size the fleet is stepped --hours of simulated time (10s
+ticks) with a Recorder on its registry. Reports the record() time per tick
+(p50, p99, max) next to generate_latest() of the same registry (what one
+scrape costs), bytes written per tick against the text exposition size,
+and how long Recording.matrix() takes to load every series over the whole
+recording.
+
+    python benchmarks/bench_recorder.py --gpus 8,512,4096 --hours 1
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from prometheus_client import CollectorRegistry, generate_latest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'simulators'))
+sys.path.insert(0, os.path.join(ROOT, 'common'))
+
+from gpu_simulator import UPDATE_INTERVAL, FleetCollector, GPUFleet
+from recorder import Recorder, Recording
+
+
+def run(gpus, ticks, directory):
+    fleet = GPUFleet(gpus, rng=np.random.default_rng(0))
+    registry = CollectorRegistry()
+    registry.register(FleetCollector(fleet))
+    recorder = Recorder(directory)
+    recorder.add_source(registry, {'job': 'gpu-simulator'})
+
+    record_ms = []
+    for tick in range(ticks):
+        fleet.step()
+        start = time.perf_counter()
+        recorder.record(1.7e9 + tick * UPDATE_INTERVAL)
+        record_ms.append((time.perf_counter() - start) * 1000)
+    start = time.perf_counter()
+    exposition = generate_latest(registry)
+    scrape_ms = (time.perf_counter() - start) * 1000
+    recorder.close()
+
+    start = time.perf_counter()
+    recording = Recording(directory)
+    timestamps, values = recording.matrix(range(len(recording.labels)))
+    load_s = time.perf_counter() - start
+    series = values.shape[0]
+    del values
+    recording.close()
+    return {
+        'record_ms': record_ms, 'scrape_ms': scrape_ms, 'series': series, 'ticks': len(timestamps),
+        'bytes_per_tick': recorder.bytes / ticks, 'exposition_bytes': len(exposition),
+        'changed': recorder.samples / (recorder.samples + recorder.unchanged), 'load_s': load_s,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--gpus', default='8,512,4096')
+    parser.add_argument('--hours', type=float, default=1.0, help='simulated hours to record')
+    args = parser.parse_args()
+    ticks = int(args.hours * 3600 / UPDATE_INTERVAL)
+
+    print(f"{ticks} ticks of {UPDATE_INTERVAL}s per size")
+    print(f"{'gpus':>6} {'series':>7} {'record p50':>11} {'p99':>8} {'max':>8} {'scrape':>8} "
+          f"{'bytes/tick':>11} {'exposition':>11} {'changed':>8} {'load all':>9}")
+    for gpus in (int(g) for g in args.gpus.split(',')):
+        with tempfile.TemporaryDirectory() as directory:
+            result = run(gpus, ticks, directory)
+        record_ms = np.array(result['record_ms'])
+        print(f"{gpus:>6} {result['series']:>7} {np.percentile(record_ms, 50):>9.2f}ms "
+              f"{np.percentile(record_ms, 99):>6.2f}ms {record_ms.max():>6.2f}ms {result['scrape_ms']:>6.2f}ms "
+              f"{result['bytes_per_tick']:>11.0f} {result['exposition_bytes']:>11} {result['changed']:>8.0%} "
+              f"{result['load_s'] * 1000:>7.0f}ms")
+
+
+if __name__ == '__main__':
+    main()
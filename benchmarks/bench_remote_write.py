@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Remote Write Benchmark
+Push-mode cost for a GPU fleet of each size, next to rendering the same
+samples as a text-format scrape.
+
+For each size a GPUFleet is pushed --rounds times through a RemoteWriter to
+tools/remote_write_receiver.py, started as a subprocess with --discard so
+only the sender is measured. Reports samples per second queued (collect and
+encode) and delivered (until the queues drain), the send queue's bytes right
+after a push, and compressed bytes per sample on the wire.
+
+    python benchmarks/bench_remote_write.py --sizes 1000,10000 --shards 1,4
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'simulators'))
+sys.path.insert(0, os.path.join(ROOT, 'common'))
+
+from prometheus_client import CollectorRegistry, generate_latest
+
+from bench_serving import free_port, wait_for_port
+from gpu_simulator import FleetCollector, GPUFleet
+from remote_write import RemoteWriter, snappy
+
+
+def bench(url, size, shards, rounds):
+    fleet = GPUFleet(size)
+    registry = CollectorRegistry()
+    registry.register(FleetCollector(fleet))
+    fleet.step()
+
+    start = time.perf_counter()
+    generate_latest(registry)
+    scrape = time.perf_counter() - start
+
+    # Big enough queues that nothing is dropped, so queue bytes show a whole push
+    writer = RemoteWriter(url, shards=shards, capacity=size * 20, registry=CollectorRegistry())
+    writer.add_source(registry, {'job': 'gpu-simulator', 'instance': 'bench'})
+    writer.start()
+    queued = queue_bytes = push_time = 0.0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fleet.step()
+        pushed = time.perf_counter()
+        queued += writer.push()
+        push_time += time.perf_counter() - pushed
+        queue_bytes = max(queue_bytes, writer.queued_bytes())
+    writer.flush(timeout=300)
+    elapsed = time.perf_counter() - start
+
+    sent = writer.samples.labels('sent')._value.get()
+    return {
+        'scrape': queued / rounds / scrape,
+        'queued': queued / push_time,
+        'delivered': sent / elapsed,
+        'queue_bytes': queue_bytes,
+        'wire_bytes': writer.sent_bytes._value.get() / max(sent, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000')
+    parser.add_argument('--shards', default='1,4')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    port = free_port()
+    receiver = subprocess.Popen([sys.executable, os.path.join(ROOT, 'tools', 'remote_write_receiver.py'),
+                                 '--port', str(port), '--discard', '--report', '3600'],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        url = f'http://127.0.0.1:{port}/api/v1/write'
+        print(f"snappy: {'python-snappy' if snappy is not None else 'uncompressed fallback'}")
+        print(f"{'gpus':>6} {'shards':>6} {'text samples/s':>15} {'queued/s':>10} {'delivered/s':>12} "
+              f"{'queue MiB':>10} {'wire B/sample':>14}")
+        for size in (int(s) for s in args.sizes.split(',')):
+            for shards in (int(s) for s in args.shards.split(',')):
+                result = bench(url, size, shards, args.rounds)
+                print(f"{size:>6} {shards:>6} {result['scrape']:>15.0f} {result['queued']:>10.0f} "
+                      f"{result['delivered']:>12.0f} {result['queue_bytes'] / 2 ** 20:>10.2f} "
+                      f"{result['wire_bytes']:>14.1f}")
+    finally:
+        receiver.terminate()
+        receiver.wait(timeout=30)
+
+
+if __name__ == '__main__':
+    main()
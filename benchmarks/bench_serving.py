@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Serving Mode Benchmark
+Compares requests per second on /api/inference between the Flask dev server
+and the gunicorn launcher (gevent and gthread workers).
+
+Each mode is started as a subprocess on a free port, then hammered by a
+closed-loop asyncio client that keeps --concurrency requests in flight.
+
+    python benchmarks/bench_serving.py --concurrency 2000 --duration 20
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'applications', 'python-app')
+
+MODES = {
+    'dev': lambda port: [sys.executable, '-c',
+                         f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"],
+    'gunicorn-gevent': lambda port: [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                                     '--bind', f'127.0.0.1:{port}', '--worker-class', 'gevent', 'app:app'],
+    'gunicorn-gthread': lambda port: [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                                      '--bind', f'127.0.0.1:{port}', '--worker-class', 'gthread', 'app:app'],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not come up")
+
+
+async def hammer(url, concurrency, duration):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=60)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    async with session.post(url, json={}) as response:
+                        await response.read()
+                        if response.status != 200:
+                            errors += 1
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+def run_mode(mode, concurrency, duration):
+    port = free_port()
+    env = dict(os.environ)
+    env['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='bench_serving_')
+    server = subprocess.Popen(MODES[mode](port), cwd=APP_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        latencies, errors, elapsed = asyncio.run(
+            hammer(f'http://127.0.0.1:{port}/api/inference', concurrency, duration))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    latencies.sort()
+    count = len(latencies)
+    return {
+        'mode': mode,
+        'requests': count,
+        'errors': errors,
+        'rps': count / elapsed,
+        'p50': latencies[count // 2] if count else 0.0,
+        'p99': latencies[int(count * 0.99)] if count else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default=','.join(MODES), help='comma separated list of serving modes')
+    parser.add_argument('--concurrency', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=15)
+    args = parser.parse_args()
+
+    print(f"{'mode':<18} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 (s)':>8} {'p99 (s)':>8}")
+    for mode in args.modes.split(','):
+        result = run_mode(mode, args.concurrency, args.duration)
+        print(f"{result['mode']:<18} {result['requests']:>9} {result['errors']:>7} {result['rps']:>9.1f} "
+              f"{result['p50']:>8.3f} {result['p99']:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Metric Contention Benchmark
+Cost of one request's worth of metric updates (active connections inc/dec,
+request counter, duration histogram) with 1, 8 and 64 threads updating the
+same series, for the prometheus_client metrics and the per-thread ones
+python-app uses in single-process mode (its sharded counter and gauge, and
+the sparse histogram).
+
+    python benchmarks/bench_sharded_metrics.py --threads 1,8,64
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'applications', 'python-app'))
+sys.path.insert(0, os.path.join(ROOT, 'common'))
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+from sharded import ShardedCounter, ShardedGauge
+from sparse_histogram import SparseHistogram
+
+KINDS = {
+    'client': (Counter, Histogram, Gauge),
+    'sharded': (ShardedCounter, SparseHistogram, ShardedGauge),
+}
+
+
+def request_metrics(kind):
+    counter, histogram, gauge = KINDS[kind]
+    registry = CollectorRegistry()
+    count = counter('app_requests_total', 'Total number of requests', ['method', 'endpoint', 'status'],
+                    registry=registry)
+    duration = histogram('app_request_duration_seconds', 'Request duration in seconds', ['method', 'endpoint'],
+                         registry=registry)
+    active = gauge('app_active_connections', 'Number of active connections', registry=registry)
+    return registry, count.labels('GET', '/api/test', '200'), duration.labels('GET', '/api/test'), active
+
+
+def bench(kind, threads, total):
+    """Nanoseconds per simulated request with `threads` writers"""
+    registry, count, duration, active = request_metrics(kind)
+    per_thread = total // threads
+    barrier = threading.Barrier(threads + 1)
+
+    def worker():
+        barrier.wait()
+        for _ in range(per_thread):
+            active.inc()
+            count.inc()
+            duration.observe(0.03)
+            active.dec()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    body = generate_latest(registry).decode()
+    assert f'app_requests_total{{endpoint="/api/test",method="GET",status="200"}} {per_thread * threads}.0' in body
+    return elapsed / (per_thread * threads) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', default='1,8,64')
+    parser.add_argument('--requests', type=int, default=256000)
+    args = parser.parse_args()
+
+    print(f"{'threads':>7} {'client ns/req':>14} {'sharded ns/req':>15} {'speedup':>8}")
+    for threads in (int(t) for t in args.threads.split(',')):
+        client = bench('client', threads, args.requests)
+        sharded = bench('sharded', threads, args.requests)
+        print(f"{threads:>7} {client:>14.0f} {sharded:>15.0f} {client / sharded:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
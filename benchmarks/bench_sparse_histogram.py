@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Sparse Histogram Benchmark
+Memory, scrape size and p99 accuracy of a latency histogram with the
+client's default buckets, with fixed buckets as fine as a sparse histogram's,
+and as a SparseHistogram (common/sparse_histogram.py).
+
+Every variant gets --series label sets, each fed --observations latencies
+from a log-normal around 0.4 s (mostly 0.1-2 s, like inference). Memory is
+what tracemalloc sees allocated by creating and filling the metric. Scrape
+sizes are the text body and the protobuf body, which for the sparse
+histogram also carries the native buckets. p99 error is the worst relative error
+over the series of the quantile interpolated within its bucket, as
+histogram_quantile() does, against the exact p99 of the observations.
+
+    python benchmarks/bench_sparse_histogram.py --series 1,50 --observations 10000
+"""
+
+import argparse
+import math
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+
+import numpy as np
+from prometheus_client import CollectorRegistry, Histogram
+
+from exposition_formats import PROTOBUF, TEXT, generate
+from sparse_histogram import DEFAULT_SCHEMA, SparseHistogram
+
+# Classic buckets with the sparse histogram's resolution (8 per doubling) from 1 ms to 60 s
+FINE_BUCKETS = tuple(2 ** (i / 2 ** DEFAULT_SCHEMA) for i in range(-80, 48))
+
+
+def bucket_quantile(q, bounds, counts):
+    """histogram_quantile(): linear interpolation inside the bucket holding rank q"""
+    total = sum(counts)
+    rank, cumulative, lower = q * total, 0, 0.0
+    for bound, count in zip(bounds, counts):
+        if count and cumulative + count >= rank:
+            if bound == math.inf:
+                return lower
+            return lower + (bound - lower) * (rank - cumulative) / count
+        cumulative += count
+        lower = bound
+    return lower
+
+
+def classic_p99(family):
+    series = {}
+    for sample in family.samples:
+        if sample.name.endswith('_bucket'):
+            key = sample.labels['series']
+            series.setdefault(key, []).append((float(sample.labels['le']), sample.value))
+    estimates = {}
+    for key, buckets in series.items():
+        buckets.sort()
+        bounds = [bound for bound, _ in buckets]
+        counts = [value - previous for (_, value), (_, previous) in zip(buckets, [(0, 0)] + buckets[:-1])]
+        estimates[key] = bucket_quantile(0.99, bounds, counts)
+    return estimates
+
+
+def native_p99(family):
+    estimates = {}
+    for key, native in family.native.items():
+        base = 2 ** (2 ** -native.schema)
+        indexes = sorted(native.positive)
+        bounds = [base ** index for index in indexes]
+        lowers = [base ** (index - 1) for index in indexes]
+        counts = [native.positive[index] for index in indexes]
+        rank, cumulative = 0.99 * (sum(counts) + native.zero_count), native.zero_count
+        for lower, bound, count in zip(lowers, bounds, counts):
+            if cumulative + count >= rank:
+                estimates[dict(key)['series']] = lower + (bound - lower) * (rank - cumulative) / count
+                break
+            cumulative += count
+    return estimates
+
+
+def bench(kind, series, values):
+    registry = CollectorRegistry()
+    tracemalloc.start()
+    if kind == 'sparse':
+        histogram = SparseHistogram('latency_seconds', 'Latency', ['series'], registry=registry)
+    else:
+        buckets = FINE_BUCKETS if kind == 'fine' else Histogram.DEFAULT_BUCKETS
+        histogram = Histogram('latency_seconds', 'Latency', ['series'], registry=registry, buckets=buckets)
+    for s in range(series):
+        child = histogram.labels(str(s))
+        for value in values[s].tolist():
+            child.observe(value)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    family = next(iter(registry.collect()))
+    estimates = native_p99(family) if kind == 'sparse' else classic_p99(family)
+    exact = np.percentile(values, 99, axis=1)
+    error = max(abs(estimates[str(s)] - exact[s]) / exact[s] for s in range(series))
+    return {
+        'memory': memory,
+        'text': len(generate(registry, TEXT)),
+        'protobuf': len(generate(registry, PROTOBUF)),
+        'error': error,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--series', default='1,50')
+    parser.add_argument('--observations', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"fine classic buckets: {len(FINE_BUCKETS)}, default: {len(Histogram.DEFAULT_BUCKETS)}")
+    print(f"{'series':>6} {'histogram':>9} {'KiB':>8} {'text KiB':>9} {'protobuf KiB':>13} {'p99 error':>10}")
+    for series in (int(s) for s in args.series.split(',')):
+        values = rng.lognormal(math.log(0.4), 0.6, (series, args.observations))
+        for kind in ('default', 'fine', 'sparse'):
+            result = bench(kind, series, values)
+            print(f"{series:>6} {kind:>9} {result['memory'] / 1024:>8.1f} {result['text'] / 1024:>9.1f} "
+                  f"{result['protobuf'] / 1024:>13.1f} {result['error']:>9.1%}")
+
+
+if __name__ == '__main__':
+    main()
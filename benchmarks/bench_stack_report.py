@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Stack Report Benchmark
+How long a health report takes and how much it asks of Prometheus, against
+tools/fake_prometheus.py with --latency added to every response.
+
+For each --targets size reports the requests and response bytes of the old
+system_report.sh calls (`up`, the whole __name__ value list and alerts,
+one connection each, in series) and the time of tools/stack_report.py's
+report with one connection, with --connections and from a warm cache.
+
+    python benchmarks/bench_stack_report.py --targets 100,1000 --latency 20
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+from fake_prometheus import serve
+from stack_report import PrometheusClient, ResponseCache, collect
+
+SHELL_REQUESTS = ['/api/v1/query?query=up', '/api/v1/label/__name__/values', '/api/v1/alerts']
+
+
+def shell_report(url):
+    """(seconds, bytes) of system_report.sh's three serial requests"""
+    start = time.perf_counter()
+    size = 0
+    for path in SHELL_REQUESTS:
+        with urllib.request.urlopen(url + path) as response:
+            size += len(response.read())
+    return time.perf_counter() - start, size
+
+
+def timed_report(url, connections, cache_dir=None, runs=1):
+    cache = ResponseCache(cache_dir) if cache_dir else None
+    client = PrometheusClient(url, connections=connections, cache=cache, ttl=60.0 if cache_dir else 0.0)
+    try:
+        for _ in range(runs):
+            report = collect(client, top=10, docker=False)
+    finally:
+        client.close()
+    return report['seconds'], report['requests']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--targets', default='100,1000', help='GPU node targets')
+    parser.add_argument('--latency', type=float, default=20.0, help='milliseconds added to every response')
+    parser.add_argument('--connections', type=int, default=8)
+    args = parser.parse_args()
+
+    print(f"{'targets':>7} {'shell ms':>9} {'shell KiB':>10} {'serial ms':>10} {'pooled ms':>10} "
+          f"{'cached ms':>10} {'requests':>9}")
+    for targets in (int(t) for t in args.targets.split(',')):
+        server = serve(0, targets, latency=args.latency / 1000)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+        try:
+            shell, size = shell_report(url)
+            serial, requests = timed_report(url, 1)
+            pooled, _ = timed_report(url, args.connections)
+            with tempfile.TemporaryDirectory() as cache_dir:
+                cached, cached_requests = timed_report(url, args.connections, cache_dir, runs=2)
+        finally:
+            server.shutdown()
+            server.server_close()
+        print(f"{targets:>7} {shell * 1000:>9.0f} {size / 1024:>10.1f} {serial * 1000:>10.0f} "
+              f"{pooled * 1000:>10.0f} {cached * 1000:>10.0f} {f'{requests} ({cached_requests})':>9}")
+    print("requests: per report, in parentheses once cached")
+
+
+if __name__ == '__main__':
+    main()
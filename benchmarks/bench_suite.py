@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Exporter Benchmark Suite
+Update and scrape cost of all three exporters over a sweep of their sizes,
+saved as JSON and compared against a baseline run to flag regressions.
+
+    app  python-app's /metrics through the Flask test client, with
+         --endpoints routes' worth of request series (method, endpoint and
+         status label sets); a tick is one update_gpu_metrics() call
+    gpu  a GPUFleet of --gpus GPUs behind FleetCollector and
+         prometheus_client's start_http_server, as gpu_simulator runs it; a
+         tick is one GPUFleet.step()
+    ml   ml_simulator's WorkloadSimulator with --jobs training jobs kept
+         running, served by exposition_formats.start_http_server; a tick is
+         one WorkloadSimulator.tick(), the body of update_metrics_loop
+
+Each case runs in its own process for --rounds rounds: one timed tick, then
+every one of --scrapers threads scrapes once, concurrently, as several
+Prometheus replicas would after an update. Reported per case: tick time
+(p50, mean), scrape latency (p50, p95, p99), exposition bytes and series,
+and the process's peak RSS. Scrapers run in the exporter's process, so
+scrape latency includes the client's share of the GIL; that is the same in
+every run, which is what a baseline comparison needs.
+
+A case regresses when a tracked value (tick p50, scrape p95, exposition
+bytes, peak RSS) is more than --tolerance above the baseline's. Time
+differences under --min-delta-ms are ignored as noise. The exit status is 1
+when anything regressed. Baselines are only comparable on the same machine.
+
+    python benchmarks/bench_suite.py --output baseline.json
+    python benchmarks/bench_suite.py --baseline baseline.json --output after.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+APP_DIR = os.path.join(ROOT, 'applications', 'python-app')
+sys.path.insert(0, os.path.join(ROOT, 'simulators'))
+sys.path.insert(0, os.path.join(ROOT, 'common'))
+
+from bench_serving import free_port, wait_for_port
+
+RESULT_PREFIX = 'RESULT '
+TRACKED = [('tick_ms', 'p50'), ('scrape_ms', 'p95'), ('exposition_bytes', None), ('peak_rss_mb', None)]
+SIZE_PARAMS = {'app': 'endpoints', 'gpu': 'gpus', 'ml': 'jobs'}
+
+
+# --- Cases (run in a child process) ---------------------------------------
+
+def http_scraper(port):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+
+    def scrape():
+        connection.request('GET', '/metrics')
+        response = connection.getresponse()
+        return response.read()
+    return scrape
+
+
+def setup_app(endpoints, scrapers):
+    sys.path.insert(0, APP_DIR)
+    import app as app_module
+
+    # Label sets as if the app had `endpoints` routes, each seen with a 200 and a 500
+    for i in range(endpoints):
+        endpoint = f'/api/route{i}'
+        for status in ('200', '500'):
+            app_module.request_count.labels(method='GET', endpoint=endpoint, status=status).inc()
+        app_module.request_duration.labels(method='GET', endpoint=endpoint).observe(0.05 + (i % 50) / 100)
+        app_module.request_cpu_time.labels(method='GET', endpoint=endpoint).inc(0.001)
+
+    def scraper():
+        client = app_module.app.test_client()
+        return lambda: client.get('/metrics').data
+
+    return (lambda: app_module.update_gpu_metrics(app_module.scenario)), [scraper() for _ in range(scrapers)]
+
+
+def setup_gpu(gpus, scrapers):
+    from prometheus_client import CollectorRegistry, start_http_server
+
+    from gpu_simulator import FleetCollector, GPUFleet
+
+    fleet = GPUFleet(gpus, rng=np.random.default_rng(0))
+    fleet.step()
+    registry = CollectorRegistry()
+    registry.register(FleetCollector(fleet))
+    port = free_port()
+    start_http_server(port, addr='127.0.0.1', registry=registry)
+    wait_for_port(port)
+    return fleet.step, [http_scraper(port) for _ in range(scrapers)]
+
+
+def setup_ml(jobs, scrapers):
+    import ml_simulator
+    from exposition_formats import start_http_server
+    from prometheus_client import REGISTRY
+    from scenario import ScenarioEngine
+
+    engine = ScenarioEngine('ml-simulator', seed=0, tick=ml_simulator.UPDATE_INTERVAL)
+    simulator = ml_simulator.WorkloadSimulator(np.random.default_rng(0), grace_ticks=6)
+    models = ['transformer', 'cnn', 'rnn', 'gan']
+
+    def top_up():
+        # The simulator runs at most 4 jobs; keep `jobs` running, replacing finished ones
+        while len(simulator.training_jobs) < jobs:
+            job = ml_simulator.TrainingJob(f'job_{simulator.job_counter}', models[simulator.job_counter % 4],
+                                           engine.rng)
+            simulator.training_jobs.append(job)
+            simulator.job_counter += 1
+
+    top_up()
+    port = free_port()
+    start_http_server(port, addr='127.0.0.1', registry=REGISTRY)
+    wait_for_port(port)
+    return (lambda: engine.step(simulator.tick)), [http_scraper(port) for _ in range(scrapers)], top_up
+
+
+def percentiles(values_ms, *qs):
+    return {f'p{q:g}': float(np.percentile(values_ms, q)) for q in qs} if values_ms else {}
+
+
+def run_case(case):
+    exporter, size, scrapers, rounds = case['exporter'], case['size'], case['scrapers'], case['rounds']
+    setup = {'app': setup_app, 'gpu': setup_gpu, 'ml': setup_ml}[exporter](size, scrapers)
+    tick, scrape_fns = setup[0], setup[1]
+    between = setup[2] if len(setup) > 2 else None
+
+    ticks, scrapes = [], []
+    lock = threading.Lock()
+    body = b''
+
+    def scrape(fn):
+        nonlocal body
+        start = time.perf_counter()
+        data = fn()
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            scrapes.append(elapsed)
+            body = data
+
+    for _ in range(rounds):
+        if between is not None:
+            between()
+        start = time.perf_counter()
+        tick()
+        ticks.append((time.perf_counter() - start) * 1000)
+        threads = [threading.Thread(target=scrape, args=(fn,)) for fn in scrape_fns]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    series = sum(1 for line in body.splitlines() if line and not line.startswith(b'#'))
+    return dict(case, **{
+        'tick_ms': dict(percentiles(ticks, 50, 99), mean=float(np.mean(ticks))),
+        'scrape_ms': percentiles(scrapes, 50, 95, 99),
+        'exposition_bytes': len(body),
+        'series': series,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+
+
+# --- Sweep, report and baseline comparison --------------------------------
+
+def case_key(result):
+    return f"{result['exporter']} {SIZE_PARAMS[result['exporter']]}={result['size']} scrapers={result['scrapers']}"
+
+
+def run_child(case):
+    process = subprocess.run([sys.executable, __file__, '--case', json.dumps(case)],
+                             capture_output=True, text=True, cwd=ROOT)
+    for line in reversed(process.stdout.splitlines()):
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"{json.dumps(case)} failed:\n{process.stderr[-2000:]}")
+
+
+def tracked_value(result, metric, stat):
+    value = result.get(metric)
+    return value.get(stat) if stat else value
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """{case key: [(metric, base, new, regressed)]} for the cases in both runs"""
+    base_by_key = {case_key(result): result for result in baseline['results']}
+    changes = {}
+    for result in results:
+        base = base_by_key.get(case_key(result))
+        if base is None:
+            continue
+        rows = []
+        for metric, stat in TRACKED:
+            old, new = tracked_value(base, metric, stat), tracked_value(result, metric, stat)
+            if old is None or new is None:
+                continue
+            regressed = new > old * (1 + tolerance)
+            if metric.endswith('_ms') and new - old < min_delta_ms:
+                regressed = False
+            rows.append((metric + (f'.{stat}' if stat else ''), old, new, regressed))
+        changes[case_key(result)] = rows
+    return changes
+
+
+def print_results(results, changes=None):
+    width = max(len(case_key(result)) for result in results)
+    print(f"{'case':<{width}} {'tick p50':>9} {'scrape p50':>11} {'p95':>8} {'p99':>8} {'bytes':>10} "
+          f"{'series':>7} {'RSS MiB':>8}")
+    for result in results:
+        scrape = result['scrape_ms']
+        print(f"{case_key(result):<{width}} {result['tick_ms']['p50']:>7.3f}ms {scrape['p50']:>9.2f}ms "
+              f"{scrape['p95']:>6.2f}ms {scrape['p99']:>6.2f}ms {result['exposition_bytes']:>10} "
+              f"{result['series']:>7} {result['peak_rss_mb']:>8.1f}")
+        for metric, old, new, regressed in (changes or {}).get(case_key(result), []):
+            if regressed:
+                print(f"  REGRESSION {metric}: {old:.4g} -> {new:.4g} ({new / old - 1:+.0%})")
+
+
+def machine():
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'machine': platform.node()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--exporters', default='app,gpu,ml')
+    parser.add_argument('--endpoints', default='10,100,1000', help='app: routes worth of request series')
+    parser.add_argument('--gpus', default='8,512,4096', help='gpu: fleet sizes')
+    parser.add_argument('--jobs', default='4,64,512', help='ml: concurrent training jobs')
+    parser.add_argument('--scrapers', default='1,4', help='concurrent scrapers after every tick')
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='allowed relative increase')
+    parser.add_argument('--min-delta-ms', type=float, default=0.5, help='ignore smaller time increases')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(RESULT_PREFIX + json.dumps(run_case(json.loads(args.case))), flush=True)
+        return
+
+    sizes = {'app': args.endpoints, 'gpu': args.gpus, 'ml': args.jobs}
+    cases = [{'exporter': exporter, 'size': int(size), 'scrapers': int(scrapers), 'rounds': args.rounds}
+             for exporter in args.exporters.split(',')
+             for size in sizes[exporter].split(',')
+             for scrapers in args.scrapers.split(',')]
+    results = []
+    for case in cases:
+        print(f"running {case_key(case)}", file=sys.stderr, flush=True)
+        results.append(run_child(case))
+
+    changes = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('machine') != machine():
+            print(f"warning: the baseline was recorded on {baseline.get('machine')}, this is {machine()}",
+                  file=sys.stderr)
+        changes = compare(results, baseline, args.tolerance, args.min_delta_ms)
+    print_results(results, changes)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'machine': machine(), 'time': time.time(), 'results': results}, f, indent=2)
+    if changes is not None:
+        regressions = sum(regressed for rows in changes.values() for *_, regressed in rows)
+        print(f"\n{regressions} regressions in {len(changes)} cases compared against {args.baseline}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
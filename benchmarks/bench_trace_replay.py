@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Trace Replay Benchmark
+Cost of the request trace format and how fast the load generator can
+replay a trace.
+
+Writes a synthetic trace of --requests requests (a mix of GETs and POSTs
+with small JSON bodies, Poisson arrivals), then reports write and index
+rates and bytes per request. The trace is then replayed at max speed with
+each --workers count against --servers minimal aiohttp server processes
+sharing one port, which answer every request immediately, so the numbers
+are close to the replayer's own ceiling.
+
+    python benchmarks/bench_trace_replay.py --requests 200000 --workers 1,2,4
+"""
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'common'))
+
+from bench_serving import free_port, wait_for_port
+from tracefile import TraceReader, TraceWriter, merged_order
+
+SERVER = """
+from aiohttp import web
+async def ok(request):
+    await request.read()
+    return web.Response(text='ok')
+app = web.Application()
+app.router.add_route('*', '/{tail:.*}', ok)
+web.run_app(app, host='127.0.0.1', port=%d, reuse_port=True, print=None, access_log=None)
+"""
+
+PATHS = [('GET', '/'), ('GET', '/api/test'), ('GET', '/api/test?debug=1'), ('POST', '/api/inference')]
+
+
+def write_trace(path, requests, rate, rng):
+    writer = TraceWriter(path, start=0.0)
+    now = 0.0
+    start = time.perf_counter()
+    for _ in range(requests):
+        now += rng.expovariate(rate)
+        method, url = rng.choice(PATHS)
+        body = b'{"prompt": "benchmark"}' if method == 'POST' else b''
+        writer.write(now, method, url, 200, rng.uniform(0.01, 0.5), body)
+    writer.close()
+    return time.perf_counter() - start
+
+
+def replay(path, port, workers):
+    env = dict(os.environ, REPLAY_TRACE=path, REPLAY_TARGET=f'http://127.0.0.1:{port}', REPLAY_SPEED='max',
+               REPLAY_WORKERS=str(workers), METRICS_PORT='0', REPORT_INTERVAL='3600', MAX_IN_FLIGHT='512')
+    start = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(ROOT, 'applications', 'load-generator', 'load_generator.py')],
+                   env=env, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200000)
+    parser.add_argument('--rate', type=float, default=1000.0, help='captured requests per second')
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--servers', type=int, default=4, help='server processes to replay against')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.trace')
+        written = write_trace(path, args.requests, args.rate, random.Random(0))
+        size = os.path.getsize(path)
+
+        start = time.perf_counter()
+        reader = TraceReader(path)
+        indexed = time.perf_counter() - start
+        start = time.perf_counter()
+        order = merged_order([reader])
+        for reader_, index, _ in order:
+            reader_.request(index)
+        read = time.perf_counter() - start
+        reader.close()
+
+        print(f"requests:  {args.requests}, {size / args.requests:.1f} bytes per request ({size / 2 ** 20:.1f} MiB)")
+        print(f"write:     {args.requests / written:10.0f} requests/s")
+        print(f"index:     {args.requests / indexed:10.0f} requests/s")
+        print(f"sort+read: {args.requests / read:10.0f} requests/s")
+
+        port = free_port()
+        servers = [subprocess.Popen([sys.executable, '-c', SERVER % port],
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                   for _ in range(args.servers)]
+        try:
+            wait_for_port(port)
+            print(f"{'workers':>7} {'seconds':>8} {'replayed req/s':>15}")
+            for workers in (int(w) for w in args.workers.split(',')):
+                elapsed = replay(path, port, workers)
+                print(f"{workers:>7} {elapsed:>8.1f} {args.requests / elapsed:>15.0f}")
+        finally:
+            for server in servers:
+                server.terminate()
+                server.wait(timeout=30)
+
+
+if __name__ == '__main__':
+    main()
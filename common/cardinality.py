@@ -0,0 +1,78 @@
+"""
+Cardinality Limiter
+Caps how many label sets each metric may create, shared by every metric in
+a registry.
+
+Metrics labelled with something unbounded (job ids, request ids) grow a new
+child, and a new Prometheus series, for every value. Writes go through
+CardinalityLimiter.labels() instead of metric.labels(): label sets already
+known pass straight through; a new one is admitted while the metric is
+under its cap, otherwise the write lands in a single overflow series (every
+label set to OVERFLOW_VALUE) and cardinality_series_dropped_total counts the
+refused label set. remove() retires a series and frees its slot.
+
+The limit is opt-in per call site, not enforced by the registry: only
+writes made through limiter.labels() are counted and capped. A plain
+metric.labels() call on the same metric bypasses the limiter entirely, and
+the series it creates do not count towards the cap, so every write to a
+limited metric has to go through the limiter.
+"""
+
+import threading
+
+from prometheus_client import REGISTRY, Counter
+
+OVERFLOW_VALUE = 'overflow'
+
+
+class CardinalityLimiter:
+    def __init__(self, max_series=1000, limits=None, registry=REGISTRY):
+        self.max_series = max_series
+        self.limits = dict(limits or {})  # per-metric caps overriding max_series
+        self._series = {}
+        self._refused = {}
+        self._lock = threading.Lock()
+        self.dropped = Counter(
+            'cardinality_series_dropped',
+            'New label sets refused by the cardinality limiter and written to the overflow series',
+            ['metric'],
+            registry=registry
+        )
+
+    def limit(self, name):
+        return self.limits.get(name, self.max_series)
+
+    def labels(self, metric, *labelvalues):
+        """metric.labels(*labelvalues), or the overflow child once the metric is full"""
+        key = tuple(str(value) for value in labelvalues)
+        name = metric._name
+        with self._lock:
+            series = self._series.setdefault(name, set())
+            if key in series:
+                return metric.labels(*key)
+            if len(series) < self.limit(name):
+                series.add(key)
+                return metric.labels(*key)
+
+            # Count each refused label set once; the memory of refused sets is
+            # itself capped and starts over when full
+            refused = self._refused.setdefault(name, set())
+            if key not in refused:
+                if len(refused) >= self.limit(name):
+                    refused.clear()
+                refused.add(key)
+                self.dropped.labels(name).inc()
+        return metric.labels(*(OVERFLOW_VALUE,) * len(key))
+
+    def remove(self, metric, *labelvalues):
+        """Drop a series from the metric and free its slot"""
+        key = tuple(str(value) for value in labelvalues)
+        with self._lock:
+            series = self._series.get(metric._name, set())
+            if key not in series:
+                return
+            series.discard(key)
+        metric.remove(*key)
+
+    def series_count(self, metric):
+        return len(self._series.get(metric._name, ()))
@@ -0,0 +1,268 @@
+"""
+Exposition Formats
+Encodes metric families as the Prometheus text format, OpenMetrics or the
+Prometheus protobuf format, whichever the scraper asks for in its Accept
+header.
+
+Text is what every scraper understands. OpenMetrics adds exemplars, so a
+latency bucket links to the request id that landed in it. Protobuf
+(io.prometheus.client.MetricFamily, length-delimited) is the only format
+that carries the exponential buckets of a SparseHistogram
+(common/sparse_histogram.py) as a native histogram; it is encoded by hand
+here, like the remote-write messages, so there is no protobuf dependency.
+Prometheus asks for it once native histograms are enabled.
+
+Families are encoded one at a time so callers can cache the encoding of
+families that did not change (see python-app's exposition.py).
+"""
+
+import gzip
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from prometheus_client import REGISTRY
+from prometheus_client import exposition as text_format
+from prometheus_client.openmetrics import exposition as openmetrics_format
+from prometheus_client.utils import INF
+
+TEXT = 'text'
+OPENMETRICS = 'openmetrics'
+PROTOBUF = 'protobuf'
+
+PROTOBUF_CONTENT_TYPE = 'application/vnd.google.protobuf; proto=io.prometheus.client.MetricFamily; encoding=delimited'
+CONTENT_TYPES = {
+    TEXT: text_format.CONTENT_TYPE_LATEST,
+    OPENMETRICS: openmetrics_format.CONTENT_TYPE_LATEST,
+    PROTOBUF: PROTOBUF_CONTENT_TYPE,
+}
+
+_EOF = b'# EOF\n'
+_DOUBLE = struct.Struct('<d')
+
+# MetricType values from metrics.proto
+_COUNTER, _GAUGE, _SUMMARY, _UNTYPED, _HISTOGRAM, _GAUGE_HISTOGRAM = range(6)
+
+
+def choose_format(accept):
+    """The supported format with the highest q-value in an Accept header, text by default"""
+    best, best_q = TEXT, 0.0
+    for item in (accept or '').split(','):
+        params = [part.strip() for part in item.split(';')]
+        media_type = params[0].lower()
+        options = dict(param.split('=', 1) for param in params[1:] if '=' in param)
+        try:
+            q = float(options.get('q', 1.0))
+        except ValueError:
+            continue
+        if media_type == 'application/vnd.google.protobuf':
+            if options.get('proto') != 'io.prometheus.client.MetricFamily' or options.get('encoding') != 'delimited':
+                continue
+            fmt = PROTOBUF
+        elif media_type == 'application/openmetrics-text':
+            fmt = OPENMETRICS
+        elif media_type in ('text/plain', '*/*'):
+            fmt = TEXT
+        else:
+            continue
+        if q > best_q:
+            best, best_q = fmt, q
+    return best
+
+
+class _SingleFamily:
+    """Registry stand-in so generate_latest() encodes exactly one family"""
+
+    def __init__(self, family):
+        self.family = family
+
+    def collect(self):
+        return [self.family]
+
+
+def encode_family(family, fmt=TEXT):
+    """One family's part of a body; join the parts with finish()"""
+    if fmt == PROTOBUF:
+        message = _metric_family(family)
+        return _varint(len(message)) + message
+    if fmt == OPENMETRICS:
+        # Every OpenMetrics body ends in a single # EOF, added by finish()
+        return openmetrics_format.generate_latest(_SingleFamily(family))[:-len(_EOF)]
+    return text_format.generate_latest(_SingleFamily(family))
+
+
+def finish(parts, fmt=TEXT):
+    body = b''.join(parts)
+    return body + _EOF if fmt == OPENMETRICS else body
+
+
+def generate(registry=REGISTRY, fmt=TEXT):
+    return finish([encode_family(family, fmt) for family in registry.collect()], fmt)
+
+
+def _varint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _key(number, wire_type):
+    return _varint(number << 3 | wire_type)
+
+
+def _uint(number, value):
+    return _key(number, 0) + _varint(int(value))
+
+
+def _sint(number, value):
+    return _key(number, 0) + _varint(value * 2 if value >= 0 else -value * 2 - 1)
+
+
+def _double(number, value):
+    return _key(number, 1) + _DOUBLE.pack(float(value))
+
+
+def _bytes(number, payload):
+    return _key(number, 2) + _varint(len(payload)) + payload
+
+
+def _string(number, value):
+    return _bytes(number, str(value).encode())
+
+
+def _label_pairs(labels):
+    return b''.join(_bytes(1, _string(1, name) + _string(2, value)) for name, value in labels.items())
+
+
+def _exemplar(exemplar):
+    message = _label_pairs(exemplar.labels) + _double(2, exemplar.value)
+    if exemplar.timestamp is not None:
+        seconds = int(exemplar.timestamp)
+        message += _bytes(3, _uint(1, seconds) + _uint(2, int((exemplar.timestamp - seconds) * 1e9)))
+    return message
+
+
+def _native(native):
+    parts = [_sint(5, native.schema), _double(6, native.zero_threshold), _uint(7, native.zero_count)]
+    for span_field, delta_field, buckets in ((9, 10, native.negative), (12, 13, native.positive)):
+        if not buckets:
+            continue
+        spans, deltas = native.spans(buckets)
+        parts.extend(_bytes(span_field, _sint(1, offset) + _uint(2, length)) for offset, length in spans)
+        packed = b''.join(_varint(d * 2 if d >= 0 else -d * 2 - 1) for d in deltas)
+        parts.append(_bytes(delta_field, packed))
+    return b''.join(parts)
+
+
+def _group(samples, exclude):
+    """Samples grouped by their labels minus `exclude`, in first-seen order"""
+    groups = {}
+    for sample in samples:
+        labels = {name: value for name, value in sample.labels.items() if name != exclude}
+        groups.setdefault(tuple(sorted(labels.items())), (labels, []))[1].append(sample)
+    return groups
+
+
+def _histogram(family, name, key, samples, suffixes):
+    count_suffix, sum_suffix = suffixes
+    count = total = 0
+    buckets = []
+    for sample in samples:
+        if sample.name == name + '_bucket':
+            bound = float(sample.labels['le'])
+            if bound != INF:  # +Inf is implied by sample_count
+                bucket = _uint(1, sample.value) + _double(2, bound)
+                if sample.exemplar is not None:
+                    bucket += _bytes(3, _exemplar(sample.exemplar))
+                buckets.append((bound, bucket))
+        elif sample.name == name + count_suffix:
+            count = sample.value
+        elif sample.name == name + sum_suffix:
+            total = sample.value
+    message = _uint(1, count) + _double(2, total)
+    message += b''.join(_bytes(3, bucket) for _, bucket in sorted(buckets, key=lambda b: b[0]))
+    native = getattr(family, 'native', {}).get(key)
+    if native is not None:
+        message += _native(native)
+    return message
+
+
+def _metric_family(family):
+    name, kind = family.name, family.type
+    metrics = []
+    if kind in ('histogram', 'gaugehistogram'):
+        suffixes = ('_count', '_sum') if kind == 'histogram' else ('_gcount', '_gsum')
+        for key, (labels, samples) in _group(family.samples, 'le').items():
+            body = _histogram(family, name, key, samples, suffixes)
+            metrics.append(_label_pairs(labels) + _bytes(7, body))
+        proto_type = _HISTOGRAM if kind == 'histogram' else _GAUGE_HISTOGRAM
+    elif kind == 'summary':
+        for key, (labels, samples) in _group(family.samples, 'quantile').items():
+            body = b''
+            for sample in samples:
+                if sample.name == name + '_count':
+                    body += _uint(1, sample.value)
+                elif sample.name == name + '_sum':
+                    body += _double(2, sample.value)
+                elif sample.name == name:
+                    body += _bytes(3, _double(1, float(sample.labels['quantile'])) + _double(2, sample.value))
+            metrics.append(_label_pairs(labels) + _bytes(4, body))
+        proto_type = _SUMMARY
+    elif kind == 'counter':
+        name += '_total'
+        for sample in family.samples:
+            if sample.name == name:
+                body = _double(1, sample.value)
+                if sample.exemplar is not None:
+                    body += _bytes(2, _exemplar(sample.exemplar))
+                metrics.append(_label_pairs(sample.labels) + _bytes(3, body))
+        proto_type = _COUNTER
+    else:
+        # gauge, info, stateset and unknown are single values per sample
+        if kind == 'info':
+            name += '_info'
+        proto_type = _UNTYPED if kind == 'unknown' else _GAUGE
+        field = 5 if proto_type == _UNTYPED else 2
+        for sample in family.samples:
+            if sample.name == name:
+                metrics.append(_label_pairs(sample.labels) + _bytes(field, _double(1, sample.value)))
+    return (_string(1, name) + _string(2, family.documentation) + _uint(3, proto_type)
+            + b''.join(_bytes(4, metric) for metric in metrics))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        fmt = choose_format(self.headers.get('Accept'))
+        try:
+            body = generate(self.registry, fmt)
+        except Exception as e:
+            self.send_error(500, f'error generating metric output: {e}')
+            raise
+        headers = {'Content-Type': CONTENT_TYPES[fmt]}
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            headers['Content-Encoding'] = 'gzip'
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, addr='0.0.0.0', registry=REGISTRY):
+    """prometheus_client.start_http_server with protobuf and OpenMetrics negotiation"""
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, thread
@@ -0,0 +1,313 @@
+"""
+Metric Recorder
+Snapshots every sample of one or more registries at each update tick into
+a compact columnar recording, so an incident can be analysed or replayed
+offline without Prometheus.
+
+A recording is a directory of four files:
+
+    ticks.bin    header (magic, first tick's Unix time, ticks, samples)
+                 then per tick <I ms since the previous tick> <I samples>
+    ids.bin      <I series id> per sample
+    values.bin   <d value> per sample
+    series.jsonl the labels (with __name__) of series id N on line N
+
+Timestamps are delta-encoded per tick, and values are change-encoded: a
+tick only writes the series whose value differs from the one last written,
+plus a NaN for each series that disappeared, so gauges that hold still and
+idle counters cost nothing. The column files are memory-mapped and grown
+in doubling steps; a tick is committed by rewriting the header counts after
+its samples are in place, so a reader (even of a live recording) never sees
+half a tick. The work per tick is one collect() of the sources and a dict
+lookup per sample; new series beyond max_series are dropped, and recording
+stops once the files reach max_bytes.
+
+Recording is read with NumPy: its id and value columns are views of the
+mapped files, and matrix() forward-fills the selected series onto the tick
+grid. The writer itself only needs the standard library, since python-app
+has no NumPy.
+"""
+
+import array
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+MAGIC = b'METREC01'
+HEADER = struct.Struct('<8sdQQ')
+TICK = struct.Struct('<II')
+ID_SIZE, VALUE_SIZE = 4, 8
+MAX_DELTA_MS = 0xffffffff
+INITIAL_CAPACITY = 1 << 20
+
+TICKS_FILE, IDS_FILE, VALUES_FILE, SERIES_FILE = 'ticks.bin', 'ids.bin', 'values.bin', 'series.jsonl'
+
+
+class RecordingFormatError(Exception):
+    pass
+
+
+class _Column:
+    """An append-only memory-mapped file, grown in doubling steps and trimmed on close"""
+
+    def __init__(self, path, prefix=b''):
+        self._file = open(path, 'w+b')
+        self.capacity = max(INITIAL_CAPACITY, len(prefix))
+        self._file.truncate(self.capacity)
+        self._map = mmap.mmap(self._file.fileno(), self.capacity)
+        self._map[:len(prefix)] = prefix
+        self.length = len(prefix)
+
+    def append(self, data):
+        end = self.length + len(data)
+        if end > self.capacity:
+            self._map.close()
+            self.capacity = max(end, self.capacity * 2)
+            self._file.truncate(self.capacity)
+            self._map = mmap.mmap(self._file.fileno(), self.capacity)
+        self._map[self.length:end] = data
+        self.length = end
+
+    def write_at(self, position, data):
+        self._map[position:position + len(data)] = data
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+        self._file.truncate(self.length)
+        self._file.close()
+
+
+def _little_endian(column):
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+
+class Recorder:
+    def __init__(self, path, max_series=100000, max_bytes=1 << 30):
+        self.path = path
+        self.max_series = max_series
+        self.max_bytes = max_bytes
+        self._sources = []
+        self._ids = {}  # (source, name, labels) -> series id
+        self._last = []  # last value written, by series id
+        self._present = set()
+        self._lock = threading.Lock()
+        self._columns = None  # opened by the first record(), so idle gunicorn workers create nothing
+        self._series_file = None
+        self.start = None
+        self._elapsed_ms = 0
+        self.ticks = 0
+        self.samples = 0
+        self.unchanged = 0
+        self.dropped = 0
+        self.bytes = 0
+        self.stopped = False
+
+    @classmethod
+    def from_env(cls):
+        """A recorder configured from RECORD_* variables, or None when RECORD_DIR is unset
+
+        {pid} in RECORD_DIR is replaced by the process id.
+        """
+        path = os.environ.get('RECORD_DIR')
+        if not path:
+            return None
+        recorder = cls(
+            path.format(pid=os.getpid()),
+            max_series=int(os.environ.get('RECORD_MAX_SERIES', '100000')),
+            max_bytes=int(float(os.environ.get('RECORD_MAX_MB', '1024')) * (1 << 20)),
+        )
+        print(f"Recording metric snapshots to {recorder.path} (at most {recorder.max_series} series, "
+              f"{recorder.max_bytes >> 20} MiB)")
+        return recorder
+
+    def add_source(self, registry, labels=None):
+        """Record every sample of a registry, with extra labels (e.g. job, instance) added"""
+        self._sources.append((registry, dict(labels or {})))
+
+    def _open(self):
+        os.makedirs(self.path, exist_ok=True)
+        self.bytes = HEADER.size
+        self._columns = (
+            _Column(os.path.join(self.path, TICKS_FILE), HEADER.pack(MAGIC, self.start, 0, 0)),
+            _Column(os.path.join(self.path, IDS_FILE)),
+            _Column(os.path.join(self.path, VALUES_FILE)),
+        )
+        self._series_file = open(os.path.join(self.path, SERIES_FILE), 'w')
+
+    def record(self, timestamp=None):
+        """Collect every source once and append the changed samples as one tick; returns how many were written"""
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            if self.stopped:
+                return 0
+            if self._columns is None:
+                self.start = timestamp
+                self._open()
+            ids, values = array.array('I'), array.array('d')
+            present = set()
+            new_series = []
+            last = self._last
+            for index, (registry, extra) in enumerate(self._sources):
+                for family in registry.collect():
+                    for sample in family.samples:
+                        key = (index, sample.name, tuple(sample.labels.items()))
+                        series = self._ids.get(key)
+                        if series is None:
+                            if len(self._ids) >= self.max_series:
+                                self.dropped += 1
+                                continue
+                            series = self._ids[key] = len(last)
+                            last.append(math.nan)
+                            new_series.append(dict(extra, __name__=sample.name, **sample.labels))
+                        present.add(series)
+                        value = sample.value
+                        if value != last[series]:
+                            ids.append(series)
+                            values.append(value)
+                            last[series] = value
+            self.unchanged += len(present) - len(ids)
+            # A NaN marks series that are gone, like a Prometheus staleness marker
+            for series in self._present - present:
+                ids.append(series)
+                values.append(math.nan)
+                last[series] = math.nan
+            self._present = present
+            self._append(timestamp, ids, values, new_series)
+            if self.bytes >= self.max_bytes:
+                self.stopped = True
+                print(f"Recording {self.path} reached {self.max_bytes >> 20} MiB after {self.ticks} ticks; "
+                      f"no longer recording")
+            return len(ids)
+
+    def _append(self, timestamp, ids, values, new_series):
+        if new_series:
+            self._series_file.write(''.join(json.dumps(labels) + '\n' for labels in new_series))
+            self._series_file.flush()
+        ticks, id_column, value_column = self._columns
+        id_column.append(_little_endian(ids).tobytes())
+        value_column.append(_little_endian(values).tobytes())
+        elapsed = round((timestamp - self.start) * 1000)
+        delta = min(max(elapsed - self._elapsed_ms, 0), MAX_DELTA_MS)
+        self._elapsed_ms += delta
+        ticks.append(TICK.pack(delta, len(ids)))
+        self.ticks += 1
+        self.samples += len(ids)
+        self.bytes += TICK.size + len(ids) * (ID_SIZE + VALUE_SIZE)
+        # Committing the counts last means readers only ever see whole ticks
+        ticks.write_at(0, HEADER.pack(MAGIC, self.start, self.ticks, self.samples))
+
+    def close(self):
+        with self._lock:
+            self.stopped = True
+            if self._columns is not None:
+                for column in self._columns:
+                    column.close()
+                self._series_file.close()
+                self._columns = None
+
+
+class Recording:
+    """A recording opened for reading with NumPy; ids and values are views of the mapped files"""
+
+    def __init__(self, path):
+        import numpy as np
+
+        self.path = path
+        self._maps = []
+        ticks_map = self._map(TICKS_FILE)
+        if len(ticks_map) < HEADER.size:
+            raise RecordingFormatError(f'{path}: too short to be a recording')
+        magic, self.start, ticks, samples = HEADER.unpack_from(ticks_map, 0)
+        if magic != MAGIC:
+            raise RecordingFormatError(f'{path}: not a metric recording (magic {magic!r})')
+        entries = np.frombuffer(ticks_map, dtype=[('delta_ms', '<u4'), ('samples', '<u4')],
+                                count=ticks, offset=HEADER.size)
+        self.timestamps = self.start + np.cumsum(entries['delta_ms'], dtype=np.int64) / 1000
+        self.offsets = np.zeros(ticks + 1, dtype=np.int64)
+        np.cumsum(entries['samples'], out=self.offsets[1:])
+        self.ids = np.frombuffer(self._map(IDS_FILE), dtype='<u4', count=samples) if samples else \
+            np.empty(0, dtype='<u4')
+        self.values = np.frombuffer(self._map(VALUES_FILE), dtype='<f8', count=samples) if samples else \
+            np.empty(0, dtype='<f8')
+        with open(os.path.join(path, SERIES_FILE)) as f:
+            self.labels = [json.loads(line) for line in f if line.endswith('\n')]
+
+    def _map(self, name):
+        with open(os.path.join(self.path, name), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b''
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        return mapped
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def select(self, name=None, **matchers):
+        """Ids of the series named `name` (any name when None) whose labels equal the matchers"""
+        return [i for i, labels in enumerate(self.labels)
+                if (name is None or labels['__name__'] == name)
+                and all(labels.get(key) == value for key, value in matchers.items())]
+
+    def changes(self, series):
+        """(timestamps, values) of the samples written for one series"""
+        import numpy as np
+
+        positions = np.flatnonzero(self.ids == series)
+        ticks = np.searchsorted(self.offsets, positions, side='right') - 1
+        return self.timestamps[ticks], self.values[positions]
+
+    def matrix(self, series, start=None, end=None):
+        """(timestamps, values) of the ticks in [start, end), one row of values per id in `series`
+
+        Values carry forward from the tick they were written in; NaN before a
+        series' first sample and while it is gone.
+        """
+        import numpy as np
+
+        first = 0 if start is None else int(np.searchsorted(self.timestamps, start))
+        stop = len(self) if end is None else int(np.searchsorted(self.timestamps, end))
+        series = np.asarray(series, dtype=np.int64)
+        width = len(series)
+        rows = np.full(len(self.labels), -1, dtype=np.int32)
+        rows[series] = np.arange(width, dtype=np.int32)
+
+        # Only the samples up to `end` matter, but from the first tick, for the carried-forward values.
+        # Row 0 of the arrays below is all NaN and row t + 1 holds tick t
+        end_sample = self.offsets[stop]
+        row = rows[self.ids[:end_sample]]
+        tick = np.repeat(np.arange(1, stop + 1, dtype=np.int32), np.diff(self.offsets[:stop + 1]))
+        values = self.values[:end_sample]
+        if width < len(self.labels):
+            keep = np.flatnonzero(row >= 0)
+            row, tick, values = row[keep], tick[keep], values[keep]
+        cell = tick.astype(np.int64) * width + row
+
+        # Tick-major like the file, so the scatters write memory in order; cells never written are never read
+        written = np.empty((stop + 1, width))
+        written[0] = np.nan
+        written.ravel()[cell] = values
+        # For each tick, the latest row at or before it where the series was written
+        latest = np.zeros((stop + 1, width), dtype=np.int32)
+        latest.ravel()[cell] = tick
+        np.maximum.accumulate(latest, axis=0, out=latest)
+        dense = np.take_along_axis(written, latest[1:], axis=0)
+        return self.timestamps[first:stop], dense[first:stop].T
+
+    def close(self):
+        # The arrays above are views of the maps; drop them first
+        self.ids = self.values = None
+        for mapped in self._maps:
+            try:
+                mapped.close()
+            except BufferError:
+                pass  # still exported to an array the caller holds; freed with it
+        self._maps = []
@@ -0,0 +1,391 @@
+"""
+Remote Write
+Pushes the samples of one or more registries to a Prometheus remote-write
+endpoint, as an alternative to being scraped.
+
+Requests are WriteRequest protobufs, encoded by hand (the schema is three
+tiny messages, so no protobuf dependency), snappy-compressed and POSTed the
+way Prometheus' own queue manager does. Each series is hashed to one of
+`shards` sender threads, which keeps its samples in order. A shard sends
+when it has max_samples_per_send samples or its oldest one has waited
+batch_send_deadline seconds. Recoverable failures (connection errors, 5xx,
+429) are retried with exponential backoff. Each shard queue holds at most
+`capacity` samples; samples pushed into a full queue are dropped and counted
+rather than blocking the simulator.
+
+Samples are queued already encoded, with the label part of every series
+encoded once and cached, so the queue's memory is exactly the payload bytes
+it holds (remote_write_queue_bytes).
+
+Snappy comes from python-snappy when it is installed. Without it, requests
+are sent as valid but uncompressed (literal-only) snappy blocks, and
+decompress() falls back to a pure Python decoder.
+"""
+
+import http.client
+import os
+import struct
+import threading
+import time
+import urllib.parse
+from collections import deque
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+_DOUBLE = struct.Struct('<d')
+
+
+def _varint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _field(tag, payload):
+    """A length-delimited protobuf field"""
+    return tag + _varint(len(payload)) + payload
+
+
+def encode_labels(labels):
+    """The repeated Label fields of a TimeSeries, sorted by name as Prometheus requires"""
+    return b''.join(
+        _field(b'\x0a', _field(b'\x0a', name.encode()) + _field(b'\x12', str(value).encode()))
+        for name, value in sorted(labels.items())
+    )
+
+
+def encode_series(encoded_labels, value, timestamp_varint):
+    """One WriteRequest.timeseries entry holding a single sample"""
+    sample = b'\x09' + _DOUBLE.pack(value) + b'\x10' + timestamp_varint
+    return _field(b'\x0a', encoded_labels + _field(b'\x12', sample))
+
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _fields(data):
+    """(field number, wire type, value) for every field of a protobuf message"""
+    pos, end = 0, len(data)
+    while pos < end:
+        key, pos = _read_varint(data, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = _read_varint(data, pos)
+        elif wire_type == 1:
+            value, pos = data[pos:pos + 8], pos + 8
+        elif wire_type == 2:
+            length, pos = _read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        elif wire_type == 5:
+            value, pos = data[pos:pos + 4], pos + 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+        yield number, wire_type, value
+
+
+def decode_write_request(data):
+    """(labels dict, [(value, timestamp_ms), ...]) for every series of a WriteRequest"""
+    series = []
+    for number, _, timeseries in _fields(data):
+        if number != 1:
+            continue
+        labels, samples = {}, []
+        for field, _, message in _fields(timeseries):
+            if field == 1:
+                label = {n: v for n, _, v in _fields(message)}
+                labels[label.get(1, b'').decode()] = label.get(2, b'').decode()
+            elif field == 2:
+                sample = {n: v for n, _, v in _fields(message)}
+                timestamp = sample.get(2, 0)
+                if timestamp >= 1 << 63:
+                    timestamp -= 1 << 64
+                samples.append((_DOUBLE.unpack(sample[1])[0] if 1 in sample else 0.0, timestamp))
+        series.append((labels, samples))
+    return series
+
+
+def compress(data):
+    """Snappy block format; uncompressed literals when python-snappy is missing"""
+    if snappy is not None:
+        return snappy.compress(data)
+    out = [_varint(len(data))]
+    for start in range(0, len(data), 65536):
+        chunk = data[start:start + 65536]
+        out.append(b'\xf4' + (len(chunk) - 1).to_bytes(2, 'little'))  # literal, 2-byte length
+        out.append(chunk)
+    return b''.join(out)
+
+
+def decompress(data):
+    if snappy is not None:
+        return snappy.uncompress(data)
+    length, pos = _read_varint(data, 0)
+    out = bytearray()
+    while pos < len(data):
+        tag = data[pos]
+        pos += 1
+        kind = tag & 3
+        if kind == 0:
+            size = tag >> 2
+            if size >= 60:
+                extra = size - 59
+                size = int.from_bytes(data[pos:pos + extra], 'little')
+                pos += extra
+            size += 1
+            out += data[pos:pos + size]
+            pos += size
+            continue
+        if kind == 1:
+            size = ((tag >> 2) & 7) + 4
+            offset = ((tag >> 5) << 8) | data[pos]
+            pos += 1
+        else:
+            width = 2 if kind == 2 else 4
+            size = (tag >> 2) + 1
+            offset = int.from_bytes(data[pos:pos + width], 'little')
+            pos += width
+        if not 0 < offset <= len(out):
+            raise ValueError("Corrupt snappy block: copy offset out of range")
+        start = len(out) - offset
+        if offset >= size:
+            out += out[start:start + size]
+        else:
+            for i in range(size):  # Overlapping copy repeats the last offset bytes
+                out.append(out[start + i])
+    if len(out) != length:
+        raise ValueError(f"Corrupt snappy block: expected {length} bytes, got {len(out)}")
+    return bytes(out)
+
+
+class RemoteWriteError(Exception):
+    def __init__(self, message, recoverable):
+        super().__init__(message)
+        self.recoverable = recoverable
+
+
+class _Shard:
+    def __init__(self):
+        self.queue = deque()
+        self.bytes = 0
+        self.oldest = None
+        self.in_flight = 0
+        self.cond = threading.Condition()
+
+
+class RemoteWriter:
+    def __init__(self, url, shards=4, max_samples_per_send=2000, capacity=10000, batch_send_deadline=5.0,
+                 min_backoff=0.03, max_backoff=5.0, timeout=30.0, interval=None, max_cached_series=100000,
+                 registry=REGISTRY):
+        self.url = urllib.parse.urlsplit(url)
+        self.interval = interval  # seconds between pushes once started
+        self.max_samples_per_send = max_samples_per_send
+        self.capacity = capacity  # samples per shard
+        self.batch_send_deadline = batch_send_deadline
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.max_cached_series = max_cached_series
+        self._shards = [_Shard() for _ in range(shards)]
+        self._sources = []
+        self._series = {}  # (source, name, labels) -> (shard, encoded labels)
+        self._flushing = False
+
+        self.samples = Counter('remote_write_samples', 'Samples by outcome: sent, failed (rejected by the receiver) '
+                               'or dropped (queue full)', ['result'], registry=registry)
+        self.retries = Counter('remote_write_retries', 'Send attempts retried after a recoverable error',
+                               registry=registry)
+        self.sent_bytes = Counter('remote_write_sent_bytes', 'Compressed request bytes sent', registry=registry)
+        self.send_duration = Histogram('remote_write_send_duration_seconds', 'Duration of one remote write request',
+                                       registry=registry)
+        Gauge('remote_write_queue_samples', 'Samples waiting in the send queues',
+              registry=registry).set_function(self.pending)
+        Gauge('remote_write_queue_bytes', 'Encoded bytes waiting in the send queues',
+              registry=registry).set_function(self.queued_bytes)
+        self._sent, self._failed, self._dropped = (self.samples.labels(r) for r in ('sent', 'failed', 'dropped'))
+
+    @classmethod
+    def from_env(cls, registry=REGISTRY):
+        """A writer configured from REMOTE_WRITE_* variables, or None when REMOTE_WRITE_URL is unset"""
+        url = os.environ.get('REMOTE_WRITE_URL')
+        if not url:
+            return None
+        writer = cls(
+            url,
+            shards=int(os.environ.get('REMOTE_WRITE_SHARDS', '4')),
+            max_samples_per_send=int(os.environ.get('REMOTE_WRITE_MAX_SAMPLES_PER_SEND', '2000')),
+            capacity=int(os.environ.get('REMOTE_WRITE_CAPACITY', '10000')),
+            batch_send_deadline=float(os.environ.get('REMOTE_WRITE_DEADLINE', '5')),
+            interval=float(os.environ.get('REMOTE_WRITE_INTERVAL', '15')),
+            registry=registry,
+        )
+        print(f"Remote write to {url}: {len(writer._shards)} shards, {writer.capacity} samples per shard queue, "
+              f"snappy={'python-snappy' if snappy is not None else 'uncompressed fallback'}")
+        return writer
+
+    def add_source(self, registry, labels=None):
+        """Push every sample of a registry, with extra labels (e.g. job, instance) added"""
+        self._sources.append((registry, dict(labels or {})))
+
+    def pending(self):
+        return sum(len(shard.queue) for shard in self._shards)
+
+    def queued_bytes(self):
+        return sum(shard.bytes for shard in self._shards)
+
+    def push(self, timestamp=None):
+        """Collect every source once and queue its samples; returns how many were queued"""
+        timestamp_varint = _varint(int((timestamp if timestamp is not None else time.time()) * 1000))
+        if len(self._series) > self.max_cached_series:
+            self._series.clear()
+        queued = 0
+        for index, (registry, extra) in enumerate(self._sources):
+            for family in registry.collect():
+                for sample in family.samples:
+                    key = (index, sample.name, tuple(sample.labels.items()))
+                    cached = self._series.get(key)
+                    if cached is None:
+                        labels = dict(extra, **sample.labels)
+                        labels['__name__'] = sample.name
+                        cached = self._series[key] = (self._shards[hash(key) % len(self._shards)],
+                                                      encode_labels(labels))
+                    shard, encoded_labels = cached
+                    queued += self._enqueue(shard, encode_series(encoded_labels, sample.value, timestamp_varint))
+        return queued
+
+    def _enqueue(self, shard, entry):
+        with shard.cond:
+            if len(shard.queue) >= self.capacity:
+                self._dropped.inc()
+                return 0
+            shard.queue.append(entry)
+            shard.bytes += len(entry)
+            # Wake the sender to start the batch deadline, and again once a batch is full
+            if len(shard.queue) == 1:
+                shard.oldest = time.monotonic()
+                shard.cond.notify()
+            elif len(shard.queue) == self.max_samples_per_send:
+                shard.cond.notify()
+        return 1
+
+    def _next_batch(self, shard):
+        with shard.cond:
+            while True:
+                if shard.queue:
+                    waited = time.monotonic() - shard.oldest
+                    if (len(shard.queue) >= self.max_samples_per_send or self._flushing
+                            or waited >= self.batch_send_deadline):
+                        break
+                    shard.cond.wait(self.batch_send_deadline - waited)
+                else:
+                    shard.cond.wait()
+            batch = [shard.queue.popleft() for _ in range(min(len(shard.queue), self.max_samples_per_send))]
+            shard.bytes -= sum(len(entry) for entry in batch)
+            shard.oldest = time.monotonic() if shard.queue else None
+            shard.in_flight = len(batch)
+            return batch
+
+    def _connect(self):
+        connection = http.client.HTTPSConnection if self.url.scheme == 'https' else http.client.HTTPConnection
+        return connection(self.url.hostname, self.url.port, timeout=self.timeout)
+
+    def _send(self, connection, body):
+        path = self.url.path or '/'
+        if self.url.query:
+            path += '?' + self.url.query
+        connection.request('POST', path, body=body, headers={
+            'Content-Type': 'application/x-protobuf',
+            'Content-Encoding': 'snappy',
+            'X-Prometheus-Remote-Write-Version': '0.1.0',
+            'User-Agent': 'coreweave-demo-simulator',
+        })
+        response = connection.getresponse()
+        detail = response.read()
+        if response.status // 100 == 2:
+            return
+        message = f"HTTP {response.status}: {detail[:200].decode(errors='replace')}"
+        raise RemoteWriteError(message, recoverable=response.status >= 500 or response.status == 429)
+
+    def _run_shard(self, shard):
+        connection = None
+        while True:
+            batch = self._next_batch(shard)
+            body = compress(b''.join(batch))
+            backoff = self.min_backoff
+            while True:
+                start = time.perf_counter()
+                try:
+                    if connection is None:
+                        connection = self._connect()
+                    self._send(connection, body)
+                    self._sent.inc(len(batch))
+                    self.sent_bytes.inc(len(body))
+                    break
+                except (OSError, http.client.HTTPException, RemoteWriteError) as e:
+                    if not isinstance(e, RemoteWriteError):
+                        connection.close()
+                        connection = None
+                    if isinstance(e, RemoteWriteError) and not e.recoverable:
+                        print(f"Remote write rejected {len(batch)} samples: {e}")
+                        self._failed.inc(len(batch))
+                        break
+                    # Recoverable: retry the same batch while the queue keeps filling up behind it
+                    self.retries.inc()
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+                finally:
+                    self.send_duration.observe(time.perf_counter() - start)
+            with shard.cond:
+                shard.in_flight = 0
+
+    def start(self):
+        """Start the shard senders and, when an interval is set, the periodic push"""
+        for index, shard in enumerate(self._shards):
+            threading.Thread(target=self._run_shard, args=(shard,), name=f'remote-write-{index}',
+                             daemon=True).start()
+        if self.interval:
+            threading.Thread(target=self._push_loop, args=(self.interval,), name='remote-write-push',
+                             daemon=True).start()
+        return self
+
+    def _push_loop(self, interval):
+        deadline = time.monotonic()
+        while True:
+            try:
+                self.push()
+            except Exception as e:
+                print(f"Remote write push failed: {e}")
+            deadline += interval
+            time.sleep(max(0.0, deadline - time.monotonic()))
+
+    def flush(self, timeout=30.0):
+        """Send everything queued without waiting for batch deadlines; True once all of it was sent"""
+        self._flushing = True
+        try:
+            for shard in self._shards:
+                with shard.cond:
+                    shard.cond.notify()
+            deadline = time.monotonic() + timeout
+            while self._unsent() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            return not self._unsent()
+        finally:
+            self._flushing = False
+
+    def _unsent(self):
+        return sum(len(shard.queue) + shard.in_flight for shard in self._shards)
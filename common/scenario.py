@@ -0,0 +1,186 @@
+"""
+Scenario Engine
+Seeded, time-compressed scheduler shared by the simulators and python-app.
+
+Every process that simulates something (gpu_simulator, ml_simulator and the
+GPU updater in python-app) drives its per-tick update through a
+ScenarioEngine instead of calling the global random module on its own
+timer. Given the same seed and scenario file, each component produces the
+same sequence of values, so incidents can be replayed and alert latency can
+be measured repeatably.
+
+Time advances in fixed ticks of UPDATE_INTERVAL simulated seconds, in real
+time by default. With time_scale=60 one tick takes a sixth of a real
+second, i.e. one simulated hour per real minute; Prometheus alerts with a
+real-time `for:` then see events 60x shorter than declared.
+
+Scenario files are JSON:
+
+    {
+      "seed": 42,
+      "time_scale": 1,
+      "events": [
+        {"name": "rack-power-loss", "type": "failure_burst", "at": "10m", "duration": "5m",
+         "count": 4, "targets": ["gpu-simulator"]},
+        {"name": "cooling-fault", "type": "thermal_runaway", "at": "30m", "duration": "10m",
+         "count": 1, "rate": 2.0},
+        {"name": "monday-rush", "type": "queue_spike", "at": "1h", "duration": "15m",
+         "queue": "inference", "depth": 120}
+      ]
+    }
+
+Event types:
+    failure_burst     `count` devices go offline for the duration
+    thermal_runaway   `count` devices heat up by `rate` degrees C per simulated minute
+    queue_spike       the `queue` queue is held at `depth` jobs
+Events without `targets` apply to every component.
+"""
+
+import json
+import os
+import random
+import re
+import time
+import zlib
+
+from prometheus_client.core import GaugeMetricFamily
+
+UPDATE_INTERVAL = 10  # simulated seconds per tick
+EVENT_TYPES = ('failure_burst', 'thermal_runaway', 'queue_spike')
+
+_DURATION = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*(ms|s|m|h|d)?\s*$')
+_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, None: 1}
+
+
+def parse_duration(value):
+    """Seconds from a number or a Prometheus style duration such as '5m'"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _DURATION.match(value)
+    if not match:
+        raise ValueError(f"Invalid duration {value!r}")
+    return float(match.group(1)) * _UNITS[match.group(2)]
+
+
+class Event:
+    def __init__(self, name, type, at, duration, targets=None, **params):
+        if type not in EVENT_TYPES:
+            raise ValueError(f"Unknown event type {type!r} for event {name!r}, expected one of {EVENT_TYPES}")
+        self.name = name
+        self.type = type
+        self.start = parse_duration(at)
+        self.end = self.start + parse_duration(duration)
+        self.targets = set(targets) if targets else None
+        self.params = params
+
+    def applies_to(self, component):
+        return self.targets is None or component in self.targets
+
+    def active(self, sim_time):
+        return self.start <= sim_time < self.end
+
+    def elapsed(self, sim_time):
+        """Simulated seconds since the event started"""
+        return sim_time - self.start
+
+
+class ScenarioEngine:
+    def __init__(self, component, seed=None, time_scale=1.0, events=(), tick=UPDATE_INTERVAL, start_time=None):
+        self.component = component
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.time_scale = time_scale
+        self.tick = tick
+        self.events = [event for event in events if event.applies_to(component)]
+        self.start_time = start_time if start_time is not None else time.time()
+        self.ticks = 0
+        self.rng = random.Random(self.seed_for('random'))
+        self._picks = {}
+        self._was_active = set()
+
+    @classmethod
+    def from_env(cls, component, tick=UPDATE_INTERVAL):
+        """Build an engine from SCENARIO_FILE, SCENARIO_SEED and TIME_SCALE"""
+        config = {}
+        path = os.environ.get('SCENARIO_FILE')
+        if path:
+            with open(path) as f:
+                config = json.load(f)
+        seed = os.environ.get('SCENARIO_SEED', config.get('seed'))
+        time_scale = float(os.environ.get('TIME_SCALE', config.get('time_scale', 1.0)))
+        events = [Event(**event) for event in config.get('events', [])]
+        engine = cls(component, seed=int(seed) if seed is not None else None,
+                     time_scale=time_scale, events=events, tick=tick)
+        print(f"Scenario engine for {component}: seed={engine.seed} time_scale={time_scale:g} "
+              f"events={len(engine.events)}")
+        return engine
+
+    def seed_for(self, stream):
+        """Stable per-component seed for an independent random stream (e.g. NumPy)"""
+        return zlib.crc32(f'{self.seed}:{self.component}:{stream}'.encode())
+
+    @property
+    def sim_time(self):
+        """Simulated seconds since the scenario started"""
+        return self.ticks * self.tick
+
+    def now(self):
+        """Simulated wall-clock timestamp of the current tick"""
+        return self.start_time + self.sim_time
+
+    def active(self, event_type):
+        return [event for event in self.events if event.type == event_type and event.active(self.sim_time)]
+
+    def pick(self, event, population, count=None):
+        """Deterministically choose which devices an event affects"""
+        key = (event.name, population)
+        if key not in self._picks:
+            count = min(population, int(count if count is not None else event.params.get('count', 1)))
+            self._picks[key] = sorted(self.rng.sample(range(population), count))
+        return self._picks[key]
+
+    def _log_transitions(self):
+        active = {event.name for event in self.events if event.active(self.sim_time)}
+        for name in sorted(active - self._was_active):
+            print(f"[scenario t={self.sim_time:.0f}s] {name} started")
+        for name in sorted(self._was_active - active):
+            print(f"[scenario t={self.sim_time:.0f}s] {name} ended")
+        self._was_active = active
+
+    def step(self, update):
+        """Run one tick of update(engine) and advance simulated time"""
+        self._log_transitions()
+        update(self)
+        self.ticks += 1
+
+    def run(self, update, ticks=None, realtime=True):
+        """Call update(engine) once per tick, forever or for a number of ticks
+
+        With realtime=False the ticks run back to back, which is what replays
+        and offline benchmarks want.
+        """
+        interval = self.tick / self.time_scale
+        deadline = time.monotonic()
+        while ticks is None or ticks > 0:
+            self.step(update)
+            if ticks is not None:
+                ticks -= 1
+            if realtime:
+                # Sleep to the next tick boundary so slow updates do not stretch simulated time
+                deadline += interval
+                time.sleep(max(0.0, deadline - time.monotonic()))
+
+
+class ScenarioCollector:
+    """Expose which scenario events are active, for measuring alert latency"""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def collect(self):
+        active = GaugeMetricFamily('scenario_event_active', 'Whether a scenario event is currently active',
+                                   labels=['event', 'type'])
+        for event in self.engine.events:
+            active.add_metric([event.name, event.type], 1 if event.active(self.engine.sim_time) else 0)
+        yield active
+        yield GaugeMetricFamily('scenario_sim_time_seconds', 'Simulated seconds since the scenario started',
+                                value=self.engine.sim_time)
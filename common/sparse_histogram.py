@@ -0,0 +1,282 @@
+"""
+Sparse Histogram
+Histogram with exponential buckets that stores only the buckets it has
+seen, in the layout of Prometheus native histograms.
+
+Bucket boundaries are powers of 2 ** (2 ** -schema): schema 3 gives 8
+buckets per doubling, each about 9% wide, from microseconds to hours with
+no configuration. Only populated buckets are kept (a dict per sign), so a
+latency spread over 0.1-2 s costs a few dozen counters instead of a fixed
+list of `le` series. If a series ever holds more than max_buckets
+buckets, the schema is lowered and neighbouring buckets merged, halving
+the resolution, as the Go client does.
+
+The exponential buckets are exposed through the protobuf format
+(common/exposition_formats.py). Every histogram also keeps classic `le`
+bucket counts, so text and OpenMetrics scrapes and existing
+histogram_quantile() queries on *_bucket keep working. The classic buckets
+carry the last exemplar (e.g. a request id) observed in each of them.
+
+Like the sharded metrics in python-app, each writing thread updates its own
+cell without a lock and the cells are merged at collect time; a scrape may
+miss an observation made at the same moment, which the next one picks up.
+"""
+
+import bisect
+import math
+import threading
+import time
+
+from prometheus_client import REGISTRY
+from prometheus_client.core import HistogramMetricFamily
+from prometheus_client.samples import Exemplar, Sample
+from prometheus_client.utils import INF, floatToGoString
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .075, .1, .25, .5, .75, 1.0, 2.5, 5.0, 7.5, 10.0, INF)
+DEFAULT_SCHEMA = 3
+MIN_SCHEMA = -4
+MAX_BUCKETS = 160
+ZERO_THRESHOLD = 2.0 ** -128  # the Go client's default
+
+get_ident = threading.get_ident
+
+
+def bucket_index(value, schema):
+    """Index of the exponential bucket (base ** (i - 1), base ** i] holding a positive value"""
+    return math.ceil(math.log2(value) * 2.0 ** schema)
+
+
+def downscale(buckets, by):
+    """Bucket counts at a schema `by` steps lower: each step merges pairs of buckets"""
+    if by <= 0:
+        return dict(buckets)
+    merged = {}
+    for index, count in buckets.items():
+        index = -((-index) >> by)  # ceil(index / 2 ** by)
+        merged[index] = merged.get(index, 0) + count
+    return merged
+
+
+class NativeHistogram:
+    """Exponential buckets of one series at collect time"""
+
+    __slots__ = ('schema', 'zero_threshold', 'zero_count', 'positive', 'negative')
+
+    def __init__(self, schema, zero_threshold, zero_count, positive, negative):
+        self.schema = schema
+        self.zero_threshold = zero_threshold
+        self.zero_count = zero_count
+        self.positive = positive
+        self.negative = negative
+
+    @staticmethod
+    def spans(buckets):
+        """(spans, deltas) of a bucket dict: runs of consecutive indexes as (offset, length)
+        and each count as the difference from the previous one"""
+        spans, deltas = [], []
+        previous_index = previous_count = None
+        for index in sorted(buckets):
+            count = buckets[index]
+            if previous_index is not None and index == previous_index + 1:
+                offset, length = spans[-1]
+                spans[-1] = (offset, length + 1)
+            else:
+                gap = index if previous_index is None else index - previous_index - 1
+                spans.append((gap, 1))
+            deltas.append(count - (previous_count or 0))
+            previous_index, previous_count = index, count
+        return spans, deltas
+
+
+class SparseHistogramFamily(HistogramMetricFamily):
+    """HistogramMetricFamily that also carries the exponential buckets of each series"""
+
+    def __init__(self, name, documentation, labels=None, unit=''):
+        super().__init__(name, documentation, labels=labels, unit=unit)
+        self.native = {}  # sorted label items -> NativeHistogram
+
+    def add_native(self, labels, native):
+        self.native[tuple(sorted(labels.items()))] = native
+
+
+class _Cell:
+    """One thread's share of a series"""
+
+    __slots__ = ('classic', 'sum', 'zero', 'state')
+
+    def __init__(self, width, schema):
+        self.classic = [0] * width
+        self.sum = 0.0
+        self.zero = 0
+        # Replaced as a whole when the schema is lowered, so readers never
+        # see a schema together with buckets of another one
+        self.state = (schema, {}, {})
+
+
+class _SparseChild:
+    def __init__(self, histogram):
+        self._upper_bounds = histogram._upper_bounds
+        self._schema = histogram.schema
+        self._zero_threshold = histogram.zero_threshold
+        self._max_buckets = histogram.max_buckets
+        self._exemplars = [None] * len(self._upper_bounds)
+        self._cells = {}
+        self._lock = threading.Lock()
+        self.created = time.time()
+
+    def _new_cell(self):
+        # Only taken the first time a thread id writes to this series
+        with self._lock:
+            cell = self._cells[get_ident()] = _Cell(len(self._upper_bounds), self._schema)
+        return cell
+
+    def observe(self, amount, exemplar=None):
+        cell = self._cells.get(get_ident()) or self._new_cell()
+        i = bisect.bisect_left(self._upper_bounds, amount)
+        cell.classic[i] += 1
+        cell.sum += amount
+        if exemplar:
+            self._exemplars[i] = Exemplar(exemplar, amount, time.time())
+
+        magnitude = abs(amount)
+        if magnitude <= self._zero_threshold:
+            cell.zero += 1
+            return
+        schema, positive, negative = cell.state
+        buckets = positive if amount > 0 else negative
+        index = bucket_index(magnitude, schema)
+        buckets[index] = buckets.get(index, 0) + 1
+        if len(positive) + len(negative) > self._max_buckets:
+            self._shrink(cell)
+
+    def observe_many(self, values):
+        """observe() for a NumPy array of values, bucketed in a few vectorized calls"""
+        import numpy as np
+
+        values = np.asarray(values, dtype=np.float64)
+        if not values.size:
+            return
+        cell = self._cells.get(get_ident()) or self._new_cell()
+        counts = np.bincount(np.searchsorted(self._upper_bounds, values, side='left'),
+                             minlength=len(self._upper_bounds))
+        for i, count in enumerate(counts.tolist()):
+            cell.classic[i] += count
+        cell.sum += float(values.sum())
+
+        magnitude = np.abs(values)
+        nonzero = magnitude > self._zero_threshold
+        cell.zero += int(values.size - nonzero.sum())
+        schema, positive, negative = cell.state
+        for buckets, selected in ((positive, values > self._zero_threshold),
+                                  (negative, values < -self._zero_threshold)):
+            if selected.any():
+                indexes = np.ceil(np.log2(magnitude[selected]) * 2.0 ** schema).astype(np.int64)
+                unique, unique_counts = np.unique(indexes, return_counts=True)
+                for index, count in zip(unique.tolist(), unique_counts.tolist()):
+                    buckets[index] = buckets.get(index, 0) + count
+        if len(positive) + len(negative) > self._max_buckets:
+            self._shrink(cell)
+
+    def _shrink(self, cell):
+        schema, positive, negative = cell.state
+        while len(positive) + len(negative) > self._max_buckets and schema > MIN_SCHEMA:
+            schema -= 1
+            positive, negative = downscale(positive, 1), downscale(negative, 1)
+        cell.state = (schema, positive, negative)
+
+    def collect(self):
+        """(classic bucket counts, sum, NativeHistogram) merged over every thread's cell"""
+        with self._lock:
+            cells = list(self._cells.values())
+        classic = [0] * len(self._upper_bounds)
+        total, zero = 0.0, 0
+        states = []
+        for cell in cells:
+            for i, count in enumerate(cell.classic):
+                classic[i] += count
+            total += cell.sum
+            zero += cell.zero
+            schema, positive, negative = cell.state
+            # dict() copies in one step under the GIL, so a writer cannot change it mid-merge
+            states.append((schema, dict(positive), dict(negative)))
+
+        # Cells may have lowered their schema independently; merge at the lowest
+        schema = min((state[0] for state in states), default=self._schema)
+        positive, negative = {}, {}
+        for cell_schema, cell_positive, cell_negative in states:
+            for merged, buckets in ((positive, cell_positive), (negative, cell_negative)):
+                for index, count in downscale(buckets, cell_schema - schema).items():
+                    merged[index] = merged.get(index, 0) + count
+        while len(positive) + len(negative) > self._max_buckets and schema > MIN_SCHEMA:
+            schema -= 1
+            positive, negative = downscale(positive, 1), downscale(negative, 1)
+        return classic, total, NativeHistogram(schema, self._zero_threshold, zero, positive, negative)
+
+
+class SparseHistogram:
+    """Labelled histogram with sparse exponential buckets alongside classic ones
+
+    Takes the same arguments as prometheus_client's Histogram, where
+    `buckets` are the classic `le` buckets, plus the exponential bucket
+    settings.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY, buckets=DEFAULT_BUCKETS,
+                 schema=DEFAULT_SCHEMA, zero_threshold=ZERO_THRESHOLD, max_buckets=MAX_BUCKETS):
+        upper_bounds = [float(b) for b in buckets]
+        if upper_bounds[-1] != INF:
+            upper_bounds.append(INF)
+        self._name = name
+        self._documentation = documentation
+        self._labelnames = tuple(labelnames)
+        self._upper_bounds = upper_bounds
+        self.schema = schema
+        self.zero_threshold = zero_threshold
+        self.max_buckets = max_buckets
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self._labelnames:
+            self._unlabelled = self._children[()] = _SparseChild(self)
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *labelvalues, **labelkwargs):
+        if not self._labelnames:
+            raise ValueError(f'No label names were set when constructing {self._name}')
+        if labelkwargs:
+            if labelvalues or set(labelkwargs) != set(self._labelnames):
+                raise ValueError('Incorrect label names')
+            labelvalues = tuple(str(labelkwargs[name]) for name in self._labelnames)
+        else:
+            if len(labelvalues) != len(self._labelnames):
+                raise ValueError('Incorrect label count')
+            labelvalues = tuple(str(value) for value in labelvalues)
+        child = self._children.get(labelvalues)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(labelvalues, _SparseChild(self))
+        return child
+
+    def remove(self, *labelvalues):
+        with self._lock:
+            self._children.pop(tuple(str(value) for value in labelvalues), None)
+
+    def observe(self, amount, exemplar=None):
+        self._unlabelled.observe(amount, exemplar)
+
+    def describe(self):
+        return [SparseHistogramFamily(self._name, self._documentation, labels=self._labelnames)]
+
+    def collect(self):
+        family = SparseHistogramFamily(self._name, self._documentation, labels=self._labelnames)
+        for labelvalues, child in list(self._children.items()):
+            classic, total, native = child.collect()
+            buckets, cumulative = [], 0
+            for bound, count, exemplar in zip(self._upper_bounds, classic, child._exemplars):
+                cumulative += count
+                buckets.append((floatToGoString(bound), cumulative, exemplar))
+            family.add_metric(list(labelvalues), buckets, total)
+            labels = dict(zip(self._labelnames, labelvalues))
+            family.samples.append(Sample(self._name + '_created', labels, child.created))
+            family.add_native(labels, native)
+        return [family]
@@ -0,0 +1,182 @@
+"""
+Request Trace Files
+Compact binary record of HTTP requests, written by python-app's capture
+mode and replayed by the load generator.
+
+A trace is a 16-byte header (magic and the capture's start time as a Unix
+timestamp) followed by a stream of records, each starting with a kind byte:
+
+    ENDPOINT  <I id> <H length> "METHOD /path?query"
+    REQUEST   <Q microseconds since start> <I endpoint id> <I duration us>
+              <H status> <I body length> body
+
+Each method and path is written once, the first time it is seen, and
+requests refer to it by id, so a request without a body costs 23 bytes.
+Requests are written when they complete, so they are not quite in arrival
+order. Records go through a buffer that is written out once it is a second
+old or 64 KiB big, so a capture that is killed loses little, and the reader
+stops at a truncated last record instead of failing.
+
+TraceReader memory-maps the file and scans it once to index the requests;
+merged_order() sorts the requests of one or more traces (one per gunicorn
+worker) by arrival. Bodies stay in the mapping until a request is read, and
+processes that map the same trace share its pages.
+"""
+
+import array
+import mmap
+import os
+import struct
+import threading
+import time
+
+MAGIC = b'REQTRC01'
+HEADER = struct.Struct('<8sd')
+KIND = struct.Struct('<B')
+ENDPOINT = struct.Struct('<IH')
+REQUEST = struct.Struct('<QIIHI')
+KIND_ENDPOINT, KIND_REQUEST = 1, 2
+
+FLUSH_BYTES = 1 << 16
+FLUSH_INTERVAL = 1.0
+
+
+class TraceFormatError(Exception):
+    pass
+
+
+class TraceWriter:
+    """Appends requests to a trace file; safe to call from many threads"""
+
+    def __init__(self, path, max_body=65536, start=None):
+        self.path = path
+        self.max_body = max_body
+        self.start = time.time() if start is None else start
+        self._endpoints = {}
+        self._buffer = bytearray()
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._file = open(path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, self.start))
+        self.requests = 0
+
+    def write(self, timestamp, method, path, status, duration, body=b''):
+        """Record one request that arrived at Unix time `timestamp` and took `duration` seconds"""
+        body = body[:self.max_body] if body else b''
+        offset = max(0, int((timestamp - self.start) * 1e6))
+        with self._lock:
+            key = f'{method} {path}'
+            endpoint = self._endpoints.get(key)
+            if endpoint is None:
+                endpoint = self._endpoints[key] = len(self._endpoints)
+                encoded = key.encode()[:0xffff]
+                self._buffer += KIND.pack(KIND_ENDPOINT) + ENDPOINT.pack(endpoint, len(encoded)) + encoded
+            self._buffer += KIND.pack(KIND_REQUEST) + REQUEST.pack(
+                offset, endpoint, min(int(duration * 1e6), 0xffffffff), status, len(body))
+            self._buffer += body
+            self.requests += 1
+            if len(self._buffer) >= FLUSH_BYTES or time.monotonic() - self._flushed_at >= FLUSH_INTERVAL:
+                self._flush()
+
+    def _flush(self):
+        self._file.write(self._buffer)
+        self._file.flush()
+        self._buffer.clear()
+        self._flushed_at = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._flush()
+                self._file.close()
+
+
+class TraceReader:
+    """Memory-mapped trace with its requests indexed in file order"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER.size:
+                raise TraceFormatError(f'{path}: too short to be a trace')
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.start = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise TraceFormatError(f'{path}: not a request trace (magic {magic!r})')
+        self.endpoints = {}  # id -> (method, path)
+        self.offsets = array.array('d')  # seconds since start
+        self.endpoint_ids = array.array('I')
+        self.durations = array.array('d')
+        self.statuses = array.array('H')
+        self._bodies = array.array('Q')  # position << 32 | length
+        self.latest = 0.0  # seconds since start of the last arrival; offsets are in completion order
+        self._index(size)
+
+    def _index(self, size):
+        data = self._map
+        position = HEADER.size
+        while position < size:
+            kind = data[position]
+            if kind == KIND_ENDPOINT:
+                if position + 1 + ENDPOINT.size > size:
+                    break
+                endpoint, length = ENDPOINT.unpack_from(data, position + 1)
+                start = position + 1 + ENDPOINT.size
+                if start + length > size:
+                    break
+                method, _, path = data[start:start + length].decode().partition(' ')
+                self.endpoints[endpoint] = (method, path)
+                position = start + length
+            elif kind == KIND_REQUEST:
+                if position + 1 + REQUEST.size > size:
+                    break
+                offset, endpoint, duration, status, length = REQUEST.unpack_from(data, position + 1)
+                start = position + 1 + REQUEST.size
+                if start + length > size:
+                    break
+                seconds = offset / 1e6
+                self.offsets.append(seconds)
+                if seconds > self.latest:
+                    self.latest = seconds
+                self.endpoint_ids.append(endpoint)
+                self.durations.append(duration / 1e6)
+                self.statuses.append(status)
+                self._bodies.append(start << 32 | length)
+                position = start + length
+            else:
+                raise TraceFormatError(f'{self.path}: unknown record kind {kind} at byte {position}')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def request(self, i):
+        """(seconds since start, method, path, body) of the i-th request"""
+        method, path = self.endpoints[self.endpoint_ids[i]]
+        packed = self._bodies[i]
+        position, length = packed >> 32, packed & 0xffffffff
+        return self.offsets[i], method, path, self._map[position:position + length]
+
+    def duration(self):
+        """Seconds from the start to the last arrival"""
+        return self.latest
+
+    def close(self):
+        self._map.close()
+
+
+def merged_order(readers):
+    """(reader, index, seconds since the earliest start) of every request, in arrival order"""
+    if not readers:
+        return []
+    origin = min(reader.start for reader in readers)
+    order = []
+    for n, reader in enumerate(readers):
+        shift = reader.start - origin
+        order.extend((offset + shift, n, i) for i, offset in enumerate(reader.offsets))
+    order.sort()
+    return [(readers[n], i, t) for t, n, i in order]
@@ -2,9 +2,12 @@ FROM python:3.9-slim
 
 WORKDIR /app
 
-RUN pip install prometheus-client==0.17.1
+RUN pip install prometheus-client==0.17.1 numpy==1.24.4 python-snappy==0.6.1
 
-COPY ml_simulator.py .
+COPY common/*.py /opt/common/
+ENV PYTHONPATH=/opt/common
+
+COPY simulators/ml_simulator.py .
 
 EXPOSE 9500
 
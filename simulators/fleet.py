@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+GPU Fleet Launcher
+Runs FLEET_NODES simulated GPU nodes, each its own Prometheus target on its
+own port, spread over a pool of worker processes.
+
+Every node is a GPUFleet slice of GPUS_PER_NODE GPUs with its own registry
+and HTTP server, so a scrape of one node only serializes that node. Worker
+processes share nothing (each builds its own ScenarioEngine from the same
+scenario file and seed, so they agree on which GPUs an event picks; the
+launcher draws the seed once when neither the file nor SCENARIO_SEED sets
+it), which
+lets the fleet use every core instead of one GIL. The node list is written
+as a Prometheus file_sd target file, one target per node with its own
+instance label, so Prometheus can be load-tested at hundreds of targets on
+one machine.
+
+With REMOTE_WRITE_URL set, each worker process also pushes its nodes'
+samples through one RemoteWriter (common/remote_write.py), labelled like
+the file_sd targets. With RECORD_DIR set (with {pid} in it, one recording
+per worker) each worker records its nodes' samples every tick
+(common/recorder.py).
+
+    FLEET_NODES=200 FLEET_TARGETS_FILE=/targets/gpu-fleet.json python fleet.py
+"""
+
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+
+import numpy as np
+from prometheus_client import CollectorRegistry, start_http_server
+
+from gpu_simulator import GPUS_PER_NODE, NUM_GPUS, PORT, UPDATE_INTERVAL, FleetCollector, GPUFleet
+
+# Shared modules live in common/ (copied to /opt/common in the image)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from scenario import ScenarioEngine, ScenarioCollector
+from recorder import Recorder
+from remote_write import RemoteWriter
+
+# Configuration; without FLEET_NODES the fleet is NUM_GPUS split into nodes
+FLEET_NODES = int(os.getenv('FLEET_NODES', str(max(1, -(-NUM_GPUS // GPUS_PER_NODE)))))
+FLEET_WORKERS = int(os.getenv('FLEET_WORKERS', '0')) or os.cpu_count()
+FLEET_BASE_PORT = int(os.getenv('FLEET_BASE_PORT', str(PORT)))
+FLEET_TARGET_HOST = os.getenv('FLEET_TARGET_HOST', socket.gethostname())
+FLEET_TARGETS_FILE = os.getenv('FLEET_TARGETS_FILE', '')
+
+
+def node_fleet(engine, node):
+    """The GPUFleet slice simulated by one node"""
+    return GPUFleet(GPUS_PER_NODE, rng=np.random.default_rng(engine.seed_for(f'fleet-node{node}')),
+                    first_gpu=node * GPUS_PER_NODE, fleet_size=FLEET_NODES * GPUS_PER_NODE)
+
+
+def run_worker(nodes):
+    """Serve and update a group of nodes; runs in its own process"""
+    engine = ScenarioEngine.from_env('gpu-simulator', tick=UPDATE_INTERVAL)
+    registries = [CollectorRegistry() for _ in nodes]
+    # The writer's own metrics are served by the worker's first node
+    writer = RemoteWriter.from_env(registry=registries[0])
+    recorder = Recorder.from_env()
+    fleets = []
+    for node, registry in zip(nodes, registries):
+        fleet = node_fleet(engine, node)
+        registry.register(FleetCollector(fleet))
+        registry.register(ScenarioCollector(engine))
+        if writer is not None:
+            writer.add_source(registry, {'job': 'gpu-simulator', **target_labels(node)})
+        if recorder is not None:
+            recorder.add_source(registry, {'job': 'gpu-simulator', **target_labels(node)})
+        start_http_server(FLEET_BASE_PORT + node, registry=registry)
+        fleets.append(fleet)
+    if writer is not None:
+        writer.start()
+
+    def step(engine):
+        for fleet in fleets:
+            fleet.step(engine)
+        if recorder is not None:
+            recorder.record(engine.now())
+
+    engine.run(step)
+
+
+def target_labels(node):
+    return {'instance': f'node{node}', 'component': 'gpu', 'environment': 'simulation'}
+
+
+def target_groups(nodes, host=FLEET_TARGET_HOST, base_port=FLEET_BASE_PORT):
+    """file_sd target groups, one per node"""
+    return [{'targets': [f'{host}:{base_port + node}'], 'labels': target_labels(node)} for node in range(nodes)]
+
+
+def interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def write_targets(path, groups):
+    """Replace the target file atomically so Prometheus never reads half of it"""
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(groups, f, indent=2)
+    os.replace(tmp, path)
+
+
+if __name__ == '__main__':
+    # Workers inherit the environment; without a fixed seed each would draw its own and pick different GPUs
+    os.environ['SCENARIO_SEED'] = str(ScenarioEngine.from_env('gpu-simulator', tick=UPDATE_INTERVAL).seed)
+    workers = max(1, min(FLEET_WORKERS, FLEET_NODES))
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(list(range(i, FLEET_NODES, workers)),),
+                                name=f'gpu-fleet-{i}')
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    # docker stop sends SIGTERM; shut the workers down as on Ctrl-C instead of orphaning them.
+    # Set after the workers start, so they keep the default handler that terminate() relies on
+    signal.signal(signal.SIGTERM, interrupt)
+
+    # Exit as soon as a worker dies so the container restarts the whole fleet
+    status = 0
+    try:
+        if FLEET_TARGETS_FILE:
+            write_targets(FLEET_TARGETS_FILE, target_groups(FLEET_NODES))
+            print(f"Wrote {FLEET_NODES} targets to {FLEET_TARGETS_FILE}")
+        print(f"GPU fleet started: {FLEET_NODES} nodes x {GPUS_PER_NODE} GPUs on ports "
+              f"{FLEET_BASE_PORT}-{FLEET_BASE_PORT + FLEET_NODES - 1} in {workers} processes")
+        while all(process.is_alive() for process in processes):
+            time.sleep(1)
+        print("A fleet worker exited, shutting down")
+        status = 1
+    except KeyboardInterrupt:
+        print("Shutting down GPU fleet")
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join()
+    sys.exit(status)
@@ -1,111 +1,212 @@
 #!/usr/bin/env python3
 """
 GPU Infrastructure Simulator
-Simulates 8 NVIDIA A100 GPUs with realistic metrics
+Simulates a fleet of NVIDIA A100 GPUs with realistic metrics.
+
+Device state is kept in NumPy column arrays (one entry per GPU) and advanced
+by a single vectorized step, and FleetCollector emits the samples straight
+from those arrays at scrape time, so a fleet of 10k+ GPUs costs a handful of
+array operations per tick instead of one Python object and a dozen
+labels().set() calls per device.
+
+Ticks are driven by the shared ScenarioEngine (common/scenario.py), which
+seeds the fleet's random stream and injects failure bursts and thermal
+runaway from the scenario file.
+
+With REMOTE_WRITE_URL set the samples are also pushed as batched
+remote-write requests (common/remote_write.py), and with RECORD_DIR set
+every tick's samples are appended to a recording (common/recorder.py).
 """
 
+import atexit
 import time
-import random
 import os
-from prometheus_client import start_http_server, Gauge, Counter, Histogram
+import socket
+import sys
+import numpy as np
+from prometheus_client import start_http_server, REGISTRY
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+from prometheus_client.samples import Sample
 import threading
 
+# Shared modules live in common/ (copied to /opt/common in the image)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from scenario import ScenarioEngine, ScenarioCollector
+from recorder import Recorder
+from remote_write import RemoteWriter
+
 # Configuration
 PORT = 9400
-UPDATE_INTERVAL = 10  # seconds
-NUM_GPUS = 8
+UPDATE_INTERVAL = 10  # simulated seconds per tick
+NUM_GPUS = int(os.getenv('NUM_GPUS', '8'))
+GPUS_PER_NODE = int(os.getenv('GPUS_PER_NODE', '8'))
 FAILURE_RATE = float(os.getenv('GPU_FAILURE_RATE', '0.001'))
+RECOVERY_RATE = 0.1  # chance per tick that a failed GPU comes back
+ECC_ERROR_RATE = 0.01
+
+GPU_MODEL = "NVIDIA-A100-40GB"
+GPU_MEMORY_TOTAL = 42949672960  # 40GB in bytes
+BASE_SM_CLOCK = 1410
+THROTTLE_TEMP = 70
+MAX_RUNAWAY_HEAT = 40  # degrees C a thermal runaway event can add
+
+LABEL_NAMES = ['gpu_id', 'gpu_model', 'node']
+
+# Exported gauges: metric name, help text, GPUFleet attribute
+GAUGES = [
+    ('gpu_utilization_percent', 'GPU utilization percentage', 'utilization_out'),
+    ('gpu_memory_used_bytes', 'GPU memory used in bytes', 'memory_used'),
+    ('gpu_memory_total_bytes', 'GPU memory total in bytes', 'memory_total'),
+    ('gpu_temperature_celsius', 'GPU temperature in Celsius', 'temperature'),
+    ('gpu_power_draw_watts', 'GPU power draw in watts', 'power'),
+    ('gpu_sm_clock_mhz', 'GPU SM clock speed in MHz', 'sm_clock'),
+    ('gpu_pcie_throughput_rx_bytes', 'PCIe RX throughput', 'pcie_rx'),
+    ('gpu_pcie_throughput_tx_bytes', 'PCIe TX throughput', 'pcie_tx'),
+]
+
+
+class GPUFleet:
+    """State of every simulated GPU as column arrays"""
+
+    def __init__(self, num_gpus, gpus_per_node=GPUS_PER_NODE, rng=None, first_gpu=0, fleet_size=None):
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.size = num_gpus
+        # A fleet can be one slice of a larger one (fleet.py runs one per node):
+        # GPUs are numbered fleet-wide and scenario picks are made over the whole fleet
+        self.first_gpu = first_gpu
+        self.fleet_size = fleet_size if fleet_size is not None else num_gpus
+        gpus = range(first_gpu, first_gpu + num_gpus)
+        self.gpu_ids = [f"gpu{i % gpus_per_node}" for i in gpus]
+        self.nodes = [f"node{i // gpus_per_node}" for i in gpus]
+
+        self.utilization = self.rng.integers(30, 71, num_gpus).astype(np.float64)
+        self.base_temp = self.rng.integers(35, 46, num_gpus).astype(np.float64)
+        self.failed = np.zeros(num_gpus, dtype=bool)
+        self.memory_total = np.full(num_gpus, float(GPU_MEMORY_TOTAL))
+
+        # Last exported values; failed GPUs report zeros, PCIe keeps its last reading
+        self.utilization_out = np.zeros(num_gpus)
+        self.memory_used = np.zeros(num_gpus)
+        self.temperature = np.zeros(num_gpus)
+        self.power = np.zeros(num_gpus)
+        self.sm_clock = np.zeros(num_gpus)
+        self.pcie_rx = np.zeros(num_gpus)
+        self.pcie_tx = np.zeros(num_gpus)
+        self.ecc_errors = np.zeros(num_gpus, dtype=np.int64)
+
+    def picked(self, engine, event):
+        """Local indices of the GPUs an event picks across the whole fleet"""
+        picked = np.array(engine.pick(event, self.fleet_size), dtype=np.int64) - self.first_gpu
+        return picked[(picked >= 0) & (picked < self.size)]
+
+    def step(self, engine=None):
+        """Advance every GPU by one update interval"""
+        rng = self.rng
+        n = self.size
+
+        # Failure and recovery transitions
+        self.failed |= rng.random(n) < FAILURE_RATE
+        self.failed &= ~(rng.random(n) < RECOVERY_RATE)
+        extra_heat = np.zeros(n)
+        if engine is not None:
+            for event in engine.active('failure_burst'):
+                self.failed[self.picked(engine, event)] = True
+            for event in engine.active('thermal_runaway'):
+                heat = event.params.get('rate', 1.0) * event.elapsed(engine.sim_time) / 60
+                extra_heat[self.picked(engine, event)] += min(heat, MAX_RUNAWAY_HEAT)
+        alive = ~self.failed
+        k = int(alive.sum())
+
+        # Random walk on utilization; failed GPUs keep their last load for when they recover
+        util = np.clip(self.utilization[alive] + rng.integers(-10, 11, k), 0, 100)
+        self.utilization[alive] = util
+
+        # Correlated metrics
+        temperature = self.base_temp[alive] + util * 0.5 + rng.integers(-3, 4, k) + extra_heat[alive]
+        self.utilization_out[alive] = util
+        self.memory_used[alive] = GPU_MEMORY_TOTAL * (util / 100) * rng.uniform(0.8, 1.2, k)
+        self.temperature[alive] = temperature
+        self.power[alive] = 100 + util * 3 + rng.integers(-20, 21, k)
+        self.sm_clock[alive] = np.where(temperature > THROTTLE_TEMP,
+                                        BASE_SM_CLOCK - (temperature - THROTTLE_TEMP) * 10,
+                                        BASE_SM_CLOCK)  # Thermal throttling
 
-# Metrics definitions
-gpu_utilization = Gauge('gpu_utilization_percent', 'GPU utilization percentage', ['gpu_id', 'gpu_model'])
-gpu_memory_used = Gauge('gpu_memory_used_bytes', 'GPU memory used in bytes', ['gpu_id', 'gpu_model'])
-gpu_memory_total = Gauge('gpu_memory_total_bytes', 'GPU memory total in bytes', ['gpu_id', 'gpu_model'])
-gpu_temperature = Gauge('gpu_temperature_celsius', 'GPU temperature in Celsius', ['gpu_id', 'gpu_model'])
-gpu_power_draw = Gauge('gpu_power_draw_watts', 'GPU power draw in watts', ['gpu_id', 'gpu_model'])
-gpu_sm_clock = Gauge('gpu_sm_clock_mhz', 'GPU SM clock speed in MHz', ['gpu_id', 'gpu_model'])
-gpu_pcie_throughput_rx = Gauge('gpu_pcie_throughput_rx_bytes', 'PCIe RX throughput', ['gpu_id', 'gpu_model'])
-gpu_pcie_throughput_tx = Gauge('gpu_pcie_throughput_tx_bytes', 'PCIe TX throughput', ['gpu_id', 'gpu_model'])
-gpu_ecc_errors = Counter('gpu_ecc_errors_total', 'Total ECC errors', ['gpu_id', 'gpu_model', 'error_type'])
-
-# GPU state tracking
-class GPU:
-    def __init__(self, gpu_id):
-        self.gpu_id = f"gpu{gpu_id}"
-        self.model = "NVIDIA-A100-40GB"
-        self.utilization = random.randint(30, 70)
-        self.base_temp = random.randint(35, 45)
-        self.failed = False
-        self.memory_total = 42949672960  # 40GB in bytes
-        
-    def update_metrics(self):
-        # Simulate failure
-        if random.random() < FAILURE_RATE:
-            self.failed = True
-        
-        if self.failed and random.random() < 0.1:  # 10% chance to recover
-            self.failed = False
-            
-        if self.failed:
-            # Failed GPU metrics
-            gpu_utilization.labels(gpu_id=self.gpu_id, gpu_model=self.model).set(0)
-            gpu_memory_used.labels(gpu_id=self.gpu_id, gpu_model=self.model).set(0)
-            gpu_temperature.labels(gpu_id=self.gpu_id, gpu_model=self.model).set(0)
-            gpu_power_draw.labels(gpu_id=self.gpu_id, gpu_model=self.model).set(0)
-            gpu_sm_clock.labels(gpu_id=self.gpu_id, gpu_model=self.model).set(0)
-        else:
-            # Normal operation with realistic variations
-            self.utilization = max(0, min(100, self.utilization + random.randint(-10, 10)))
-            
-            # Correlated metrics
-            memory_used = self.memory_total * (self.utilization / 100) * random.uniform(0.8, 1.2)
-            temperature = self.base_temp + (self.utilization * 0.5) + random.randint(-3, 3)
-            power = 100 + (self.utilization * 3) + random.randint(-20, 20)
-            sm_clock = 1410 - (temperature - 70) * 10 if temperature > 70 else 1410  # Thermal throttling
-            
-            # Set metrics
-            gpu_utilization.labels(gpu_id=self.gpu_id, gpu_model=self.model).set(self.utilization)
-            gpu_memory_used.labels(gpu_id=self.gpu_id, gpu_model=self.model).set(memory_used)
-            gpu_memory_total.labels(gpu_id=self.gpu_id, gpu_model=self.model).set(self.memory_total)
-            gpu_temperature.labels(gpu_id=self.gpu_id, gpu_model=self.model).set(temperature)
-            gpu_power_draw.labels(gpu_id=self.gpu_id, gpu_model=self.model).set(power)
-            gpu_sm_clock.labels(gpu_id=self.gpu_id, gpu_model=self.model).set(sm_clock)
-            
-            # PCIe throughput based on utilization
-            gpu_pcie_throughput_rx.labels(gpu_id=self.gpu_id, gpu_model=self.model).set(
-                self.utilization * 1000000 * random.uniform(0.5, 1.5)
-            )
-            gpu_pcie_throughput_tx.labels(gpu_id=self.gpu_id, gpu_model=self.model).set(
-                self.utilization * 800000 * random.uniform(0.5, 1.5)
-            )
-            
-            # Occasional ECC errors
-            if random.random() < 0.01:
-                gpu_ecc_errors.labels(
-                    gpu_id=self.gpu_id, 
-                    gpu_model=self.model, 
-                    error_type="correctable"
-                ).inc()
-
-def update_metrics_loop(gpus):
-    """Update all GPU metrics in a loop"""
-    while True:
-        for gpu in gpus:
-            gpu.update_metrics()
-        time.sleep(UPDATE_INTERVAL)
+        # PCIe throughput based on utilization
+        self.pcie_rx[alive] = util * 1000000 * rng.uniform(0.5, 1.5, k)
+        self.pcie_tx[alive] = util * 800000 * rng.uniform(0.5, 1.5, k)
+
+        # Occasional ECC errors
+        self.ecc_errors[alive] += rng.random(k) < ECC_ERROR_RATE
+
+        for attr in ('utilization_out', 'memory_used', 'temperature', 'power', 'sm_clock'):
+            getattr(self, attr)[self.failed] = 0
+
+
+class FleetCollector:
+    """Emit fleet samples directly from the GPUFleet arrays
+
+    Label dicts are built once, so a scrape is one Sample per value with no
+    per-child label lookups or locks.
+    """
+
+    def __init__(self, fleet):
+        self.fleet = fleet
+        self._labels = [
+            {'gpu_id': gpu_id, 'gpu_model': GPU_MODEL, 'node': node}
+            for gpu_id, node in zip(fleet.gpu_ids, fleet.nodes)
+        ]
+        self._ecc_labels = [dict(labels, error_type='correctable') for labels in self._labels]
+
+    def _samples(self, name, label_dicts, values):
+        return [Sample(name, labels, value, None, None) for labels, value in zip(label_dicts, values.tolist())]
+
+    def collect(self):
+        for name, documentation, attr in GAUGES:
+            family = GaugeMetricFamily(name, documentation, labels=LABEL_NAMES)
+            family.samples = self._samples(name, self._labels, getattr(self.fleet, attr))
+            yield family
+        ecc = CounterMetricFamily('gpu_ecc_errors', 'Total ECC errors', labels=LABEL_NAMES + ['error_type'])
+        ecc.samples = self._samples('gpu_ecc_errors_total', self._ecc_labels, self.fleet.ecc_errors)
+        yield ecc
+
+
+def update_metrics_loop(fleet, engine, recorder=None):
+    """Update all GPU metrics in a loop, recording every tick when given a recorder"""
+    def tick(engine):
+        fleet.step(engine)
+        if recorder is not None:
+            recorder.record(engine.now())
+
+    engine.run(tick)
 
 if __name__ == '__main__':
     # Initialize GPUs
-    gpus = [GPU(i) for i in range(NUM_GPUS)]
-    
+    engine = ScenarioEngine.from_env('gpu-simulator', tick=UPDATE_INTERVAL)
+    fleet = GPUFleet(NUM_GPUS, rng=np.random.default_rng(engine.seed_for('fleet')))
+    REGISTRY.register(FleetCollector(fleet))
+    REGISTRY.register(ScenarioCollector(engine))
+
     # Start metrics server
     start_http_server(PORT)
-    print(f"GPU Simulator started on port {PORT}")
-    
+    print(f"GPU Simulator started on port {PORT} with {NUM_GPUS} GPUs")
+
+    # Optional push mode
+    writer = RemoteWriter.from_env()
+    if writer is not None:
+        writer.add_source(REGISTRY, {'job': 'gpu-simulator', 'instance': f'{socket.gethostname()}:{PORT}'})
+        writer.start()
+
+    # Optional snapshot recording
+    recorder = Recorder.from_env()
+    if recorder is not None:
+        recorder.add_source(REGISTRY, {'job': 'gpu-simulator', 'instance': f'{socket.gethostname()}:{PORT}'})
+        atexit.register(recorder.close)
+
     # Start update thread
-    update_thread = threading.Thread(target=update_metrics_loop, args=(gpus,))
+    update_thread = threading.Thread(target=update_metrics_loop, args=(fleet, engine, recorder))
     update_thread.daemon = True
     update_thread.start()
-    
+
     # Keep main thread alive
     try:
         while True:
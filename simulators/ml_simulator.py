@@ -2,40 +2,83 @@
 """
 ML Workload Simulator
 Simulates machine learning training and inference workloads
+
+All randomness comes from the shared ScenarioEngine (common/scenario.py), so
+a seed reproduces the same jobs and traffic, and queue_spike events from the
+scenario file hold a queue at a fixed depth.
+
+Inference traffic is simulated a batch at a time: each tick draws every
+request's outcome and latency in one NumPy call and adds the bucket counts
+to the histogram in bulk, so the Python work per tick does not grow with
+the request rate.
+
+Latencies are SparseHistograms (common/sparse_histogram.py): exponential
+buckets served as native histograms to protobuf scrapes, next to the
+classic buckets, and batch times carry their job id as an exemplar.
+
+Job-labelled series are removed a grace period after their job finishes,
+and all of them go through a CardinalityLimiter (common/cardinality.py) so a
+runaway number of jobs ends up in an overflow series instead of growing
+memory and scrape size without bound.
+
+With REMOTE_WRITE_URL set the samples are also pushed as batched
+remote-write requests (common/remote_write.py), and with RECORD_DIR set
+every tick's samples are appended to a recording (common/recorder.py).
 """
 
+import atexit
+import os
+import socket
+import sys
 import time
-import random
 import math
-from prometheus_client import start_http_server, Gauge, Counter, Histogram
+import numpy as np
+from prometheus_client import Gauge, Counter, REGISTRY
 import threading
 
+# Shared modules live in common/ (copied to /opt/common in the image)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from scenario import ScenarioEngine, ScenarioCollector
+from cardinality import CardinalityLimiter
+from recorder import Recorder
+from remote_write import RemoteWriter
+from sparse_histogram import SparseHistogram
+from exposition_formats import start_http_server
+
 # Configuration
 PORT = 9500
-UPDATE_INTERVAL = 10
+UPDATE_INTERVAL = 10  # simulated seconds per tick
+INFERENCE_MODELS = ['bert-base', 'gpt-3', 'resnet50', 'yolov5']
+INFERENCE_VOLUME = int(os.getenv('INFERENCE_VOLUME', '1'))  # multiplies the 10-100 requests per model per tick
+SERIES_GRACE_PERIOD = float(os.getenv('SERIES_GRACE_PERIOD', '60'))  # real seconds a finished job stays exported
+MAX_SERIES_PER_METRIC = int(os.getenv('MAX_SERIES_PER_METRIC', '500'))
 
 # Metrics definitions
 training_loss = Gauge('training_loss', 'Current training loss', ['model_name', 'job_id'])
 training_accuracy = Gauge('training_accuracy', 'Current training accuracy', ['model_name', 'job_id'])
 training_epoch = Gauge('training_epoch', 'Current epoch number', ['model_name', 'job_id'])
 training_throughput = Gauge('training_throughput_samples_per_second', 'Training throughput', ['model_name'])
-batch_processing_time = Histogram('batch_processing_time_seconds', 'Time to process a batch', ['model_name'])
+batch_processing_time = SparseHistogram('batch_processing_time_seconds', 'Time to process a batch', ['model_name'])
 inference_requests = Counter('inference_requests_total', 'Total inference requests', ['model_name', 'status'])
-inference_latency = Histogram('inference_latency_seconds', 'Inference latency', ['model_name'])
+inference_latency = SparseHistogram('inference_latency_seconds', 'Inference latency', ['model_name'])
 job_queue_depth = Gauge('ml_job_queue_depth', 'Number of jobs in queue', ['queue_type'])
 checkpoint_saves = Counter('checkpoint_saves_total', 'Total checkpoint saves', ['model_name'])
 gpu_memory_allocated = Gauge('ml_gpu_memory_allocated_gb', 'GPU memory allocated for ML', ['job_id'])
 
+limiter = CardinalityLimiter(max_series=MAX_SERIES_PER_METRIC)
+
 class TrainingJob:
-    def __init__(self, job_id, model_name):
+    def __init__(self, job_id, model_name, rng):
         self.job_id = job_id
         self.model_name = model_name
+        self.rng = rng
         self.epoch = 0
-        self.initial_loss = random.uniform(2.0, 4.0)
-        self.convergence_rate = random.uniform(0.01, 0.05)
-        self.max_epochs = random.randint(50, 200)
+        self.initial_loss = rng.uniform(2.0, 4.0)
+        self.convergence_rate = rng.uniform(0.01, 0.05)
+        self.max_epochs = rng.randint(50, 200)
         
     def update_metrics(self):
+        random = self.rng
         self.epoch += 1
         
         # Simulate loss decay (exponential decay with noise)
@@ -50,17 +93,17 @@ class TrainingJob:
         throughput = random.uniform(1000, 5000)
         
         # Set metrics
-        training_loss.labels(model_name=self.model_name, job_id=self.job_id).set(current_loss)
-        training_accuracy.labels(model_name=self.model_name, job_id=self.job_id).set(accuracy)
-        training_epoch.labels(model_name=self.model_name, job_id=self.job_id).set(self.epoch)
+        limiter.labels(training_loss, self.model_name, self.job_id).set(current_loss)
+        limiter.labels(training_accuracy, self.model_name, self.job_id).set(accuracy)
+        limiter.labels(training_epoch, self.model_name, self.job_id).set(self.epoch)
         training_throughput.labels(model_name=self.model_name).set(throughput)
         
         # Batch processing time
         batch_time = random.uniform(0.5, 2.0)
-        batch_processing_time.labels(model_name=self.model_name).observe(batch_time)
+        batch_processing_time.labels(model_name=self.model_name).observe(batch_time, {'job_id': self.job_id})
         
         # GPU memory allocation
-        gpu_memory_allocated.labels(job_id=self.job_id).set(random.uniform(10, 35))
+        limiter.labels(gpu_memory_allocated, self.job_id).set(random.uniform(10, 35))
         
         # Checkpoint saves every 10 epochs
         if self.epoch % 10 == 0:
@@ -71,35 +114,65 @@ class TrainingJob:
             return True
         return False
 
-def simulate_inference():
-    """Simulate inference requests"""
-    models = ['bert-base', 'gpt-3', 'resnet50', 'yolov5']
-    
-    for model in models:
+    def remove_metrics(self):
+        """Stop exporting this job's series"""
+        for metric in (training_loss, training_accuracy, training_epoch):
+            limiter.remove(metric, self.model_name, self.job_id)
+        limiter.remove(gpu_memory_allocated, self.job_id)
+
+def observe_batch(histogram, values):
+    """Add an array of observations to a histogram child
+
+    Same result as calling observe() per value: each value is counted in the
+    first bucket whose upper bound is >= the value (the client stores
+    per-bucket counts and makes them cumulative at scrape time). Sparse
+    histogram children bucket the array themselves.
+    """
+    if hasattr(histogram, 'observe_many'):
+        histogram.observe_many(values)
+        return
+    bounds = histogram._upper_bounds
+    counts = np.bincount(np.searchsorted(bounds, values, side='left'), minlength=len(bounds))
+    for bucket, count in zip(histogram._buckets, counts.tolist()):
+        if count:
+            bucket.inc(count)
+    histogram._sum.inc(float(values.sum()))
+
+def simulate_inference(random, rng):
+    """Simulate inference requests, one batch per model"""
+    for model in INFERENCE_MODELS:
         # Generate some inference requests
         if random.random() < 0.7:  # 70% chance of requests
-            num_requests = random.randint(10, 100)
-            for _ in range(num_requests):
-                # Simulate success/failure
-                if random.random() < 0.95:  # 95% success rate
-                    inference_requests.labels(model_name=model, status='success').inc()
-                    latency = random.uniform(0.01, 0.5)
-                    inference_latency.labels(model_name=model).observe(latency)
-                else:
-                    inference_requests.labels(model_name=model, status='error').inc()
-
-def update_metrics_loop():
-    """Main metrics update loop"""
-    training_jobs = []
-    job_counter = 0
-    
-    while True:
+            num_requests = random.randint(10, 100) * INFERENCE_VOLUME
+            successes = int(rng.binomial(num_requests, 0.95))  # 95% success rate
+            errors = num_requests - successes
+            if successes:
+                inference_requests.labels(model_name=model, status='success').inc(successes)
+                observe_batch(inference_latency.labels(model_name=model), rng.uniform(0.01, 0.5, successes))
+            if errors:
+                inference_requests.labels(model_name=model, status='error').inc(errors)
+
+class WorkloadSimulator:
+    """Training jobs and inference traffic advanced one tick at a time"""
+
+    def __init__(self, rng, grace_ticks=0):
+        self.rng = rng  # NumPy stream for the inference batches
+        self.grace_ticks = grace_ticks  # None keeps finished jobs' series forever
+        self.training_jobs = []
+        self.finished_jobs = []  # (tick to remove at, job)
+        self.ticks = 0
+        self.job_counter = 0
+
+    def tick(self, engine):
+        random = engine.rng
+        training_jobs = self.training_jobs
+
         # Start new training jobs randomly
         if random.random() < 0.1 and len(training_jobs) < 4:
             models = ['transformer', 'cnn', 'rnn', 'gan']
-            job = TrainingJob(f"job_{job_counter}", random.choice(models))
+            job = TrainingJob(f"job_{self.job_counter}", random.choice(models), random)
             training_jobs.append(job)
-            job_counter += 1
+            self.job_counter += 1
         
         # Update training jobs
         completed_jobs = []
@@ -107,26 +180,62 @@ def update_metrics_loop():
             if job.update_metrics():
                 completed_jobs.append(job)
         
-        # Remove completed jobs
+        # Remove completed jobs; their series go once the grace period is over
         for job in completed_jobs:
             training_jobs.remove(job)
+            if self.grace_ticks is not None:
+                self.finished_jobs.append((self.ticks + self.grace_ticks, job))
+        while self.finished_jobs and self.finished_jobs[0][0] <= self.ticks:
+            self.finished_jobs.pop(0)[1].remove_metrics()
+        self.ticks += 1
         
-        # Update queue depth
-        job_queue_depth.labels(queue_type='training').set(len(training_jobs))
-        job_queue_depth.labels(queue_type='inference').set(random.randint(0, 50))
+        # Update queue depth, unless a scenario is holding it
+        depths = {'training': len(training_jobs), 'inference': random.randint(0, 50)}
+        for event in engine.active('queue_spike'):
+            queue = event.params.get('queue', 'inference')
+            if queue in depths:
+                depths[queue] = event.params.get('depth', 100)
+        for queue_type, depth in depths.items():
+            job_queue_depth.labels(queue_type=queue_type).set(depth)
         
         # Simulate inference
-        simulate_inference()
-        
-        time.sleep(UPDATE_INTERVAL)
+        simulate_inference(random, self.rng)
+
+def update_metrics_loop(engine, recorder=None):
+    """Main metrics update loop, recording every tick when given a recorder"""
+    # The grace period is in real seconds so the final values still get scraped
+    grace_ticks = math.ceil(SERIES_GRACE_PERIOD * engine.time_scale / engine.tick)
+    simulator = WorkloadSimulator(np.random.default_rng(engine.seed_for('inference')), grace_ticks)
+
+    def tick(engine):
+        simulator.tick(engine)
+        if recorder is not None:
+            recorder.record(engine.now())
+
+    engine.run(tick)
 
 if __name__ == '__main__':
+    engine = ScenarioEngine.from_env('ml-simulator', tick=UPDATE_INTERVAL)
+    REGISTRY.register(ScenarioCollector(engine))
+
     # Start metrics server
     start_http_server(PORT)
     print(f"ML Workload Simulator started on port {PORT}")
+
+    # Optional push mode
+    writer = RemoteWriter.from_env()
+    if writer is not None:
+        writer.add_source(REGISTRY, {'job': 'ml-simulator', 'instance': f'{socket.gethostname()}:{PORT}'})
+        writer.start()
+
+    # Optional snapshot recording
+    recorder = Recorder.from_env()
+    if recorder is not None:
+        recorder.add_source(REGISTRY, {'job': 'ml-simulator', 'instance': f'{socket.gethostname()}:{PORT}'})
+        atexit.register(recorder.close)
     
     # Start update thread
-    update_thread = threading.Thread(target=update_metrics_loop)
+    update_thread = threading.Thread(target=update_metrics_loop, args=(engine, recorder))
     update_thread.daemon = True
     update_thread.start()
     
@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+Alert Rule Backtester
+Evaluates the rules in prometheus/alerts.yml over a recorded or simulated
+history and prints when each alert would have fired and resolved, so
+thresholds and `for:` durations can be tuned without waiting for the live
+stack.
+
+Histories come from:
+    --prometheus FILE...   /api/v1/query_range JSON responses (matrix results)
+    --simulate 30d         the GPU fleet (gpu_simulator.GPUFleet), the ML
+                           workload loop (ml_simulator, with --sources ml) and
+                           a vectorized model of app.py's GPU, queue and
+                           request metrics, all driven by a scenario file
+    --series FILE.npz      a history saved earlier with --save-series
+    --recording DIR...     snapshots recorded by the exporters with RECORD_DIR
+                           set (common/recorder.py); only the metrics the
+                           rules read are loaded
+
+Rules are evaluated with tools/promql.py over the whole history at once,
+then `for:` is applied as a run length over the group's evaluation steps,
+so a month of data backtests in seconds. The recording rules in
+prometheus/recording_rules.yml are evaluated into the history first, in
+file order, since the alerts read some of their series.
+
+    python tools/alert_backtest.py --simulate 30d --scenario scenarios/gpu-incidents.json
+    curl -s 'localhost:9090/api/v1/query_range?query=gpu_temperature_celsius&start=...&end=...&step=15s' > temp.json
+    python tools/alert_backtest.py --prometheus temp.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import yaml
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'simulators'))
+sys.path.insert(0, os.path.join(ROOT, 'common'))
+
+from promql import Evaluator, SeriesStore, parse, parse_duration, selectors
+from recorder import Recording
+
+DEFAULT_RULES = os.path.join(ROOT, 'prometheus', 'alerts.yml')
+DEFAULT_RECORDING_RULES = os.path.join(ROOT, 'prometheus', 'recording_rules.yml')
+SIM_STEP = 10  # seconds, the simulators' UPDATE_INTERVAL
+APP_GPUS = 4
+
+
+class Rule:
+    def __init__(self, name, expr, for_seconds, interval, labels):
+        self.name = name
+        self.expr = expr
+        self.ast = parse(expr)
+        self.for_seconds = for_seconds
+        self.interval = interval
+        self.labels = labels
+
+
+def load_rules(path):
+    with open(path) as f:
+        config = yaml.safe_load(f)
+    rules = []
+    for group in config.get('groups', []):
+        interval = parse_duration(group.get('interval', '1m'))
+        for rule in group.get('rules', []):
+            if 'alert' in rule:
+                for_seconds = parse_duration(rule['for']) if rule.get('for') else 0
+                rules.append(Rule(rule['alert'], rule['expr'], for_seconds, interval, rule.get('labels', {})))
+    return rules
+
+
+def rule_names(rules_path, recording_rules_path):
+    """Metric names read by the alert and recording rules"""
+    names = set()
+    for path in (rules_path, recording_rules_path):
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            config = yaml.safe_load(f) or {}
+        for group in config.get('groups', []):
+            for rule in group.get('rules', []):
+                names |= selectors(parse(rule['expr']))
+    return names
+
+
+def record(store, path):
+    """Evaluate the recording rules in `path` into the store, each one able to read the ones before it"""
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+    recorded = 0
+    for group in config.get('groups', []):
+        for rule in group.get('rules', []):
+            if 'record' not in rule:
+                continue
+            vector = Evaluator(store).evaluate(rule['expr'])
+            for labels, values in zip(vector.labels, vector.values):
+                store.add(dict(labels, __name__=rule['record']), values)
+            recorded += 1
+    return recorded
+
+
+# --- Histories -----------------------------------------------------------
+
+def load_prometheus(paths, step=None):
+    """Build a store from query_range responses, on a grid of their (smallest) step"""
+    results = []
+    for path in paths:
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('status') != 'success' or data['data']['resultType'] != 'matrix':
+            raise SystemExit(f"{path}: expected a successful matrix (query_range) response")
+        results.extend(data['data']['result'])
+    if not results:
+        raise SystemExit("No series in the given files")
+    stamps = [np.array([float(t) for t, _ in r['values']]) for r in results]
+    start = min(s[0] for s in stamps)
+    end = max(s[-1] for s in stamps)
+    if step is None:
+        step = min(np.diff(s).min() for s in stamps if len(s) > 1)
+    store = SeriesStore(start, step, int(round((end - start) / step)) + 1)
+    for result, ts in zip(results, stamps):
+        values = [float(v) for _, v in result['values']]
+        store.add_samples(result['metric'], ts, values)
+    return store
+
+
+def load_recordings(paths, names=None, step=None):
+    """Build a store from recorder.py recordings (all of them or only `names`), on a grid of their tick spacing"""
+    recordings = [Recording(path) for path in paths]
+    stamps = [recording.timestamps for recording in recordings if len(recording)]
+    if not stamps:
+        raise SystemExit("No ticks in the given recordings")
+    start = min(s[0] for s in stamps)
+    end = max(s[-1] for s in stamps)
+    if step is None:
+        step = min((float(np.median(np.diff(s))) for s in stamps if len(s) > 1), default=SIM_STEP)
+    store = SeriesStore(start, step, int(round((end - start) / step)) + 1)
+    for recording in recordings:
+        series = [i for i, labels in enumerate(recording.labels) if names is None or labels['__name__'] in names]
+        timestamps, values = recording.matrix(series)
+        for i, row in zip(series, values):
+            store.add_samples(recording.labels[i], timestamps, row)
+        recording.close()
+    return store
+
+
+def save_store(store, path):
+    np.savez_compressed(path, start=store.start, step=store.step, values=np.vstack(store.rows),
+                        labels=json.dumps(store.labels))
+
+
+def load_store(path):
+    data = np.load(path)
+    store = SeriesStore(float(data['start']), float(data['step']), data['values'].shape[1])
+    for labels, row in zip(json.loads(str(data['labels'])), data['values']):
+        store.add(labels, row)
+    return store
+
+
+def event_mask(event, timestamps):
+    return (timestamps >= event.start) & (timestamps < event.end)
+
+
+def simulate_gpu(store, engine, gpus):
+    import gpu_simulator
+
+    fleet = gpu_simulator.GPUFleet(gpus, rng=np.random.default_rng(engine.seed_for('fleet')))
+    utilization = np.empty((store.steps, gpus))
+    temperature = np.empty((store.steps, gpus))
+
+    def tick(engine):
+        fleet.step(engine)
+        utilization[engine.ticks] = fleet.utilization_out
+        temperature[engine.ticks] = fleet.temperature
+
+    engine.run(tick, ticks=store.steps, realtime=False)
+    for i in range(gpus):
+        labels = {'job': 'gpu-simulator', 'gpu_id': fleet.gpu_ids[i], 'gpu_model': gpu_simulator.GPU_MODEL,
+                  'node': fleet.nodes[i]}
+        store.add(dict(labels, __name__='gpu_utilization_percent'), utilization[:, i])
+        store.add(dict(labels, __name__='gpu_temperature_celsius'), temperature[:, i])
+
+
+def simulate_ml(store, engine):
+    import ml_simulator
+
+    simulator = ml_simulator.WorkloadSimulator(np.random.default_rng(engine.seed_for('inference')), grace_ticks=0)
+    depths = {'training': np.empty(store.steps), 'inference': np.empty(store.steps)}
+    children = {queue: ml_simulator.job_queue_depth.labels(queue_type=queue) for queue in depths}
+
+    def tick(engine):
+        simulator.tick(engine)
+        for queue, child in children.items():
+            depths[queue][engine.ticks] = child._value.get()
+
+    engine.run(tick, ticks=store.steps, realtime=False)
+    for queue, values in depths.items():
+        store.add({'__name__': 'ml_job_queue_depth', 'job': 'ml-simulator', 'queue_type': queue}, values)
+
+
+def simulate_app(store, engine, rps):
+    """app.py's GPU gauges, job_queue_size and /api/test counters, drawn for every tick at once
+
+    Mirrors update_gpu_metrics(), /api/inference's time-of-day queue table
+    and /api/test's 20% errors and 5% chance of knocking gpu_3 offline;
+    app.py itself starts its server threads on import, so it is modelled
+    here rather than imported.
+    """
+    rng = np.random.default_rng(engine.seed_for('backtest'))
+    steps, t = store.steps, store.timestamps - store.start
+    labels = {'job': 'python-app'}
+
+    # GPU 0 heavy, GPU 1 medium, GPUs 2-3 light; temperature follows load
+    ranges = [(85, 99, 65, 0.3), (40, 70, 50, 0.2), (5, 25, 40, 0.15), (5, 25, 40, 0.15)]
+    utilization = np.empty((APP_GPUS, steps))
+    temperature = np.empty((APP_GPUS, steps))
+    for gpu, (low, high, base, factor) in enumerate(ranges):
+        utilization[gpu] = rng.integers(low, high + 1, steps)
+        temperature[gpu] = base + rng.integers(low, high + 1, steps) * factor + rng.integers(-3, 4, steps)
+
+    requests = rng.poisson(rps * store.step, steps)
+    utilization[3] = np.where(rng.binomial(requests, 0.05) > 0, 0, utilization[3])
+    for event in engine.events:
+        mask = event_mask(event, t)
+        if event.type == 'thermal_runaway':
+            heat = np.minimum(event.params.get('rate', 1.0) * (t - event.start) / 60, 40)
+            for gpu in engine.pick(event, APP_GPUS):
+                temperature[gpu] += np.where(mask, heat, 0)
+        elif event.type == 'failure_burst':
+            for gpu in engine.pick(event, APP_GPUS):
+                utilization[gpu][mask] = 0
+    for gpu in range(APP_GPUS):
+        store.add(dict(labels, __name__='gpu_utilization_percent', gpu_id=f'gpu_{gpu}'), utilization[gpu])
+        store.add(dict(labels, __name__='gpu_temperature_celsius', gpu_id=f'gpu_{gpu}'), temperature[gpu])
+
+    # Queue depth by time of day, as in /api/inference
+    hour = (((store.timestamps + engine.start_time) % 86400) // 3600).astype(int)
+    minute = (((store.timestamps + engine.start_time) % 3600) // 60).astype(int)
+    business = (hour >= 9) & (hour < 17)
+    queues = {}
+    for queue, table in (('inference', [(50, 100), (30, 70), (15, 40), (0, 15)]),
+                         ('training', [(20, 40), (10, 30), (5, 20), (0, 5)])):
+        period = np.select([business & (minute < 10), business, (hour >= 17) & (hour < 21)], [0, 1, 2], 3)
+        low = np.array([r[0] for r in table])[period]
+        high = np.array([r[1] for r in table])[period]
+        queues[queue] = rng.integers(low, high + 1).astype(np.float64)
+    for event in engine.events:
+        if event.type == 'queue_spike':
+            queue = event.params.get('queue', 'inference')
+            if queue in queues:
+                queues[queue][event_mask(event, t)] = event.params.get('depth', 100)
+    for queue, values in queues.items():
+        store.add(dict(labels, __name__='job_queue_size', queue_type=queue), values)
+
+    errors = rng.binomial(requests, 0.2)
+    for status, counts in (('200', requests - errors), ('500', errors)):
+        store.add(dict(labels, __name__='app_requests_total', method='GET', endpoint='/api/test', status=status),
+                  np.cumsum(counts).astype(np.float64))
+
+
+def simulate(duration, scenario, seed, sources, gpus, rps):
+    from scenario import ScenarioEngine
+
+    if scenario:
+        os.environ['SCENARIO_FILE'] = scenario
+    if seed is not None:
+        os.environ['SCENARIO_SEED'] = str(seed)
+    store = SeriesStore(0, SIM_STEP, int(duration // SIM_STEP))
+    engines = {}
+    for source, component in (('gpu', 'gpu-simulator'), ('ml', 'ml-simulator'), ('app', 'python-app')):
+        if source in sources:
+            engines[source] = ScenarioEngine.from_env(component, tick=SIM_STEP)
+            engines[source].start_time = 0.0
+    if 'gpu' in engines:
+        simulate_gpu(store, engines['gpu'], gpus)
+    if 'ml' in engines:
+        simulate_ml(store, engines['ml'])
+    if 'app' in engines:
+        simulate_app(store, engines['app'], rps)
+    events = {event.name: event for engine in engines.values() for event in engine.events}
+    return store, list(events.values())
+
+
+# --- Evaluation ----------------------------------------------------------
+
+def run_lengths(active):
+    """Consecutive True count ending at each column, per row"""
+    counts = np.cumsum(active, axis=1)
+    resets = np.where(~active, counts, 0)
+    return counts - np.maximum.accumulate(resets, axis=1)
+
+
+def backtest(rule, evaluator, flap_window):
+    store = evaluator.store
+    vector = evaluator.evaluate(rule.ast)
+    every = max(int(round(rule.interval / store.step)), 1)
+    columns = np.arange(0, store.steps, every)
+    times = store.timestamps[columns]
+    active = ~np.isnan(vector.values[:, columns]) if len(vector) else np.zeros((0, len(columns)), dtype=bool)
+
+    # An alert fires once its expression has held for `for:` since it went pending
+    firing = (run_lengths(active) - 1) * rule.interval >= rule.for_seconds
+    firing &= active
+    padded = np.pad(firing, ((0, 0), (1, 1)))
+    starts = np.argwhere(padded[:, 1:] & ~padded[:, :-1])
+    ends = np.argwhere(~padded[:, 1:] & padded[:, :-1])
+
+    episodes, flaps = [], 0
+    last_end = {}
+    for (row, start), (_, end) in zip(starts, ends):
+        began = times[start]
+        resolved = times[end] if end < len(times) else None
+        if row in last_end and began - last_end[row] <= flap_window:
+            flaps += 1
+        if resolved is not None:
+            last_end[row] = resolved
+        labels = {k: v for k, v in vector.labels[row].items() if k != '__name__'}
+        episodes.append({'labels': dict(labels, alertname=rule.name, **rule.labels),
+                         'fired': float(began), 'resolved': None if resolved is None else float(resolved)})
+    episodes.sort(key=lambda e: e['fired'])
+    pending = int((active & ~firing).any(axis=1).sum())
+    return {
+        'alert': rule.name,
+        'expr': rule.expr,
+        'for': rule.for_seconds,
+        'series': len(vector),
+        'series_pending': pending,
+        'episodes': episodes,
+        'flaps': flaps,
+        'firing_seconds': float(firing.sum() * rule.interval),
+    }
+
+
+def event_latency(events, results):
+    """Delay from each scenario event's start to the first alert firing during it"""
+    latencies = []
+    for event in sorted(events, key=lambda e: e.start):
+        first = {}
+        for result in results:
+            for episode in result['episodes']:
+                if event.start <= episode['fired'] < event.end + 600:
+                    first.setdefault(result['alert'], episode['fired'] - event.start)
+                    break
+        latencies.append({'event': event.name, 'type': event.type, 'start': event.start, 'end': event.end,
+                          'alerts': first})
+    return latencies
+
+
+def fmt_time(seconds, origin):
+    if seconds is None:
+        return 'still firing'
+    if origin:
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(seconds))
+    days, rest = divmod(int(seconds), 86400)
+    return f"d{days} {rest // 3600:02d}:{rest % 3600 // 60:02d}:{rest % 60:02d}"
+
+
+def fmt_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}m{seconds % 60:02d}s"
+
+
+def print_report(results, latencies, store, absolute, max_episodes):
+    span = store.steps * store.step
+    print(f"History: {fmt_duration(span)} at {store.step:g}s resolution, {len(store.rows)} series\n")
+    print(f"{'alert':<16} {'series':>6} {'episodes':>8} {'flaps':>5} {'firing':>10}")
+    for r in results:
+        print(f"{r['alert']:<16} {r['series']:>6} {len(r['episodes']):>8} {r['flaps']:>5} "
+              f"{fmt_duration(r['firing_seconds']):>10}")
+    for r in results:
+        if not r['episodes']:
+            continue
+        print(f"\n{r['alert']}  ({r['expr']}, for {fmt_duration(r['for'])})")
+        for e in r['episodes'][:max_episodes]:
+            labels = ','.join(f'{k}={v}' for k, v in sorted(e['labels'].items())
+                              if k not in ('alertname', 'severity', 'component'))
+            duration = fmt_duration(e['resolved'] - e['fired']) if e['resolved'] is not None else ''
+            print(f"  fired {fmt_time(e['fired'], absolute)}  resolved {fmt_time(e['resolved'], absolute)}"
+                  f"  {duration:>7}  {labels}")
+        if len(r['episodes']) > max_episodes:
+            print(f"  ... {len(r['episodes']) - max_episodes} more")
+    if latencies:
+        print("\nScenario events:")
+        for item in latencies:
+            alerts = ', '.join(f"{name} +{fmt_duration(delay)}" for name, delay in item['alerts'].items()) or 'no alert'
+            print(f"  {item['event']:<20} {item['type']:<16} {fmt_time(item['start'], absolute)}  {alerts}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--prometheus', nargs='+', metavar='FILE', help='query_range JSON responses')
+    source.add_argument('--simulate', metavar='DURATION', help='simulate this much history, e.g. 30d')
+    source.add_argument('--series', metavar='FILE', help='history saved with --save-series')
+    source.add_argument('--recording', nargs='+', metavar='DIR', help='recordings made with RECORD_DIR')
+    parser.add_argument('--rules', default=DEFAULT_RULES)
+    parser.add_argument('--recording-rules', default=DEFAULT_RECORDING_RULES,
+                        help='recording rules to evaluate first (skipped if the file does not exist)')
+    parser.add_argument('--alert', action='append', help='only backtest these alerts')
+    parser.add_argument('--step', help='grid step for --prometheus and --recording input '
+                                       '(default: smallest sample spacing)')
+    parser.add_argument('--scenario', help='scenario file for --simulate')
+    parser.add_argument('--seed', type=int, help='scenario seed for --simulate')
+    parser.add_argument('--sources', default='gpu,app', help='simulated components: gpu, ml, app')
+    parser.add_argument('--gpus', type=int, default=8, help='simulated fleet size')
+    parser.add_argument('--rps', type=float, default=0.2, help='simulated /api/test requests per second')
+    parser.add_argument('--flap-window', default='10m', help='re-firing within this long after resolving is a flap')
+    parser.add_argument('--max-episodes', type=int, default=10)
+    parser.add_argument('--save-series', metavar='FILE', help='save the history as .npz for later runs')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    events = []
+    if args.prometheus:
+        store = load_prometheus(args.prometheus, parse_duration(args.step) if args.step else None)
+    elif args.series:
+        store = load_store(args.series)
+    elif args.recording:
+        store = load_recordings(args.recording, rule_names(args.rules, args.recording_rules),
+                                parse_duration(args.step) if args.step else None)
+    else:
+        store, events = simulate(parse_duration(args.simulate), args.scenario, args.seed,
+                                 set(args.sources.split(',')), args.gpus, args.rps)
+    loaded = time.perf_counter()
+    if args.save_series:
+        save_store(store, args.save_series)
+
+    if os.path.exists(args.recording_rules):
+        record(store, args.recording_rules)
+    rules = [rule for rule in load_rules(args.rules) if not args.alert or rule.name in args.alert]
+    evaluator = Evaluator(store)
+    results = []
+    for rule in rules:
+        missing = selectors(rule.ast) - store.names()
+        if missing:
+            print(f"warning: {rule.name} reads {', '.join(sorted(missing))}, which the history does not contain",
+                  file=sys.stderr)
+        results.append(backtest(rule, evaluator, parse_duration(args.flap_window)))
+    evaluated = time.perf_counter()
+    latencies = event_latency(events, results)
+
+    if args.json:
+        json.dump({'rules': results, 'events': latencies}, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(results, latencies, store, absolute=bool(args.prometheus or args.recording), max_episodes=args.max_episodes)
+    print(f"\nLoaded history in {loaded - started:.2f}s, evaluated {len(rules)} rules in {evaluated - loaded:.2f}s",
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
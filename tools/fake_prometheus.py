@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Fake Prometheus API
+Serves the parts of the Prometheus HTTP API that tools/stack_report.py
+reads, for the compose jobs plus --targets simulated GPU nodes, so the
+report can be developed and load-tested without the real stack.
+
+Instant queries are evaluated with tools/promql.py over every target's
+up, scrape_duration_seconds and scrape_samples_scraped series; targets,
+TSDB head statistics, alerts and the __name__ values are generated from
+the same target list. --down and --stale mark a share of the GPU nodes as
+failing or no longer scraped, --latency delays every response like a busy
+server, and requests per endpoint are counted on /metrics, which shows
+how many requests a report run actually made.
+
+    python tools/fake_prometheus.py --targets 500 --latency 50
+    python tools/stack_report.py --prometheus http://localhost:9099 --no-docker
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, generate_latest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'simulators'))
+sys.path.insert(0, os.path.join(ROOT, 'common'))
+
+from gpu_simulator import GAUGES, GPUS_PER_NODE
+from promql import Evaluator, PromQLError, SeriesStore, Vector
+
+SCRAPE_INTERVAL = 15.0
+
+# job -> (instance, series per metric name), roughly what the compose services expose
+COMPOSE_TARGETS = {
+    'prometheus': ('prometheus:9090', {'prometheus_http_request_duration_seconds_bucket': 180,
+                                       'prometheus_http_requests_total': 40, 'go_gc_duration_seconds': 5}),
+    'node-exporter': ('node-exporter:9100', {'node_cpu_seconds_total': 64, 'node_filesystem_avail_bytes': 12,
+                                             'node_memory_MemAvailable_bytes': 1}),
+    'cadvisor': ('cadvisor:8080', {'container_cpu_usage_seconds_total': 90, 'container_memory_usage_bytes': 45}),
+    'python-app': ('python-app:8000', {'app_request_duration_seconds_bucket': 180, 'app_requests_total': 12,
+                                       'gpu_utilization_percent': 4, 'job_queue_size': 2}),
+    'ml-simulator': ('ml-simulator:9500', {'inference_latency_seconds_bucket': 60, 'inference_requests_total': 4,
+                                           'ml_job_queue_depth': 1, 'training_loss': 1}),
+}
+GPU_NODE_SERIES = dict({name: GPUS_PER_NODE for name, _, _ in GAUGES}, gpu_ecc_errors_total=GPUS_PER_NODE)
+
+registry = CollectorRegistry()
+requests_total = Counter('fake_prometheus_requests', 'API requests by endpoint', ['endpoint'], registry=registry)
+
+
+class Target:
+    def __init__(self, job, instance, series, rng, health='up', stale=False):
+        self.job = job
+        self.instance = instance
+        self.series = series  # metric name -> series count
+        self.health = health
+        self.phase = rng.uniform(0, SCRAPE_INTERVAL)
+        # A stale target's last scrape is stuck several intervals back
+        self.lag = rng.uniform(3, 20) * SCRAPE_INTERVAL if stale else None
+        self.duration = rng.uniform(0.002, 0.02) * (1 + sum(series.values()) / 1000)
+
+    @property
+    def samples(self):
+        return sum(self.series.values()) if self.health == 'up' else 0
+
+    def last_scrape(self, now):
+        if self.lag is not None:
+            return now - self.lag
+        return now - (now - self.phase) % SCRAPE_INTERVAL
+
+    def api(self, now):
+        stamp = datetime.fromtimestamp(self.last_scrape(now), timezone.utc).isoformat(timespec='microseconds')
+        labels = {'job': self.job, 'instance': self.instance}
+        return {
+            'discoveredLabels': dict(labels, __address__=self.instance),
+            'labels': labels,
+            'scrapePool': self.job,
+            'scrapeUrl': f'http://{self.instance}/metrics',
+            'globalUrl': f'http://{self.instance}/metrics',
+            'lastError': '' if self.health == 'up' else 'connection refused',
+            'lastScrape': stamp.replace('+00:00', 'Z'),
+            'lastScrapeDuration': self.duration,
+            'health': self.health,
+            'scrapeInterval': f'{SCRAPE_INTERVAL:g}s',
+            'scrapeTimeout': '10s',
+        }
+
+
+def make_targets(gpu_nodes, down, stale, seed):
+    rng = random.Random(seed)
+    targets = [Target(job, instance, series, rng) for job, (instance, series) in COMPOSE_TARGETS.items()]
+    for node in range(gpu_nodes):
+        roll = rng.random()
+        health = 'down' if roll < down else 'up'
+        targets.append(Target('gpu-simulator', f'node{node}', GPU_NODE_SERIES, rng, health,
+                              stale=down <= roll < down + stale))
+    return targets
+
+
+def build_store(targets, now):
+    """The scrape series Prometheus keeps for every target, on a one-step grid"""
+    store = SeriesStore(now, SCRAPE_INTERVAL, 1)
+    for target in targets:
+        if target.lag is not None:
+            continue  # stale targets' series have been marked stale
+        labels = {'job': target.job, 'instance': target.instance}
+        store.add(dict(labels, __name__='up'), [1.0 if target.health == 'up' else 0.0])
+        store.add(dict(labels, __name__='scrape_duration_seconds'), [target.duration])
+        store.add(dict(labels, __name__='scrape_samples_scraped'), [float(target.samples)])
+    return store
+
+
+def tsdb_status(targets, limit):
+    by_metric = {}
+    for target in targets:
+        if target.health == 'up':
+            for name, count in target.series.items():
+                by_metric[name] = by_metric.get(name, 0) + count
+    scrape_series = 3 * len(targets)  # up, scrape_duration_seconds, scrape_samples_scraped
+    top = sorted(by_metric.items(), key=lambda item: -item[1])[:limit]
+    return {
+        'headStats': {'numSeries': sum(by_metric.values()) + scrape_series, 'chunkCount': 0,
+                      'minTime': 0, 'maxTime': 0},
+        'seriesCountByMetricName': [{'name': name, 'value': count} for name, count in top],
+        'labelValueCountByLabelName': [
+            {'name': '__name__', 'value': len(by_metric) + 3},
+            {'name': 'instance', 'value': len(targets)},
+            {'name': 'job', 'value': len({target.job for target in targets})},
+        ],
+        'memoryInBytesByLabelName': [],
+        'seriesCountByLabelValuePair': [],
+    }
+
+
+def alerts(targets, now):
+    """GPUOffline firing for every down GPU node"""
+    return {'alerts': [{
+        'labels': {'alertname': 'GPUOffline', 'severity': 'critical', 'instance': target.instance},
+        'annotations': {'summary': f'GPU node {target.instance} is offline'},
+        'state': 'firing',
+        'activeAt': datetime.fromtimestamp(now - 600, timezone.utc).isoformat().replace('+00:00', 'Z'),
+        'value': '0e+00',
+    } for target in targets if target.job == 'gpu-simulator' and target.health == 'down']}
+
+
+def query(targets, expr):
+    now = time.time()
+    result = Evaluator(build_store(targets, now)).evaluate(expr)
+    if not isinstance(result, Vector):
+        return {'resultType': 'scalar', 'result': [now, repr(float(result))]}
+    return {'resultType': 'vector', 'result': [
+        {'metric': labels, 'value': [now, repr(float(values[-1]))]}
+        for labels, values in zip(result.labels, result.values) if values[-1] == values[-1]  # skip NaN
+    ]}
+
+
+def make_handler(targets, latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive, like Prometheus
+
+        def _respond(self, code, body, content_type='application/json'):
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _json(self, data=None, error=None):
+            payload = {'status': 'success', 'data': data} if error is None else \
+                {'status': 'error', 'errorType': 'bad_data', 'error': error}
+            self._respond(200 if error is None else 400, json.dumps(payload).encode())
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            if url.path == '/metrics':
+                return self._respond(200, generate_latest(registry), CONTENT_TYPE_LATEST)
+            requests_total.labels(url.path).inc()
+            if latency:
+                time.sleep(latency)
+            now = time.time()
+            if url.path == '/api/v1/query':
+                try:
+                    return self._json(query(targets, params.get('query', '')))
+                except PromQLError as e:
+                    return self._json(error=str(e))
+            if url.path == '/api/v1/targets':
+                return self._json({'activeTargets': [target.api(now) for target in targets], 'droppedTargets': []})
+            if url.path == '/api/v1/status/tsdb':
+                return self._json(tsdb_status(targets, int(params.get('limit', 10))))
+            if url.path == '/api/v1/alerts':
+                return self._json(alerts(targets, now))
+            if url.path == '/api/v1/label/__name__/values':
+                names = {name for target in targets for name in target.series}
+                return self._json(sorted(names | {'up', 'scrape_duration_seconds', 'scrape_samples_scraped'}))
+            self._respond(404, b'{"status": "error", "errorType": "not_found", "error": "not found"}')
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(port, gpu_nodes, down=0.0, stale=0.0, latency=0.0, seed=0):
+    """Start a fake Prometheus on `port` (0 picks one) and return the server; serve_forever() runs it"""
+    handler = make_handler(make_targets(gpu_nodes, down, stale, seed), latency)
+    server = ThreadingHTTPServer(('127.0.0.1' if port == 0 else '', port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=9099)
+    parser.add_argument('--targets', type=int, default=100, help='simulated GPU nodes, on top of the compose jobs')
+    parser.add_argument('--down', type=float, default=0.02, help='share of GPU nodes that fail their scrapes')
+    parser.add_argument('--stale', type=float, default=0.02, help='share of GPU nodes no longer being scraped')
+    parser.add_argument('--latency', type=float, default=0.0, help='milliseconds to delay every API response')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    server = serve(args.port, args.targets, args.down, args.stale, args.latency / 1000, args.seed)
+    print(f"Fake Prometheus on :{server.server_address[1]} with {args.targets + len(COMPOSE_TARGETS)} targets")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Shutting down fake Prometheus")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,629 @@
+"""
+PromQL Subset
+Parser and vectorized evaluator for the part of PromQL our alert and
+recording rules use, evaluated over a whole history at once.
+
+Supported:
+    selectors     name{label="v", label!="v", label=~"re", label!~"re"}, range [5m]
+    functions     rate, increase, avg_over_time, min_over_time, max_over_time,
+                  histogram_quantile (parsed and unparsed, not evaluated)
+    aggregations  sum, avg, min, max, count with by (...) / without (...)
+    operators     + - * / % ^, == != > < >= <= (filtering, or with bool),
+                  on (...) / ignoring (...) one-to-one vector matching, and unary minus
+
+Series live in a SeriesStore on a regular time grid, one NumPy row per
+series with NaN where there is no sample. Every expression evaluates to a
+Vector covering all grid steps at once: selectors apply Prometheus' 5m
+lookback, rate/increase use its counter-reset handling and extrapolation,
+and comparisons and arithmetic are element-wise array operations. A month
+of 10s samples is a few hundred thousand columns per series, so a rule is
+evaluated over the whole history in one pass instead of once per step.
+"""
+
+import re
+import warnings
+
+import numpy as np
+
+LOOKBACK = 300.0  # seconds an instant selector looks back for a sample
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800, 'y': 31536000}
+FUNCTIONS = ('rate', 'increase', 'avg_over_time', 'min_over_time', 'max_over_time')
+PARSE_ONLY_FUNCTIONS = ('histogram_quantile',)
+AGGREGATIONS = ('sum', 'avg', 'min', 'max', 'count')
+COMPARISONS = ('==', '!=', '>', '<', '>=', '<=')
+
+# Binary operator precedence, lowest first (Prometheus order)
+PRECEDENCE = {
+    '==': 1, '!=': 1, '>': 1, '<': 1, '>=': 1, '<=': 1,
+    '+': 2, '-': 2,
+    '*': 3, '/': 3, '%': 3,
+    '^': 4,
+}
+
+_TOKEN = re.compile(r'''
+    \s*(?:
+        (?P<duration>\d+(?:ms|[smhdwy]))(?![A-Za-z0-9_])
+      | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+      | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+      | (?P<ident>[A-Za-z_:][A-Za-z0-9_:]*)
+      | (?P<op>==|!=|=~|!~|>=|<=|[-+*/%^<>=(){}\[\],])
+    )''', re.VERBOSE)
+
+
+class PromQLError(ValueError):
+    pass
+
+
+def parse_duration(text):
+    """Seconds in a PromQL duration such as 5m or 1h30m"""
+    parts = re.findall(r'(\d+)(ms|[smhdwy])', text)
+    if not parts or ''.join(n + u for n, u in parts) != text:
+        raise PromQLError(f"Invalid duration {text!r}")
+    return sum(int(n) * DURATION_UNITS[u] for n, u in parts)
+
+
+def tokenize(text):
+    tokens, pos = [], 0
+    text = text.strip()
+    while pos < len(text):
+        match = _TOKEN.match(text, pos)
+        if not match or match.end() == pos:
+            raise PromQLError(f"Unexpected input at {pos}: {text[pos:pos + 20]!r}")
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        pos = match.end()
+    tokens.append(('end', None))
+    return tokens
+
+
+# AST nodes are tuples: ('number', value), ('selector', name, matchers, range),
+# ('call', function, args), ('aggregate', op, grouping, without, expr),
+# ('binary', op, lhs, rhs, bool, on, labels), ('neg', expr)
+
+class _Parser:
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos]
+
+    def take(self, value=None):
+        kind, token = self.tokens[self.pos]
+        if value is not None and token != value:
+            raise PromQLError(f"Expected {value!r}, got {token!r}")
+        self.pos += 1
+        return kind, token
+
+    def parse(self):
+        node = self.expression(0)
+        if self.peek()[0] != 'end':
+            raise PromQLError(f"Unexpected {self.peek()[1]!r}")
+        return node
+
+    def expression(self, min_precedence):
+        lhs = self.unary()
+        while True:
+            kind, op = self.peek()
+            if kind != 'op' or op not in PRECEDENCE or PRECEDENCE[op] < min_precedence:
+                return lhs
+            precedence = PRECEDENCE[op]
+            self.take()
+            bool_modifier = self._keyword('bool')
+            on, labels = None, ()
+            if self.peek()[1] in ('on', 'ignoring'):
+                on = self.take()[1] == 'on'
+                labels = self.label_list()
+            # ^ is right associative, everything else left associative
+            rhs = self.expression(precedence if op == '^' else precedence + 1)
+            lhs = ('binary', op, lhs, rhs, bool_modifier, on, labels)
+
+    def _keyword(self, word):
+        if self.peek() == ('ident', word):
+            self.take()
+            return True
+        return False
+
+    def unary(self):
+        kind, token = self.peek()
+        if (kind, token) == ('op', '-'):
+            self.take()
+            return ('neg', self.unary())
+        if (kind, token) == ('op', '+'):
+            self.take()
+            return self.unary()
+        return self.primary()
+
+    def primary(self):
+        kind, token = self.take()
+        if kind == 'number':
+            return ('number', float(token))
+        if (kind, token) == ('op', '('):
+            node = self.expression(0)
+            self.take(')')
+            return node
+        if (kind, token) == ('op', '{'):
+            return self.selector(None)
+        if kind != 'ident':
+            raise PromQLError(f"Unexpected {token!r}")
+        if token in AGGREGATIONS and self.peek()[1] in ('(', 'by', 'without'):
+            return self.aggregation(token)
+        if token in FUNCTIONS + PARSE_ONLY_FUNCTIONS and self.peek()[1] == '(':
+            self.take('(')
+            args = [self.expression(0)]
+            while self.peek()[1] == ',':
+                self.take()
+                args.append(self.expression(0))
+            self.take(')')
+            return ('call', token, args)
+        if self.peek()[1] == '(':
+            raise PromQLError(f"Unsupported function {token!r}")
+        return self.selector(token)
+
+    def label_list(self):
+        self.take('(')
+        labels = []
+        while self.peek()[1] != ')':
+            labels.append(self.take()[1])
+            if self.peek()[1] == ',':
+                self.take()
+        self.take(')')
+        return tuple(labels)
+
+    def aggregation(self, op):
+        grouping, without = (), False
+        if self.peek()[1] in ('by', 'without'):
+            without = self.take()[1] == 'without'
+            grouping = self.label_list()
+        self.take('(')
+        expr = self.expression(0)
+        self.take(')')
+        if self.peek()[1] in ('by', 'without'):
+            without = self.take()[1] == 'without'
+            grouping = self.label_list()
+        return ('aggregate', op, grouping, without, expr)
+
+    def selector(self, name):
+        matchers = []
+        if name is None:
+            pass  # opening brace already taken
+        elif self.peek()[1] == '{':
+            self.take('{')
+        else:
+            return self._range(('selector', name, (), None))
+        while self.peek()[1] != '}':
+            label = self.take()[1]
+            op = self.take()[1]
+            if op not in ('=', '!=', '=~', '!~'):
+                raise PromQLError(f"Invalid matcher operator {op!r}")
+            kind, value = self.take()
+            if kind != 'string':
+                raise PromQLError(f"Expected a quoted label value for {label!r}")
+            value = bytes(value[1:-1], 'utf-8').decode('unicode_escape')
+            if label == '__name__' and op == '=':
+                name = value
+            else:
+                matchers.append((label, op, value))
+            if self.peek()[1] == ',':
+                self.take()
+        self.take('}')
+        return self._range(('selector', name, tuple(matchers), None))
+
+    def _range(self, node):
+        if self.peek()[1] != '[':
+            return node
+        self.take('[')
+        kind, token = self.take()
+        if kind != 'duration':
+            raise PromQLError(f"Expected a range duration, got {token!r}")
+        self.take(']')
+        return node[:3] + (parse_duration(token),)
+
+
+def parse(text):
+    """Parse a PromQL expression into a tuple AST"""
+    return _Parser(text).parse()
+
+
+def format_duration(seconds):
+    """Shortest PromQL duration for a number of seconds, e.g. 300 -> 5m"""
+    for unit, size in sorted(DURATION_UNITS.items(), key=lambda item: -item[1]):
+        if size >= 1 and seconds >= size and seconds % size == 0:
+            return f'{int(seconds // size)}{unit}'
+    return f'{int(round(seconds * 1000))}ms'
+
+
+def _quote(value):
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+
+
+def _operand(node, op, right):
+    """Format a binary operand, parenthesized if it would otherwise bind differently"""
+    text = unparse(node)
+    if node[0] == 'binary':
+        inner, outer = PRECEDENCE[node[1]], PRECEDENCE[op]
+        # ^ is right associative, everything else left associative
+        if inner < outer or (inner == outer and right != (op == '^')):
+            return f'({text})'
+    return text
+
+
+def unparse(node):
+    """PromQL text for an AST; parse(unparse(node)) == node"""
+    kind = node[0]
+    if kind == 'number':
+        return str(int(node[1])) if float(node[1]).is_integer() else repr(node[1])
+    if kind == 'selector':
+        _, name, matchers, window = node
+        text = name or ''
+        if matchers or not name:
+            text += '{' + ', '.join(f'{label}{op}{_quote(value)}' for label, op, value in matchers) + '}'
+        return text + (f'[{format_duration(window)}]' if window is not None else '')
+    if kind == 'call':
+        return f"{node[1]}({', '.join(unparse(arg) for arg in node[2])})"
+    if kind == 'aggregate':
+        _, op, grouping, without, expr = node
+        modifier = f" {'without' if without else 'by'} ({', '.join(grouping)})" if grouping or without else ''
+        return f'{op}{modifier} ({unparse(expr)})' if modifier else f'{op}({unparse(expr)})'
+    if kind == 'neg':
+        operand = unparse(node[1])
+        return f'-({operand})' if node[1][0] == 'binary' else f'-{operand}'
+    if kind == 'binary':
+        _, op, lhs, rhs, bool_modifier, on, labels = node
+        text = f"{_operand(lhs, op, False)} {op}"
+        if bool_modifier:
+            text += ' bool'
+        if on is not None:
+            text += f" {'on' if on else 'ignoring'} ({', '.join(labels)})"
+        return f"{text} {_operand(rhs, op, True)}"
+    raise PromQLError(f"Cannot format {kind}")
+
+
+def children(node):
+    """Direct subexpressions of an AST node"""
+    kind = node[0]
+    if kind == 'call':
+        return tuple(node[2])
+    if kind == 'aggregate':
+        return (node[4],)
+    if kind == 'binary':
+        return (node[2], node[3])
+    if kind == 'neg':
+        return (node[1],)
+    return ()
+
+
+def walk(node):
+    """Every node of an AST, parents before children"""
+    yield node
+    for child in children(node):
+        yield from walk(child)
+
+
+def selectors(node):
+    """Metric names an expression reads"""
+    if node[0] == 'selector':
+        return {node[1]}
+    if node[0] == 'call':
+        return set().union(*(selectors(arg) for arg in node[2]))
+    if node[0] == 'aggregate':
+        return selectors(node[4])
+    if node[0] == 'binary':
+        return selectors(node[2]) | selectors(node[3])
+    if node[0] == 'neg':
+        return selectors(node[1])
+    return set()
+
+
+class Vector:
+    """Series labels plus a [series, steps] value array (NaN = no sample)"""
+
+    def __init__(self, labels, values):
+        self.labels = labels
+        self.values = values
+
+    def __len__(self):
+        return len(self.labels)
+
+
+class SeriesStore:
+    """Samples of many series on one regular time grid"""
+
+    def __init__(self, start, step, steps):
+        self.start = float(start)
+        self.step = float(step)
+        self.steps = int(steps)
+        self.labels = []
+        self.rows = []
+        self._by_name = {}
+
+    @property
+    def timestamps(self):
+        return self.start + self.step * np.arange(self.steps)
+
+    def add(self, labels, values):
+        """Add one series; values has one entry per grid step, NaN where absent"""
+        values = np.asarray(values, dtype=np.float64)
+        if values.shape != (self.steps,):
+            raise ValueError(f"Series {labels} has {values.shape} values, expected ({self.steps},)")
+        self._by_name.setdefault(labels['__name__'], []).append(len(self.rows))
+        self.labels.append(dict(labels))
+        self.rows.append(values)
+
+    def add_samples(self, labels, timestamps, values):
+        """Add a series from raw (timestamp, value) samples, each placed on the step at or before it"""
+        row = np.full(self.steps, np.nan)
+        index = np.floor((np.asarray(timestamps, dtype=np.float64) - self.start) / self.step + 1e-9).astype(np.int64)
+        keep = (index >= 0) & (index < self.steps)
+        row[index[keep]] = np.asarray(values, dtype=np.float64)[keep]
+        self.add(labels, row)
+
+    def names(self):
+        return set(self._by_name)
+
+    def select(self, name, matchers):
+        indices = self._by_name.get(name, []) if name is not None else range(len(self.rows))
+        picked = [i for i in indices if _matches(self.labels[i], matchers)]
+        labels = [self.labels[i] for i in picked]
+        values = np.vstack([self.rows[i] for i in picked]) if picked else np.empty((0, self.steps))
+        return labels, values
+
+
+def _matches(labels, matchers):
+    for label, op, value in matchers:
+        actual = labels.get(label, '')
+        if op == '=' and actual != value:
+            return False
+        if op == '!=' and actual == value:
+            return False
+        if op == '=~' and not re.fullmatch(value, actual):
+            return False
+        if op == '!~' and re.fullmatch(value, actual):
+            return False
+    return True
+
+
+def _last_index(present):
+    """For every step, the index of the latest present sample at or before it (-1 if none)"""
+    index = np.where(present, np.arange(present.shape[-1]), -1)
+    return np.maximum.accumulate(index, axis=-1)
+
+
+def _next_index(present):
+    """For every step, the index of the earliest present sample at or after it (steps if none)"""
+    steps = present.shape[-1]
+    index = np.where(present, np.arange(steps), steps)
+    return np.minimum.accumulate(index[..., ::-1], axis=-1)[..., ::-1]
+
+
+def _take(values, index):
+    """values[row, index[row, step]] with NaN where index is out of range"""
+    steps = values.shape[-1]
+    clipped = np.clip(index, 0, steps - 1)
+    out = np.take_along_axis(values, clipped, axis=-1)
+    return np.where((index >= 0) & (index < steps), out, np.nan)
+
+
+def lookback(values, step, window=LOOKBACK):
+    """Instant-vector values: latest sample within the lookback window"""
+    last = _last_index(~np.isnan(values))
+    fresh = (np.arange(values.shape[-1]) - last) * step < window
+    return np.where(fresh & (last >= 0), _take(values, last), np.nan)
+
+
+def _window_bounds(values, step, window):
+    """First and last present sample index within (t - window, t] for every step"""
+    present = ~np.isnan(values)
+    k = max(int(round(window / step)), 1)
+    steps = values.shape[-1]
+    starts = np.arange(steps) - k + 1
+    first = _next_index(present)[..., np.clip(starts, 0, steps - 1)]
+    last = _last_index(present)
+    valid = (last >= 0) & (first <= last) & (first >= starts)
+    return present, first, last, valid
+
+
+def extrapolated_increase(values, step, window, rate=False):
+    """Prometheus' rate()/increase() over a regular grid, with counter resets"""
+    present, first, last, valid = _window_bounds(values, step, window)
+    filled = _take(values, _last_index(present))
+    previous = np.concatenate([filled[..., :1], filled[..., :-1]], axis=-1)
+    delta = np.where(filled >= previous, filled - previous, filled)  # a drop is a counter reset
+    delta = np.nan_to_num(np.where(np.isnan(previous), 0.0, delta))
+    cumulative = np.cumsum(delta, axis=-1)
+
+    first_c = np.take_along_axis(cumulative, np.clip(first, 0, values.shape[-1] - 1), axis=-1)
+    last_c = np.take_along_axis(cumulative, np.clip(last, 0, values.shape[-1] - 1), axis=-1)
+    increase = last_c - first_c
+    counts = np.cumsum(present, axis=-1)
+    samples = np.take_along_axis(counts, np.clip(last, 0, None), axis=-1) - \
+        np.take_along_axis(counts, np.clip(first, 0, values.shape[-1] - 1), axis=-1) + 1
+    valid &= samples >= 2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        now = np.arange(values.shape[-1]) * step
+        first_t, last_t = first * step, last * step
+        sampled = last_t - first_t
+        average = sampled / (samples - 1)
+        to_start = first_t - (now - window)
+        to_end = now - last_t
+        first_value = _take(values, first)
+        to_zero = np.where((increase > 0) & (first_value >= 0), sampled * first_value / increase, np.inf)
+        to_start = np.minimum(to_start, to_zero)
+        threshold = average * 1.1
+        extrapolate = sampled + np.where(to_start < threshold, to_start, average / 2) + \
+            np.where(to_end < threshold, to_end, average / 2)
+        result = increase * extrapolate / sampled
+        if rate:
+            result = result / window
+    return np.where(valid, result, np.nan)
+
+
+def over_time(values, step, window, how):
+    present, first, last, valid = _window_bounds(values, step, window)
+    k = max(int(round(window / step)), 1)
+    if how == 'avg':
+        counts = np.cumsum(present, axis=-1)
+        sums = np.cumsum(np.nan_to_num(values), axis=-1)
+        k = min(k, values.shape[-1])  # a window longer than the history covers all of it
+        shifted = lambda a: np.concatenate([np.zeros(a.shape[:-1] + (k,)), a[..., :-k]], axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = (sums - shifted(sums)) / (counts - shifted(counts))
+    else:
+        padded = np.concatenate([np.full(values.shape[:-1] + (k - 1,), np.nan), values], axis=-1)
+        windows = np.lib.stride_tricks.sliding_window_view(padded, k, axis=-1)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN windows
+            result = np.nanmax(windows, axis=-1) if how == 'max' else np.nanmin(windows, axis=-1)
+    return np.where(valid, result, np.nan)
+
+
+def _drop_name(labels):
+    return {k: v for k, v in labels.items() if k != '__name__'}
+
+
+def _signature(labels, on, names):
+    if on:
+        return tuple(labels.get(name, '') for name in names)
+    skip = set(names) | {'__name__'}
+    return tuple(sorted((k, v) for k, v in labels.items() if k not in skip))
+
+
+_ARITHMETIC = {
+    '+': np.add, '-': np.subtract, '*': np.multiply, '/': np.true_divide,
+    '%': np.fmod, '^': np.power,
+}
+_COMPARE = {
+    '==': np.equal, '!=': np.not_equal, '>': np.greater, '<': np.less,
+    '>=': np.greater_equal, '<=': np.less_equal,
+}
+
+
+def _apply(op, lhs, rhs, bool_modifier, keep_lhs=True):
+    with np.errstate(all='ignore'):
+        if op in _ARITHMETIC:
+            return _ARITHMETIC[op](lhs, rhs)
+        holds = _COMPARE[op](lhs, rhs)
+        present = ~(np.isnan(lhs) | np.isnan(rhs))
+        if bool_modifier:
+            return np.where(present, holds.astype(np.float64), np.nan)
+        return np.where(holds & present, lhs if keep_lhs else rhs, np.nan)
+
+
+class Evaluator:
+    def __init__(self, store):
+        self.store = store
+
+    def evaluate(self, node):
+        """Evaluate an AST (or expression string) to a Vector or a float"""
+        if isinstance(node, str):
+            node = parse(node)
+        kind = node[0]
+        if kind == 'number':
+            return node[1]
+        if kind == 'neg':
+            value = self.evaluate(node[1])
+            if isinstance(value, Vector):
+                return Vector([_drop_name(l) for l in value.labels], -value.values)
+            return -value
+        if kind == 'selector':
+            if node[3] is not None:
+                raise PromQLError("Range vectors are only supported as function arguments")
+            labels, values = self.store.select(node[1], node[2])
+            return Vector(labels, lookback(values, self.store.step))
+        if kind == 'call':
+            return self._call(node[1], node[2])
+        if kind == 'aggregate':
+            return self._aggregate(*node[1:])
+        if kind == 'binary':
+            return self._binary(*node[1:])
+        raise PromQLError(f"Cannot evaluate {kind}")
+
+    def _call(self, function, args):
+        if function in PARSE_ONLY_FUNCTIONS:
+            raise PromQLError(f"{function}() is not supported by the evaluator")
+        if len(args) != 1 or args[0][0] != 'selector' or args[0][3] is None:
+            raise PromQLError(f"{function}() expects one range vector selector")
+        _, name, matchers, window = args[0]
+        labels, values = self.store.select(name, matchers)
+        step = self.store.step
+        if function in ('rate', 'increase'):
+            result = extrapolated_increase(values, step, window, rate=function == 'rate')
+        else:
+            result = over_time(values, step, window, function.split('_')[0])
+        return Vector([_drop_name(l) for l in labels], result)
+
+    def _aggregate(self, op, grouping, without, expr):
+        vector = self.evaluate(expr)
+        if not isinstance(vector, Vector):
+            raise PromQLError(f"{op}() expects an instant vector")
+        groups = {}
+        for row, labels in enumerate(vector.labels):
+            if without:
+                key = tuple(sorted((k, v) for k, v in labels.items() if k not in grouping and k != '__name__'))
+            else:
+                key = tuple((name, labels.get(name, '')) for name in grouping)
+            groups.setdefault(key, []).append(row)
+        out_labels, out_rows = [], []
+        for key, rows in groups.items():
+            values = vector.values[rows]
+            present = ~np.isnan(values)
+            count = present.sum(axis=0)
+            if op == 'sum':
+                result = np.nansum(values, axis=0)
+            elif op == 'count':
+                result = count.astype(np.float64)
+            elif op == 'avg':
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    result = np.nansum(values, axis=0) / count
+            else:
+                fill = np.inf if op == 'min' else -np.inf
+                reduce = np.min if op == 'min' else np.max
+                result = reduce(np.where(present, values, fill), axis=0)
+            out_labels.append({k: v for k, v in key if v != ''})
+            out_rows.append(np.where(count > 0, result, np.nan))
+        values = np.vstack(out_rows) if out_rows else np.empty((0, self.store.steps))
+        return Vector(out_labels, values)
+
+    def _binary(self, op, lhs, rhs, bool_modifier, on, names):
+        left, right = self.evaluate(lhs), self.evaluate(rhs)
+        comparison = op in COMPARISONS
+        if not isinstance(left, Vector) and not isinstance(right, Vector):
+            if comparison and not bool_modifier:
+                raise PromQLError("Comparisons between scalars need the bool modifier")
+            return float(_apply(op, left, right, True))
+        if not isinstance(right, Vector) or not isinstance(left, Vector):
+            vector, scalar = (left, right) if isinstance(left, Vector) else (right, left)
+            pair = (vector.values, scalar) if vector is left else (scalar, vector.values)
+            values = _apply(op, *pair, bool_modifier, keep_lhs=vector is left)
+            keep_name = comparison and not bool_modifier
+            labels = vector.labels if keep_name else [_drop_name(l) for l in vector.labels]
+            return Vector(labels, values)
+
+        # One-to-one vector matching
+        index = {}
+        for row, labels in enumerate(right.labels):
+            signature = _signature(labels, on, names)
+            if signature in index:
+                raise PromQLError(f"Many-to-one matching is not supported (duplicate series {labels} on the right)")
+            index[signature] = row
+        out_labels, left_rows, right_rows = [], [], []
+        for row, labels in enumerate(left.labels):
+            match = index.get(_signature(labels, on, names))
+            if match is None:
+                continue
+            if on:
+                result_labels = {name: labels[name] for name in names if name in labels}
+            else:
+                result_labels = _drop_name(labels)
+                for name in names:
+                    result_labels.pop(name, None)
+            if comparison and not bool_modifier:
+                result_labels = labels
+            out_labels.append(result_labels)
+            left_rows.append(row)
+            right_rows.append(match)
+        if not out_labels:
+            return Vector([], np.empty((0, self.store.steps)))
+        values = _apply(op, left.values[left_rows], right.values[right_rows], bool_modifier)
+        return Vector(out_labels, values)
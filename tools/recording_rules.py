@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+"""
+Recording Rule Generator
+Precomputes the expensive parts of the Grafana dashboards' and
+prometheus/alerts.yml's queries as recording rules, points the queries at
+the recorded series, and reports how many series and samples every panel
+and alert touches before and after.
+
+Every dashboard target and alert is parsed with tools/promql.py. Its
+outermost rate/increase/*_over_time calls and aggregations are the
+candidates: they read every matching series, over the whole range for
+range functions, on each dashboard refresh (every 5s per open browser) and
+each alert evaluation, and their cost grows with the GPU fleet. Each
+distinct candidate becomes one rule named level:metric:operations (level
+is the `by` labels, `instance` when nothing is aggregated away and empty
+for a full aggregation), so the p95 and p99 latency panels share one
+recorded bucket rate. Bare selectors are left alone, there is nothing to
+precompute. Rules already in the rules file keep their names, so the tool
+can be re-run after a dashboard changes.
+
+Series counts come from the exposition of the targets (--target, by
+default the compose ports on localhost; unreachable ones are skipped) with
+the job and instance labels Prometheus would add, and with --gpus from an
+in-process GPU fleet exposed per node like simulators/fleet.py, to see how
+the cost grows with the fleet. What a rule writes is estimated by deriving
+the label sets of its result from those series, without any values.
+
+    python tools/recording_rules.py --gpus 512            # report only
+    python tools/recording_rules.py --gpus 512 --write    # rules file, dashboards and alerts.yml
+"""
+
+import argparse
+import glob
+import json
+import math
+import os
+import re
+import sys
+import urllib.request
+
+import yaml
+from prometheus_client.parser import text_string_to_metric_families
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'simulators'))
+sys.path.insert(0, os.path.join(ROOT, 'common'))
+
+from promql import (
+    PARSE_ONLY_FUNCTIONS, PromQLError, SeriesStore, children, format_duration, parse, parse_duration, selectors,
+    unparse, walk,
+)
+
+DEFAULT_DASHBOARDS = os.path.join(ROOT, 'grafana', 'dashboards', '*.json')
+DEFAULT_ALERTS = os.path.join(ROOT, 'prometheus', 'alerts.yml')
+DEFAULT_RULES = os.path.join(ROOT, 'prometheus', 'recording_rules.yml')
+RULE_GROUP = 'dashboard_rules'
+RULE_INTERVAL = '15s'  # prometheus.yml's evaluation_interval
+SCRAPE_INTERVAL = '15s'  # prometheus.yml's scrape_interval
+DEFAULT_TARGETS = [
+    ('python-app', 'http://localhost:8000/metrics'),
+    ('gpu-simulator', 'http://localhost:9400/metrics'),
+    ('ml-simulator', 'http://localhost:9500/metrics'),
+    ('node-exporter', 'http://localhost:9100/metrics'),
+]
+
+RULES_HEADER = """\
+# Generated by tools/recording_rules.py from the Grafana dashboards and
+# alerts.yml, which query these series; re-run it after changing either.
+"""
+
+
+class Query:
+    """One PromQL expression from a dashboard target or an alert rule"""
+
+    def __init__(self, source, expr, path=None, target=None, alert=None):
+        self.source = source
+        self.expr = expr
+        self.ast = canonical(parse(expr))
+        self.path = path  # the dashboard file
+        self.target = target  # the dashboard target dict, rewritten in place
+        self.alert = alert  # the alert name, rewritten in alerts.yml's text
+        self.rewritten = self.ast
+
+
+class Rule:
+    def __init__(self, record, ast):
+        self.record = record
+        self.ast = ast
+        self.expr = unparse(ast)
+        self.used_by = []
+
+
+# --- Queries -------------------------------------------------------------
+
+def canonical(node):
+    """The AST with selector matchers sorted, so equal expressions compare equal"""
+    if node[0] == 'selector':
+        return node[:2] + (tuple(sorted(node[2])),) + node[3:]
+    return _replace_children(node, [canonical(child) for child in children(node)])
+
+
+def _replace_children(node, new):
+    kind = node[0]
+    if kind == 'call':
+        return ('call', node[1], list(new))
+    if kind == 'aggregate':
+        return node[:4] + (new[0],)
+    if kind == 'binary':
+        return ('binary', node[1], new[0], new[1]) + node[4:]
+    if kind == 'neg':
+        return ('neg', new[0])
+    return node
+
+
+def _panels(panels):
+    for panel in panels:
+        yield panel
+        yield from _panels(panel.get('panels', []))  # collapsed rows
+
+
+def load_dashboards(paths):
+    """{path: dashboard JSON} and the queries of all their panels"""
+    dashboards, queries = {}, []
+    for path in paths:
+        with open(path) as f:
+            text = f.read()
+        data = json.loads(text)
+        dashboards[path] = (data, text)
+        dashboard = data.get('dashboard', data)  # provisioning API wrapper
+        for panel in _panels(dashboard.get('panels', [])):
+            for target in panel.get('targets', []):
+                if not target.get('expr'):
+                    continue
+                source = f"{dashboard.get('title', os.path.basename(path))} / {panel.get('title', panel.get('id'))}"
+                if len(panel['targets']) > 1:
+                    source += f" [{target.get('refId', '?')}]"
+                try:
+                    queries.append(Query(source, target['expr'], path=path, target=target))
+                except PromQLError as e:
+                    print(f"warning: skipping {source}: {e}", file=sys.stderr)
+    return dashboards, queries
+
+
+def load_alerts(path):
+    with open(path) as f:
+        config = yaml.safe_load(f)
+    queries = []
+    for group in config.get('groups', []):
+        for rule in group.get('rules', []):
+            if 'alert' in rule:
+                queries.append(Query(f"alert {rule['alert']}", rule['expr'], alert=rule['alert']))
+    return queries
+
+
+def load_rules(path):
+    """Recording rules already in the rules file, in order"""
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+    return [Rule(rule['record'], canonical(parse(rule['expr'])))
+            for group in config.get('groups', []) for rule in group.get('rules', []) if 'record' in rule]
+
+
+# --- Series --------------------------------------------------------------
+
+def parse_exposition(text, target_labels):
+    """Label sets of every sample in a text exposition, plus the target's up series"""
+    series = [dict(target_labels, __name__='up')]
+    for family in text_string_to_metric_families(text):
+        for sample in family.samples:
+            series.append(dict(sample.labels, **target_labels, __name__=sample.name))
+    return series
+
+
+def read_target(job, source):
+    if re.match(r'https?://', source):
+        with urllib.request.urlopen(source, timeout=5) as response:
+            text = response.read().decode()
+        instance = re.match(r'https?://([^/]+)', source).group(1)
+    else:
+        with open(source) as f:
+            text = f.read()
+        instance = os.path.basename(source)
+    return parse_exposition(text, {'job': job, 'instance': instance})
+
+
+def fleet_series(gpus):
+    """Series of a simulated fleet of `gpus` GPUs, one target per node like simulators/fleet.py"""
+    import numpy as np
+    from prometheus_client import CollectorRegistry, generate_latest
+
+    from gpu_simulator import GPUS_PER_NODE, FleetCollector, GPUFleet
+
+    series = []
+    nodes = -(-gpus // GPUS_PER_NODE)
+    for node in range(nodes):
+        fleet = GPUFleet(min(GPUS_PER_NODE, gpus - node * GPUS_PER_NODE), rng=np.random.default_rng(node),
+                         first_gpu=node * GPUS_PER_NODE, fleet_size=gpus)
+        fleet.step()
+        registry = CollectorRegistry()
+        registry.register(FleetCollector(fleet))
+        labels = {'job': 'gpu-simulator', 'instance': f'node{node}', 'component': 'gpu', 'environment': 'simulation'}
+        series.extend(parse_exposition(generate_latest(registry).decode(), labels))
+    return series
+
+
+def build_store(series):
+    """A SeriesStore of label sets only (no samples), for selecting and counting series"""
+    store = SeriesStore(0, 1, 0)
+    for labels in series:
+        store.add(labels, [])
+    return store
+
+
+def result_labels(node, store):
+    """Label sets of an expression's result, derived from the series it reads; None for a scalar"""
+    kind = node[0]
+    if kind == 'number':
+        return None
+    if kind == 'selector':
+        return store.select(node[1], node[2])[0]
+    if kind == 'neg':
+        return _without_labels(result_labels(node[1], store), ('__name__',))
+    if kind == 'call':
+        if node[1] == 'histogram_quantile':
+            return _without_labels(result_labels(node[2][1], store), ('__name__', 'le'))
+        return _without_labels(result_labels(node[2][0], store), ('__name__',))
+    if kind == 'aggregate':
+        _, op, grouping, without, expr = node
+        groups = {}
+        for labels in result_labels(expr, store) or []:
+            if without:
+                key = tuple(sorted((k, v) for k, v in labels.items() if k not in grouping and k != '__name__'))
+            else:
+                key = tuple((name, labels[name]) for name in grouping if name in labels)
+            groups[key] = dict(key)
+        return list(groups.values())
+    _, op, lhs, rhs, bool_modifier, on, names = node
+    left, right = result_labels(lhs, store), result_labels(rhs, store)
+    if left is None or right is None:
+        vector = left if right is None else right
+        return vector if vector is None or op in ('==', '!=', '>', '<', '>=', '<=') and not bool_modifier \
+            else _without_labels(vector, ('__name__',))
+    signatures = {_signature(labels, on, names) for labels in right}
+    matched = [labels for labels in left if _signature(labels, on, names) in signatures]
+    return matched if op in ('==', '!=', '>', '<', '>=', '<=') and not bool_modifier \
+        else _without_labels(matched, ('__name__',))
+
+
+def _without_labels(label_sets, names):
+    if label_sets is None:
+        return None
+    unique = {}
+    for labels in label_sets:
+        kept = {k: v for k, v in labels.items() if k not in names}
+        unique[tuple(sorted(kept.items()))] = kept
+    return list(unique.values())
+
+
+def _signature(labels, on, names):
+    if on:
+        return tuple(labels.get(name, '') for name in names)
+    skip = set(names) | {'__name__'}
+    return tuple(sorted((k, v) for k, v in labels.items() if k not in skip))
+
+
+def cost(node, store, scrape_interval):
+    """(series, samples) an expression reads in one evaluation"""
+    series = samples = 0
+    for selector in walk(node):
+        if selector[0] != 'selector':
+            continue
+        count = len(store.select(selector[1], selector[2])[0])
+        series += count
+        window = selector[3]
+        samples += count * (max(1, math.ceil(window / scrape_interval)) if window else 1)
+    return series, samples
+
+
+# --- Rules ---------------------------------------------------------------
+
+def candidates(node):
+    """Outermost range-function calls and aggregations of an expression"""
+    if node[0] == 'aggregate' or (node[0] == 'call' and node[1] not in PARSE_ONLY_FUNCTIONS):
+        return [node]
+    return [found for child in children(node) for found in candidates(child)]
+
+
+def _sanitize(value):
+    return re.sub(r'[^A-Za-z0-9_]+', '_', value).strip('_')
+
+
+def rule_name(node):
+    """level:metric:operations for a candidate, following Prometheus' naming conventions"""
+    level, operations = None, []
+    while node[0] != 'selector':
+        if node[0] == 'aggregate':
+            _, op, grouping, without, expr = node
+            if level is None:  # the outermost aggregation sets the level
+                level = ('without_' if without else '') + '_'.join(grouping)
+            operations.append(op)
+            node = expr
+        elif node[0] == 'call':
+            window = next((arg[3] for arg in node[2] if arg[0] == 'selector' and arg[3]), None)
+            operations.append(node[1] + (format_duration(window) if window else ''))
+            node = node[2][-1]
+        elif node[0] == 'binary':
+            operations.append({'/': 'ratio', '*': 'product', '+': 'sum', '-': 'difference'}.get(node[1], 'op'))
+            node = node[2] if node[2][0] != 'number' else node[3]
+        elif node[0] == 'neg':
+            node = node[1]
+        else:
+            break
+    metric = re.sub(r'_total$', '', node[1] or 'series') if node[0] == 'selector' else 'value'
+    if node[0] == 'selector':
+        metric = '_'.join([metric] + [_sanitize(value) for _, op, value in node[2] if op == '=' and _sanitize(value)])
+    return f"{'instance' if level is None else level}:{metric}:{'_'.join(operations)}"
+
+
+def plan(queries, rules, store, scrape_interval, min_samples):
+    """Pick the candidates worth recording, extend `rules` with them and rewrite the queries"""
+    by_expr = {rule.expr: rule for rule in rules}
+    names = {rule.record for rule in rules}
+    for query in queries:
+        replacements = {}
+        for node in candidates(query.ast):
+            expr = unparse(node)
+            rule = by_expr.get(expr)
+            if rule is None:
+                if cost(node, store, scrape_interval)[1] < min_samples:
+                    continue
+                record = base = rule_name(node)
+                n = 1
+                while record in names:
+                    n += 1
+                    record = f'{base}_{n}'
+                rule = by_expr[expr] = Rule(record, node)
+                names.add(record)
+                rules.append(rule)
+                # Later rules and queries can read this rule's output
+                for labels in result_labels(node, store) or []:
+                    store.add(dict(labels, __name__=record), [])
+            replacements[expr] = ('selector', rule.record, (), None)
+        query.rewritten = _substitute(query.ast, replacements)
+    for query in queries:
+        read = selectors(query.rewritten)
+        for rule in rules:
+            if rule.record in read:
+                rule.used_by.append(query.source)
+    return rules
+
+
+def _substitute(node, replacements):
+    replacement = replacements.get(unparse(node))
+    if replacement is not None:
+        return replacement
+    return _replace_children(node, [_substitute(child, replacements) for child in children(node)])
+
+
+def _yaml_scalar(text):
+    """`text` as a plain YAML scalar if it reads back unchanged, else double-quoted"""
+    try:
+        if yaml.safe_load(f'key: {text}') == {'key': text}:
+            return text
+    except yaml.YAMLError:
+        pass
+    return json.dumps(text)
+
+
+def write_rules(path, rules):
+    lines = [RULES_HEADER + 'groups:', f'  - name: {RULE_GROUP}', f'    interval: {RULE_INTERVAL}', '    rules:']
+    for rule in rules:
+        lines.append(f'      - record: {rule.record}')
+        lines.append(f'        expr: {_yaml_scalar(rule.expr)}')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def write_dashboards(dashboards, queries):
+    changed = set()
+    for query in queries:
+        if query.target is not None and query.rewritten != query.ast:
+            query.target['expr'] = unparse(query.rewritten)
+            changed.add(query.path)
+    for path in sorted(changed):
+        data, text = dashboards[path]
+        with open(path, 'w') as f:
+            f.write(json.dumps(data, indent=2, ensure_ascii=False) + ('\n' if text.endswith('\n') else ''))
+    return sorted(changed)
+
+
+def write_alerts(path, queries):
+    """Replace rewritten alert expressions in place, keeping the file's layout and comments"""
+    with open(path) as f:
+        text = f.read()
+    rewritten = 0
+    for query in queries:
+        if query.alert is None or query.rewritten == query.ast:
+            continue
+        old = f'expr: {query.expr}'
+        if text.count(old) != 1:
+            print(f"warning: {query.source}: expression not found once in {path}, not rewritten", file=sys.stderr)
+            continue
+        text = text.replace(old, f'expr: {_yaml_scalar(unparse(query.rewritten))}')
+        rewritten += 1
+    if rewritten:
+        with open(path, 'w') as f:
+            f.write(text)
+    return rewritten
+
+
+# --- Report --------------------------------------------------------------
+
+def print_report(queries, rules, store, scrape_interval, dashboards):
+    width = max([len(query.source) for query in queries] + [5])
+    print(f"{'query':<{width}} {'series':>8} {'samples':>9}  {'recorded: series':>16} {'samples':>9}")
+    for query in queries:
+        before = cost(query.ast, store, scrape_interval)
+        after = cost(query.rewritten, store, scrape_interval)
+        print(f"{query.source:<{width}} {before[0]:>8} {before[1]:>9}  {after[0]:>16} {after[1]:>9}")
+
+    print(f"\n{'rule':<48} {'reads':>8} {'samples':>9} {'writes':>7}  used by")
+    for rule in rules:
+        series, samples = cost(rule.ast, store, scrape_interval)
+        writes = len(store.select(rule.record, ())[0])
+        used = ', '.join(rule.used_by) if rule.used_by else '(unused)'
+        print(f"{rule.record:<48} {series:>8} {samples:>9} {writes:>7}  {used}")
+
+    print()
+    for path, (data, _) in dashboards.items():
+        dashboard = data.get('dashboard', data)
+        panel_queries = [q for q in queries if q.path == path]
+        if not panel_queries:
+            continue
+        refresh = dashboard.get('refresh') or '1m'
+        before = sum(cost(q.ast, store, scrape_interval)[1] for q in panel_queries)
+        after = sum(cost(q.rewritten, store, scrape_interval)[1] for q in panel_queries)
+        print(f"{dashboard.get('title', os.path.basename(path))}: {before} samples per refresh (every {refresh}) "
+              f"before, {after} with recording rules")
+    alert_queries = [q for q in queries if q.alert is not None]
+    if alert_queries:
+        before = sum(cost(q.ast, store, scrape_interval)[1] for q in alert_queries)
+        after = sum(cost(q.rewritten, store, scrape_interval)[1] for q in alert_queries)
+        print(f"alerts: {before} samples per evaluation before, {after} with recording rules")
+    total = sum(cost(rule.ast, store, scrape_interval)[1] for rule in rules)
+    print(f"recording rules: {total} samples every {RULE_INTERVAL}, "
+          f"independent of how many dashboards are open")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dashboards', nargs='+', help='dashboard JSON files (default: grafana/dashboards/*.json)')
+    parser.add_argument('--alerts', default=DEFAULT_ALERTS)
+    parser.add_argument('--rules', default=DEFAULT_RULES, help='recording rules file to extend and write')
+    parser.add_argument('--target', action='append', metavar='JOB=URL|FILE',
+                        help='exposition to count series in (default: the compose ports on localhost)')
+    parser.add_argument('--gpus', type=int, help='count gpu-simulator series in an in-process fleet of this size')
+    parser.add_argument('--scrape-interval', default=SCRAPE_INTERVAL)
+    parser.add_argument('--min-samples', type=int, default=0,
+                        help='only record candidates that read at least this many samples per evaluation')
+    parser.add_argument('--write', action='store_true', help='write the rules file, dashboards and alerts')
+    args = parser.parse_args()
+
+    dashboards, queries = load_dashboards(args.dashboards or sorted(glob.glob(DEFAULT_DASHBOARDS)))
+    queries += load_alerts(args.alerts)
+    rules = load_rules(args.rules)
+
+    targets = [tuple(target.split('=', 1)) for target in args.target] if args.target else DEFAULT_TARGETS
+    series = []
+    for job, source in targets:
+        if args.gpus and job == 'gpu-simulator':
+            continue
+        try:
+            series += read_target(job, source)
+        except OSError as e:
+            print(f"warning: skipping {job} ({source}): {e}", file=sys.stderr)
+    if args.gpus:
+        series += fleet_series(args.gpus)
+    store = build_store(series)
+    for rule in rules:
+        for labels in result_labels(rule.ast, store) or []:
+            store.add(dict(labels, __name__=rule.record), [])
+
+    scrape_interval = parse_duration(args.scrape_interval)
+    rules = plan(queries, rules, store, scrape_interval, args.min_samples)
+    print_report(queries, rules, store, scrape_interval, dashboards)
+
+    if args.write:
+        write_rules(args.rules, rules)
+        changed = write_dashboards(dashboards, queries)
+        alerts = write_alerts(args.alerts, queries)
+        print(f"\nWrote {len(rules)} rules to {os.path.relpath(args.rules)}, rewrote "
+              f"{', '.join(os.path.relpath(path) for path in changed) or 'no dashboards'} and {alerts} alerts",
+              file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Remote Write Receiver
+Minimal stand-in for a remote-write TSDB: accepts Prometheus remote-write
+requests, decodes them and counts what arrived, so the simulators' push
+mode (common/remote_write.py) can be tested without a real backend.
+
+Every request is snappy-decompressed and fully decoded, then thrown away.
+A report line every --report seconds shows requests, samples and bytes per
+second and how many distinct series have been seen. --fail-rate answers a
+share of requests with 503 to exercise the senders' retry and backoff,
+and --discard skips decoding to load-test the senders alone.
+The receiver's own counters are on /metrics.
+
+    python tools/remote_write_receiver.py --port 9201
+    REMOTE_WRITE_URL=http://localhost:9201/api/v1/write python simulators/gpu_simulator.py
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, generate_latest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+
+from remote_write import decode_write_request, decompress
+
+registry = CollectorRegistry()
+requests_total = Counter('remote_write_receiver_requests', 'Write requests by response code', ['code'],
+                         registry=registry)
+samples_total = Counter('remote_write_receiver_samples', 'Samples received', registry=registry)
+bytes_total = Counter('remote_write_receiver_bytes', 'Request bytes received, compressed and decoded',
+                      ['encoding'], registry=registry)
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = self.samples = self.compressed = self.decoded = self.rejected = 0
+        self.series = set()
+
+    def add(self, series, compressed, decoded):
+        with self.lock:
+            self.requests += 1
+            self.samples += sum(len(samples) for _, samples in series)
+            self.compressed += compressed
+            self.decoded += decoded
+            self.series.update(tuple(sorted(labels.items())) for labels, _ in series)
+
+    def totals(self):
+        with self.lock:
+            return self.requests, self.samples, self.compressed, self.decoded, self.rejected, len(self.series)
+
+
+def make_handler(stats, fail_rate, path, discard=False):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive, as remote-write senders expect
+
+        def _respond(self, code, body=b'', content_type='text/plain'):
+            requests_total.labels(str(code)).inc()
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if self.path != path:
+                return self._respond(404, b'not found')
+            if fail_rate and random.random() < fail_rate:
+                with stats.lock:
+                    stats.rejected += 1
+                return self._respond(503, b'injected failure')
+            if discard:
+                stats.add([], len(body), 0)
+                bytes_total.labels('compressed').inc(len(body))
+                return self._respond(204)
+            try:
+                data = decompress(body)
+                series = decode_write_request(data)
+            except Exception as e:
+                return self._respond(400, f'bad write request: {e}'.encode())
+            stats.add(series, len(body), len(data))
+            samples_total.inc(sum(len(samples) for _, samples in series))
+            bytes_total.labels('compressed').inc(len(body))
+            bytes_total.labels('decoded').inc(len(data))
+            self._respond(204)
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                return self._respond(200, generate_latest(registry), CONTENT_TYPE_LATEST)
+            self._respond(404, b'not found')
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def report(stats, interval):
+    last, last_time = stats.totals(), time.monotonic()
+    while True:
+        time.sleep(interval)
+        now, current = time.monotonic(), stats.totals()
+        elapsed = now - last_time
+        requests, samples, compressed, decoded = ((c - p) / elapsed for c, p in zip(current[:4], last[:4]))
+        print(f"{requests:8.1f} req/s {samples:11.0f} samples/s {compressed / 1e6:7.2f} MB/s "
+              f"({decoded / 1e6:.2f} MB/s decoded)  series={current[5]} rejected={current[4]}")
+        last, last_time = current, now
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=9201)
+    parser.add_argument('--path', default='/api/v1/write')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='share of requests answered with 503')
+    parser.add_argument('--discard', action='store_true', help='accept requests without decoding them')
+    parser.add_argument('--report', type=float, default=5.0, help='seconds between report lines')
+    args = parser.parse_args()
+
+    stats = Stats()
+    server = ThreadingHTTPServer(('', args.port), make_handler(stats, args.fail_rate, args.path, args.discard))
+    server.daemon_threads = True
+    threading.Thread(target=report, args=(stats, args.report), daemon=True).start()
+    print(f"Remote write receiver on :{args.port}{args.path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Shutting down receiver")
+
+
+if __name__ == '__main__':
+    main()
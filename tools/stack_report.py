@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Stack Health Report
+Containers, scrape health per job, per-target staleness, series cardinality
+and alerts from the Prometheus API in one report, without loading
+Prometheus the way system_report.sh used to.
+
+All API requests of a report go out at once over a small pool of
+keep-alive connections. Per-job scrape duration and sample counts are
+aggregated by Prometheus (`sum by (job)`), so the answer is one series per
+job however many targets there are. Cardinality comes from the TSDB head
+statistics (/api/v1/status/tsdb) instead of the whole __name__ value list.
+Responses are cached on disk for --ttl seconds (cardinality for at least a
+minute), so repeated runs and --watch reuse them instead of asking again.
+
+A target is stale when its last scrape is more than two scrape intervals
+old. Only down and stale targets are listed unless --all-targets is given.
+
+    python tools/stack_report.py
+    python tools/stack_report.py --watch 5 --top 20
+    python tools/fake_prometheus.py --targets 500 --latency 50 &
+    python tools/stack_report.py --prometheus http://localhost:9099 --no-docker
+"""
+
+import argparse
+import hashlib
+import http.client
+import json
+import os
+import queue
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlencode, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from promql import parse_duration
+
+PROMETHEUS_URL = os.environ.get('PROMETHEUS_URL', 'http://localhost:9090')
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'stack-report')
+CARDINALITY_TTL = 60.0
+STALE_INTERVALS = 2
+
+JOB_QUERIES = {
+    'samples': 'sum by (job) (scrape_samples_scraped)',
+    'avg_duration': 'avg by (job) (scrape_duration_seconds)',
+    'max_duration': 'max by (job) (scrape_duration_seconds)',
+}
+
+
+class PrometheusError(Exception):
+    pass
+
+
+class ResponseCache:
+    """API responses on disk, one JSON file per request, reused while younger than their TTL"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+    def get(self, key, ttl):
+        """(data, Unix time it was fetched) of a cached response, None if missing or too old"""
+        if ttl <= 0:
+            return None
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry['fetched'] >= ttl:
+            return None
+        with self._lock:
+            self.hits += 1
+        return entry['data'], entry['fetched']
+
+    def put(self, key, data, fetched):
+        os.makedirs(self.directory, exist_ok=True)
+        # Write and rename, so a concurrent run never reads half a file
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'fetched': fetched, 'data': data}, f)
+        os.replace(tmp, self._path(key))
+
+
+class PrometheusClient:
+    """Prometheus HTTP API over a pool of keep-alive connections"""
+
+    def __init__(self, url, connections=8, timeout=10.0, cache=None, ttl=0.0):
+        self.url = urlsplit(url)
+        self.timeout = timeout
+        self.cache = cache
+        self.ttl = ttl
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._idle = queue.LifoQueue()
+        self._executor = ThreadPoolExecutor(connections, thread_name_prefix='prometheus')
+
+    def _connect(self):
+        connection = http.client.HTTPSConnection if self.url.scheme == 'https' else http.client.HTTPConnection
+        return connection(self.url.hostname, self.url.port, timeout=self.timeout)
+
+    def _request(self, path):
+        try:
+            connection = self._idle.get_nowait()
+            reused = True
+        except queue.Empty:
+            connection, reused = self._connect(), False
+        try:
+            connection.request('GET', path, headers={'Accept': 'application/json'})
+            response = connection.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            if reused:
+                return self._request(path)  # the server closed an idle connection; retry on a new one
+            raise
+        self._idle.put(connection)
+        with self._lock:
+            self.requests += 1
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            raise PrometheusError(f"{path}: HTTP {response.status}, not a JSON response")
+        if payload.get('status') != 'success':
+            raise PrometheusError(f"{path}: {payload.get('errorType', response.status)}: {payload.get('error')}")
+        return payload['data']
+
+    def get(self, endpoint, params=None, ttl=None):
+        """(data, Unix time it was fetched) of an API response, from the cache when it is fresh enough"""
+        path = (self.url.path.rstrip('/') + endpoint) + ('?' + urlencode(params) if params else '')
+        key = f'{self.url.netloc}{path}'
+        ttl = self.ttl if ttl is None else ttl
+        if self.cache is not None:
+            cached = self.cache.get(key, ttl)
+            if cached is not None:
+                return cached
+        fetched = time.time()
+        data = self._request(path)
+        if self.cache is not None and ttl > 0:
+            self.cache.put(key, data, fetched)
+        return data, fetched
+
+    def submit(self, endpoint, params=None, ttl=None):
+        return self._executor.submit(self.get, endpoint, params, ttl)
+
+    def close(self):
+        self._executor.shutdown()
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+
+def docker_ps():
+    """(name, status) of the running containers, or None without docker"""
+    if shutil.which('docker') is None:
+        return None
+    result = subprocess.run(['docker', 'ps', '--format', '{{.Names}}\t{{.Status}}'],
+                            capture_output=True, text=True, timeout=10)
+    if result.returncode != 0:
+        return None
+    return sorted(tuple(line.split('\t', 1)) for line in result.stdout.splitlines() if '\t' in line)
+
+
+def collect(client, top, docker=True):
+    """Fetch everything a report needs, all requests in flight at once"""
+    started = time.perf_counter()
+    requests, hits = client.requests, client.cache.hits if client.cache is not None else 0
+    docker_pool = ThreadPoolExecutor(1)
+    containers = docker_pool.submit(docker_ps) if docker else None
+    futures = {
+        'targets': client.submit('/api/v1/targets', {'state': 'active'}),
+        'tsdb': client.submit('/api/v1/status/tsdb', {'limit': top}, ttl=max(client.ttl, CARDINALITY_TTL)),
+        'alerts': client.submit('/api/v1/alerts'),
+    }
+    for name, query in JOB_QUERIES.items():
+        futures[name] = client.submit('/api/v1/query', {'query': query})
+
+    report = {'time': time.time(), 'errors': {}, 'fetched': {}}
+    for name, future in futures.items():
+        try:
+            report[name], report['fetched'][name] = future.result()
+        except (OSError, http.client.HTTPException, PrometheusError) as e:
+            report[name] = None
+            report['errors'][name] = str(e)
+    report['containers'] = containers.result() if containers is not None else None
+    docker_pool.shutdown()
+    report['seconds'] = time.perf_counter() - started
+    report['requests'] = client.requests - requests
+    report['cached'] = (client.cache.hits if client.cache is not None else 0) - hits
+    return report
+
+
+_RFC3339 = re.compile(r'(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.(\d+))?(Z|[+-]\d\d:\d\d)$')
+
+
+def _staleness(target, now):
+    """Time since the target's last scrape in scrape intervals, None if it was never scraped"""
+    match = _RFC3339.match(target.get('lastScrape', ''))
+    if not match or match.group(1).startswith('0001-'):
+        return None
+    # Prometheus sends nanoseconds; fromisoformat takes at most microseconds
+    base, fraction, zone = match.groups()
+    scraped = datetime.fromisoformat(f"{base}.{(fraction or '')[:6].ljust(6, '0')}"
+                                     f"{'+00:00' if zone == 'Z' else zone}").timestamp()
+    return (now - scraped) / parse_duration(target.get('scrapeInterval', '15s'))
+
+
+def summarize(report):
+    """Per-job rows and the targets worth listing"""
+    jobs = {}
+    targets = []
+    for target in (report.get('targets') or {}).get('activeTargets', []):
+        job = target['labels'].get('job', target.get('scrapePool', '?'))
+        row = jobs.setdefault(job, {'targets': 0, 'up': 0, 'stale': 0})
+        row['targets'] += 1
+        row['up'] += target.get('health') == 'up'
+        # Measured from when the target list was fetched, which may be a cached response
+        intervals = _staleness(target, report['fetched'].get('targets', report['time']))
+        stale = intervals is None or intervals > STALE_INTERVALS
+        row['stale'] += stale
+        targets.append({
+            'job': job, 'instance': target['labels'].get('instance', target.get('scrapeUrl', '')),
+            'health': target.get('health'), 'stale': stale, 'intervals': intervals,
+            'duration': target.get('lastScrapeDuration'), 'error': target.get('lastError', ''),
+        })
+    for name in JOB_QUERIES:
+        for sample in (report.get(name) or {}).get('result', []):
+            job = sample['metric'].get('job', '')
+            jobs.setdefault(job, {'targets': 0, 'up': 0, 'stale': 0})[name] = float(sample['value'][1])
+    return jobs, targets
+
+
+def render(report, all_targets=False):
+    lines = ['=== Monitoring Stack Health Report ===',
+             f"Date: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(report['time']))}", '']
+
+    if report['containers'] is not None:
+        lines.append('Containers:')
+        width = max([len(name) for name, _ in report['containers']] + [4])
+        lines += [f"  {name:<{width}}  {status}" for name, status in report['containers']] or ['  (none running)']
+        lines.append('')
+
+    jobs, targets = summarize(report)
+    lines.append('Scrape health by job:')
+    width = max([len(job) for job in jobs] + [3])
+    lines.append(f"  {'job':<{width}} {'up':>4}/{'all':<4} {'stale':>6} {'samples':>9} {'avg scrape':>11} {'max scrape':>11}")
+    for job, row in sorted(jobs.items()):
+        samples = f"{row['samples']:.0f}" if 'samples' in row else '-'
+        durations = [f"{row[key] * 1000:.1f}ms" if key in row else '-' for key in ('avg_duration', 'max_duration')]
+        lines.append(f"  {job:<{width}} {row['up']:>4}/{row['targets']:<4} {row['stale']:>6} {samples:>9} "
+                     f"{durations[0]:>11} {durations[1]:>11}")
+    listed = [t for t in targets if all_targets or t['stale'] or t['health'] != 'up']
+    if listed:
+        lines += ['', 'Targets:' if all_targets else 'Down or stale targets:']
+        for target in sorted(listed, key=lambda t: (t['job'], t['instance'])):
+            age = f"{target['intervals']:.1f} intervals ago" if target['intervals'] is not None else 'never scraped'
+            error = f"  {target['error']}" if target['error'] else ''
+            lines.append(f"  {target['job']}/{target['instance']}: {target['health']}, last scrape {age}{error}")
+
+    tsdb = report.get('tsdb')
+    if tsdb:
+        head = tsdb.get('headStats', {})
+        names = next((item['value'] for item in tsdb.get('labelValueCountByLabelName', [])
+                      if item['name'] == '__name__'), None)
+        lines += ['', f"Series: {head.get('numSeries', '?')} in the head block"
+                      + (f", {names} metric names" if names is not None else '')]
+        by_metric = tsdb.get('seriesCountByMetricName', [])
+        if by_metric:
+            lines.append(f'Top {len(by_metric)} metrics by series:')
+            width = max(len(item['name']) for item in by_metric)
+            lines += [f"  {item['name']:<{width}} {item['value']:>8}" for item in by_metric]
+
+    alerts = (report.get('alerts') or {}).get('alerts')
+    if alerts is not None:
+        lines += ['', 'Alerts:']
+        lines += [f"  {a['labels'].get('alertname')}: {a['state']}"
+                  + ''.join(f" {k}={v}" for k, v in sorted(a['labels'].items()) if k not in ('alertname', 'severity'))
+                  for a in sorted(alerts, key=lambda a: (a['state'], sorted(a['labels'].items())))] \
+            or ['  (none)']
+
+    for name, error in sorted(report['errors'].items()):
+        lines.append(f"error: {name}: {error}")
+    lines += ['', f"Fetched in {report['seconds'] * 1000:.0f}ms: {report['requests']} requests, "
+                  f"{report['cached']} from cache"]
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--prometheus', default=PROMETHEUS_URL, help='Prometheus base URL')
+    parser.add_argument('--top', type=int, default=10, help='metrics to list by series count')
+    parser.add_argument('--connections', type=int, default=8, help='concurrent API requests')
+    parser.add_argument('--ttl', type=float, default=10.0, help='seconds to reuse cached responses (0 disables)')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--watch', type=float, metavar='SECONDS', help='redraw every SECONDS until interrupted')
+    parser.add_argument('--all-targets', action='store_true', help='list every target, not only down or stale ones')
+    parser.add_argument('--no-docker', action='store_true', help='skip the container list')
+    parser.add_argument('--json', action='store_true', help='print the raw report as JSON')
+    args = parser.parse_args()
+
+    cache = ResponseCache(args.cache_dir) if args.ttl > 0 else None
+    client = PrometheusClient(args.prometheus, connections=args.connections, cache=cache, ttl=args.ttl)
+    report = None
+    try:
+        while True:
+            report = collect(client, args.top, docker=not args.no_docker)
+            if args.json:
+                json.dump(report, sys.stdout, indent=2)
+                print()
+            else:
+                if args.watch:
+                    print('\033[H\033[2J', end='')  # clear the screen
+                print(render(report, args.all_targets), flush=True)
+            if not args.watch:
+                break
+            time.sleep(args.watch)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+    if report is not None and report['errors']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()